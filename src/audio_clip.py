@@ -1,8 +1,11 @@
 import logging
 from pathlib import Path
-from moviepy.editor import VideoFileClip, AudioFileClip
+from moviepy.editor import AudioFileClip, CompositeAudioClip
 
 from common import CLIPS_DIR, VOICES_DIR, AUDIO_CLIPS_DIR, configs, list_scenes
+from loudness import gain_to_target, limit_audio, load_stats
+from scene_state import SceneState, content_key
+from video_reader import open_video, log_peak_memory
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,6 +19,12 @@ def main():
     clip_vol = float(audio_cfg.get("clip_volume", 0.0)) # Mặc định tắt tiếng video gốc (nếu là ảnh thì ko có tiếng)
     voice_vol = float(audio_cfg.get("voice_volume", 1.5)) # Tăng voice lên chút cho to
 
+    # Chuẩn hoá loudness: gain tính từ thống kê voice.py đã ghi, không cần pass ffmpeg thứ 2
+    loud_cfg = configs.get("loudness", {})
+    normalize = loud_cfg.get("enabled", False)
+    target_lufs = float(loud_cfg.get("target_lufs", -16.0))
+    ceiling_db = float(loud_cfg.get("ceiling_db", -1.0))
+
     # Lấy danh sách scene từ folder CLIPS_DIR
     scenes = list_scenes(CLIPS_DIR)
     
@@ -23,6 +32,8 @@ def main():
         logger.error(f"No clips found in {CLIPS_DIR}. Did make_clip.py run correctly?")
         return
 
+    state = SceneState()
+
     for scene_dir in scenes:
         scene_name = scene_dir.name # scene_1
         
@@ -45,40 +56,53 @@ def main():
             logger.warning(f"{scene_name}: No voice audio found, skipping.")
             continue
 
+        # Scene không đổi (clip + voice + volume như lần trước) -> giữ final.mp4 cũ
+        out_path = AUDIO_CLIPS_DIR / scene_name / "final.mp4"
+        key = content_key(video_path, audio_path, clip_vol, voice_vol, normalize, target_lufs, ceiling_db)
+        if state.is_current("mix", scene_name, key, out_path):
+            logger.info(f"{scene_name}: unchanged, reusing {out_path.name}")
+            continue
+
         # 3. Trộn (Mix)
         try:
-            video = VideoFileClip(str(video_path))
-            voice = AudioFileClip(str(audio_path))
-
-            # Điều chỉnh âm lượng
-            if video.audio:
-                video = video.volumex(clip_vol)
-            
-            # Gán voice mới vào (giữ độ dài theo video)
-            final_audio = voice.volumex(voice_vol)
-            final_clip = video.set_audio(final_audio)
-
-            # 4. Xuất file
-            out_dir = AUDIO_CLIPS_DIR / scene_name
-            out_dir.mkdir(parents=True, exist_ok=True)
-            
-            out_path = out_dir / "final.mp4"
-            
-            final_clip.write_videofile(
-                str(out_path),
-                codec="libx264",
-                audio_codec="aac",
-                logger=None
-            )
-            logger.info(f"Mixed audio for {scene_name} -> {out_path}")
-            
-            # Close clips to free memory
-            video.close()
-            voice.close()
+            with open_video(video_path) as video:
+                voice = AudioFileClip(str(audio_path))
+
+                # Điều chỉnh âm lượng
+                if video.audio:
+                    video = video.volumex(clip_vol)
+
+                # Gán voice mới vào (giữ độ dài theo video)
+                voice_gain = voice_vol
+                if normalize:
+                    voice_gain *= gain_to_target(load_stats(audio_path), target_lufs)
+                final_audio = voice.volumex(voice_gain)
+                if normalize:
+                    voice_dur = final_audio.duration
+                    final_audio = final_audio.fl(lambda gf, t: limit_audio(gf, t, voice_dur, ceiling_db))
+                # Beat sync có thể kéo clip dài hơn voice -> phần cuối là lặng (chỉ còn nhạc nền)
+                if video.duration > final_audio.duration:
+                    final_audio = CompositeAudioClip([final_audio]).set_duration(video.duration)
+                final_clip = video.set_audio(final_audio)
+
+                # 4. Xuất file
+                out_path.parent.mkdir(parents=True, exist_ok=True)
+
+                final_clip.write_videofile(
+                    str(out_path),
+                    codec="libx264",
+                    audio_codec="aac",
+                    logger=None
+                )
+                logger.info(f"Mixed audio for {scene_name} -> {out_path}")
 
+                # Close clips to free memory
+                voice.close()
+            state.mark("mix", scene_name, key)
         except Exception as e:
             logger.error(f"Failed to mix {scene_name}: {e}")
 
+    log_peak_memory("audio_clip")
     logger.info("Audio mixing finished.")
 
 if __name__ == "__main__":
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Sinh nhiều trailer từ 1 manifest (nhiều game, hoặc nhiều plot / giọng / nhạc cho cùng 1 video).
+
+Manifest (YAML):
+
+    name: lol_launch              # thư mục batch: projects/lol_launch/
+    parallel: 3                   # số biến thể chạy đồng thời
+    configs:                      # ghi đè configs.yaml cho mọi biến thể
+      subplot: {n_subplots: 4}
+    variants:
+      - name: epic
+        video: videos/lol.mp4
+        plot: plots/epic.txt      # hoặc plot_text: "...", hoặc game: "League of Legends" (IGDB)
+        music: music/epic.wav     # hoặc music_prompt: "dark orchestral, choir"
+        configs:
+          voice: {reference_voice_path: voices/narrator_a.wav}
+
+Phần xử lý video (scene detection, trích frame, embedding; proxy / probe đã cache
+theo hash) chạy 1 lần cho mỗi video trong projects/<batch>/_shared_<hash>/ (hash của
+nội dung video + frame_sampling / frame_ranking / proxy) rồi
+được link sang từng biến thể; phần text / voice / render chạy song song theo biến thể.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import yaml
+
+from common import ROOT, configs, file_fingerprint, merge_configs
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SRC = ROOT / "src"
+PROJECTS_ROOT = ROOT / configs.get("project_dir", "projects")
+
+# Output của frame.py + image_retrieval.py --stage embed, dùng chung giữa các biến thể
+SHARED_OUTPUTS = ["frames", "frame_catalog.sqlite", "frame_embeddings.pt", "embed_stats.json", "frame_index"]
+SHARED_STEPS = ["frame", "embed"]
+# Key cấu hình ảnh hưởng tới output dùng chung -> chỉ được đặt ở cấp batch
+VIDEO_SIDE_KEYS = {"frame_sampling", "frame_ranking", "proxy"}
+
+# Các biến thể luôn phân tích video_input.mp4 của chính project, không tải lại
+FORCED_CONFIGS = {"video_inputs": [], "video_retrieval": {"progressive": False}}
+
+
+def resolve(path) -> Path:
+    path = Path(path)
+    return path if path.is_absolute() else ROOT / path
+
+
+def load_manifest(path: Path) -> dict:
+    manifest = yaml.safe_load(Path(path).read_text(encoding="utf-8")) or {}
+    variants = manifest.get("variants") or []
+    if not variants:
+        raise ValueError(f"No variants in {path}")
+    names = [v.get("name") for v in variants]
+    if None in names or len(set(names)) != len(names):
+        raise ValueError("Every variant needs a unique 'name'")
+    for v in variants:
+        if "video" not in v:
+            raise ValueError(f"Variant '{v['name']}' has no 'video'")
+        if not resolve(v["video"]).exists():
+            raise FileNotFoundError(f"Variant '{v['name']}': video not found: {v['video']}")
+        shared_keys = VIDEO_SIDE_KEYS & set(v.get("configs") or {})
+        if shared_keys:
+            raise ValueError(f"Variant '{v['name']}' overrides {', '.join(sorted(shared_keys))}; "
+                             "video analysis is shared, set these in the manifest-level 'configs'")
+    manifest.setdefault("name", Path(path).stem)
+    return manifest
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    """
+    Hard link (không tốn dung lượng), khác ổ đĩa thì copy. Chỉ dùng cho file
+    các bước sau chỉ đọc (video nguồn, frame, embedding).
+    """
+    src, dst = Path(src), Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists() or dst.is_symlink():
+        if dst.is_dir() and not dst.is_symlink():
+            shutil.rmtree(dst)
+        else:
+            dst.unlink()
+    if src.is_dir():
+        shutil.copytree(src, dst, copy_function=link_or_copy)
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def run_script(project: str, script: str, *args, log_path: Path = None) -> int:
+    """Chạy 1 script trong src/ cho project (TRAILER_PROJECT), log ra file."""
+    env = dict(os.environ, TRAILER_PROJECT=project)
+    cmd = [sys.executable, str(SRC / script), *args]
+    with open(log_path or os.devnull, "a", encoding="utf-8") as log:
+        return subprocess.run(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+def fetch_game_plots(manifest: dict) -> dict:
+    """Plot IGDB cho các biến thể chỉ ghi 'game' (1 lượt multiquery cho cả batch)."""
+    games = [v["game"] for v in manifest["variants"]
+             if v.get("game") and not (v.get("plot") or v.get("plot_text"))]
+    if not games:
+        return {}
+    from plot_igdb import IGDBClient
+
+    igdb = manifest.get("igdb", {})
+    client_id = igdb.get("client_id") or os.environ.get("IGDB_CLIENT_ID", "")
+    token = igdb.get("access_token") or os.environ.get("IGDB_ACCESS_TOKEN", "")
+    if not client_id or not token:
+        raise ValueError("Variants use 'game' but no IGDB credentials (manifest igdb: or IGDB_CLIENT_ID / IGDB_ACCESS_TOKEN)")
+    plots = IGDBClient(client_id, token).fetch_plots(games)
+    missing = [g for g, found in plots.items() if found is None]
+    if missing:
+        raise ValueError(f"No IGDB plot for: {', '.join(missing)}")
+    return {game: found[0] for game, found in plots.items()}
+
+
+class Variant:
+    def __init__(self, batch: str, spec: dict, base_configs: dict):
+        self.spec = spec
+        self.name = spec["name"]
+        self.project = f"{batch}/{self.name}"
+        self.dir = PROJECTS_ROOT / self.project
+        self.video = resolve(spec["video"])
+        self.configs = merge_configs(merge_configs(base_configs, spec.get("configs") or {}), FORCED_CONFIGS)
+        if spec.get("music_prompt") and not spec.get("music"):
+            # Nhạc sinh trong DAG sau bước voice để dài đúng bằng trailer
+            self.configs = merge_configs(self.configs, {"music": {"in_pipeline": True}})
+        self.result = {"variant": self.name, "project": self.project, "status": "pending"}
+
+    def prepare(self, game_plots: dict) -> None:
+        """
+        Tạo project: video, plot, nhạc và configs.yaml riêng. Marker của lần chạy batch
+        trước bị xoá để mọi bước chạy lại trên input mới; các bước theo scene vẫn tự
+        bỏ qua scene không đổi (scene_state.py) và LLM / nhạc dùng lại cache.
+        """
+        self.dir.mkdir(parents=True, exist_ok=True)
+        for marker in (self.dir / ".checkpoints").glob("*.done"):
+            marker.unlink()
+        link_or_copy(self.video, self.dir / "video_input.mp4")
+
+        if self.spec.get("plot_text"):
+            plot = self.spec["plot_text"]
+        elif self.spec.get("plot"):
+            plot = resolve(self.spec["plot"]).read_text(encoding="utf-8")
+        elif self.spec.get("game"):
+            plot = game_plots[self.spec["game"]]
+        else:
+            raise ValueError(f"Variant '{self.name}' needs 'plot', 'plot_text' or 'game'")
+        (self.dir / "input_plot.txt").write_text(plot.strip() + "\n", encoding="utf-8")
+
+        # Nhạc của lần chạy trước (manifest đã đổi) không được dùng lại
+        music_path = self.dir / "background_music.wav"
+        for stale in (music_path, self.dir / "music_prompt.txt",
+                      self.dir / "background_music.loudness.json", self.dir / "background_music.beats.json"):
+            stale.unlink(missing_ok=True)
+        if self.spec.get("music"):
+            link_or_copy(resolve(self.spec["music"]), music_path)
+        if self.spec.get("music_prompt"):
+            (self.dir / "music_prompt.txt").write_text(self.spec["music_prompt"], encoding="utf-8")
+
+        (self.dir / "configs.yaml").write_text(
+            yaml.safe_dump(self.configs, allow_unicode=True, sort_keys=False), encoding="utf-8"
+        )
+
+    def attach_shared(self, shared_dir: Path) -> None:
+        """Link output phân tích video dùng chung + đánh dấu frame/embed đã xong."""
+        for name in SHARED_OUTPUTS:
+            src = shared_dir / name
+            if not src.exists():
+                continue
+            dst = self.dir / name
+            if name.endswith(".sqlite"):
+                # rank / clip có thể ghi vào catalog -> mỗi biến thể 1 bản riêng
+                if dst.exists():
+                    dst.unlink()
+                shutil.copy2(src, dst)
+            else:
+                link_or_copy(src, dst)
+        checkpoints = self.dir / ".checkpoints"
+        checkpoints.mkdir(parents=True, exist_ok=True)
+        for step in SHARED_STEPS:
+            (checkpoints / f"{step}.done").touch()
+
+    def run(self) -> dict:
+        log_path = self.dir / ".batch.log"
+        t0 = time.time()
+        code = run_script(self.project, "trailer_generator.py", log_path=log_path)
+        if code != 0:
+            self.result.update(status="failed", failed_at="trailer_generator.py", log=str(log_path))
+        else:
+            self.result["status"] = "done"
+
+        self.result["wall_sec"] = round(time.time() - t0, 2)
+        # Chỉ trailer của lần chạy này
+        trailers = sorted((p for p in (self.dir / "trailers").glob("*.mp4") if p.stat().st_mtime >= t0),
+                          key=lambda p: p.stat().st_mtime)
+        if self.result["status"] == "done" and trailers:
+            from video_probe import probe_video
+
+            duration = probe_video(trailers[-1]).duration
+            self.result.update(trailer=str(trailers[-1]), trailer_sec=round(duration, 2),
+                               trailer_sec_per_wall_sec=round(duration / max(self.result["wall_sec"], 1e-6), 4))
+        return self.result
+
+
+def shared_key(fingerprint: str, base_configs: dict) -> str:
+    """Nội dung video + cấu hình phía video (root configs.yaml + manifest) -> tên thư mục dùng chung."""
+    effective = merge_configs(configs, base_configs)
+    video_side = json.dumps({k: effective.get(k) for k in sorted(VIDEO_SIDE_KEYS)}, sort_keys=True, default=str)
+    return hashlib.sha1(f"{fingerprint}|{video_side}".encode("utf-8")).hexdigest()[:16]
+
+
+def run_shared_analysis(batch: str, key: str, video: Path, base_configs: dict) -> tuple:
+    """
+    frame + embed 1 lần cho mỗi video (bỏ qua nếu đã có từ lần chạy batch trước với
+    cùng video và cùng cấu hình frame_sampling / frame_ranking / proxy).
+    """
+    project = f"{batch}/_shared_{key}"
+    shared_dir = PROJECTS_ROOT / project
+    checkpoints = shared_dir / ".checkpoints"
+    if all((checkpoints / f"{s}.done").exists() for s in SHARED_STEPS):
+        logger.info(f"[batch] Reusing video analysis for {video.name} ({project})")
+        return shared_dir, 0.0
+
+    shared_dir.mkdir(parents=True, exist_ok=True)
+    link_or_copy(video, shared_dir / "video_input.mp4")
+    (shared_dir / "configs.yaml").write_text(
+        yaml.safe_dump(merge_configs(base_configs, FORCED_CONFIGS), allow_unicode=True, sort_keys=False),
+        encoding="utf-8",
+    )
+    checkpoints.mkdir(parents=True, exist_ok=True)
+
+    t0 = time.time()
+    log_path = shared_dir / ".batch.log"
+    logger.info(f"[batch] Analysing {video.name} once for all its variants...")
+    for step, args in (("frame", ["frame.py"]), ("embed", ["image_retrieval.py", "--stage", "embed"])):
+        if run_script(project, *args, log_path=log_path) != 0:
+            raise RuntimeError(f"Shared {step} step failed for {video.name}, see {log_path}")
+        (checkpoints / f"{step}.done").touch()
+    return shared_dir, time.time() - t0
+
+
+def print_report(report: dict) -> None:
+    print(f"\n{'variant':<24} {'status':<8} {'wall s':>8} {'trailer s':>10} {'x realtime':>10}")
+    for r in report["variants"]:
+        print(f"{r['variant']:<24} {r['status']:<8} {r.get('wall_sec', 0):>8.1f} "
+              f"{r.get('trailer_sec', 0):>10.1f} {r.get('trailer_sec_per_wall_sec', 0):>10.3f}")
+    agg = report["aggregate"]
+    print(f"\n{agg['done']}/{agg['variants']} variants in {agg['wall_sec']:.1f}s "
+          f"(shared video analysis {agg['shared_analysis_sec']:.1f}s) | "
+          f"{agg['variants_per_hour']:.1f} variants/h | "
+          f"{agg['trailer_sec_per_wall_sec']:.3f} trailer s per wall s | "
+          f"speedup vs serial {agg['speedup_vs_serial']:.2f}x")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate many trailer variants from a manifest.")
+    ap.add_argument("manifest", help="YAML manifest of variants")
+    ap.add_argument("--parallel", type=int, default=None, help="Variants rendered at the same time")
+    ap.add_argument("--only", default=None, help="Comma-separated variant names to run")
+    args = ap.parse_args()
+
+    manifest = load_manifest(Path(args.manifest))
+    batch = manifest["name"]
+    base_configs = manifest.get("configs") or {}
+    parallel = int(args.parallel or manifest.get("parallel", 2))
+
+    variants = [Variant(batch, spec, base_configs) for spec in manifest["variants"]]
+    if args.only:
+        keep = set(args.only.split(","))
+        variants = [v for v in variants if v.name in keep]
+
+    t_start = time.time()
+    game_plots = fetch_game_plots(manifest)
+    for v in variants:
+        v.prepare(game_plots)
+
+    # Gom biến thể theo nội dung video (không theo tên file)
+    groups = {}
+    for v in variants:
+        groups.setdefault(file_fingerprint(v.video), []).append(v)
+    logger.info(f"[batch] {len(variants)} variants over {len(groups)} distinct videos, {parallel} in parallel")
+
+    shared_sec = 0.0
+    # Phân tích video nặng GPU/CPU -> lần lượt từng video; biến thể của video nào
+    # xong phân tích thì được đưa vào pool render ngay
+    with ThreadPoolExecutor(max_workers=1) as analysis_pool, \
+            ThreadPoolExecutor(max_workers=parallel) as render_pool:
+        analyses = {
+            analysis_pool.submit(run_shared_analysis, batch, shared_key(fp, base_configs),
+                                 members[0].video, base_configs): members
+            for fp, members in groups.items()
+        }
+        renders = {}
+        for fut in as_completed(analyses):
+            members = analyses[fut]
+            try:
+                shared_dir, sec = fut.result()
+            except Exception as e:
+                logger.error(f"[batch] {e}")
+                for v in members:
+                    v.result.update(status="failed", failed_at="shared analysis")
+                continue
+            shared_sec += sec
+            for v in members:
+                v.attach_shared(shared_dir)
+                renders[render_pool.submit(v.run)] = v
+        for fut in as_completed(renders):
+            r = fut.result()
+            logger.info(f"[batch] {r['variant']}: {r['status']} in {r.get('wall_sec', 0):.1f}s")
+
+    wall = time.time() - t_start
+    results = [v.result for v in variants]
+    done = [r for r in results if r["status"] == "done"]
+    trailer_sec = sum(r.get("trailer_sec", 0) for r in done)
+    serial_sec = shared_sec * len(variants) / max(len(groups), 1) + sum(r.get("wall_sec", 0) for r in results)
+    report = {
+        "batch": batch,
+        "variants": results,
+        "aggregate": {
+            "variants": len(results),
+            "done": len(done),
+            "distinct_videos": len(groups),
+            "parallel": parallel,
+            "wall_sec": round(wall, 2),
+            "shared_analysis_sec": round(shared_sec, 2),
+            "variants_per_hour": round(len(done) * 3600 / max(wall, 1e-6), 2),
+            "trailer_sec": round(trailer_sec, 2),
+            "trailer_sec_per_wall_sec": round(trailer_sec / max(wall, 1e-6), 4),
+            # Ước lượng: mỗi biến thể tự phân tích video + render lần lượt
+            "speedup_vs_serial": round(serial_sec / max(wall, 1e-6), 2),
+        },
+    }
+    report_path = PROJECTS_ROOT / batch / "batch_report.json"
+    report_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print_report(report)
+    print(f"\nReport saved to: {report_path}")
+    return 0 if len(done) == len(results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,208 @@
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import numpy as np
+import scipy.fft
+from scipy.ndimage import uniform_filter1d
+from scipy.signal import find_peaks, resample_poly
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Phân tích ở ~11 kHz là đủ cho onset / tempo (hạ mẫu theo hệ số nguyên, nhanh hơn ~4 lần)
+ANALYSIS_SR = 11025
+N_FFT = 1024
+HOP = 256            # ~23 ms / frame
+
+
+@dataclass
+class BeatGrid:
+    tempo_bpm: float
+    period: float            # giây giữa 2 beat
+    offset: float            # thời điểm beat đầu tiên (giây)
+    duration: float
+    beats: list = field(default_factory=list)    # lưới beat đều: offset + k * period
+    onsets: list = field(default_factory=list)   # onset thật (đỉnh spectral flux)
+    source_size: int = 0     # để biết file nhạc đã bị ghi đè sau khi phân tích
+    source_mtime: float = 0.0
+
+    def snap_up(self, t: float, max_shift: float) -> float:
+        """Beat đầu tiên >= t nếu cách t không quá max_shift, ngược lại giữ t."""
+        beats = np.asarray(self.beats)
+        i = np.searchsorted(beats, t - 1e-6)
+        if i < len(beats) and beats[i] - t <= max_shift:
+            return float(max(beats[i], t))
+        return t
+
+
+# --------------------------------------------------
+# Onset envelope + tempo + pha beat (vector hoá toàn bộ, không lặp theo frame)
+# --------------------------------------------------
+def onset_envelope(samples: np.ndarray, sr: int):
+    """Spectral flux (log-magnitude, chỉ phần tăng) theo frame; trả về (envelope, frame_rate)."""
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim > 1:
+        samples = samples @ np.full(samples.shape[1], 1.0 / samples.shape[1], dtype=np.float32)
+    q = max(1, int(round(sr / ANALYSIS_SR)))
+    if q > 1:
+        samples = resample_poly(samples, 1, q).astype(np.float32)
+    frame_rate = sr / q / HOP
+    samples = np.pad(samples, N_FFT // 2)  # frame i có tâm tại i * HOP
+
+    n_frames = 1 + (len(samples) - N_FFT) // HOP
+    if n_frames < 2:
+        return np.zeros(max(n_frames, 0), dtype=np.float32), frame_rate
+    frames = np.lib.stride_tricks.as_strided(
+        samples, shape=(n_frames, N_FFT), strides=(samples.strides[0] * HOP, samples.strides[0])
+    )
+    mag = np.abs(scipy.fft.rfft(frames * np.hanning(N_FFT).astype(np.float32), axis=1))
+    log_mag = np.log1p(100.0 * mag)
+
+    flux = np.maximum(np.diff(log_mag, axis=0), 0.0).sum(axis=1)
+    flux = np.concatenate([[0.0], flux])
+    # Bỏ phần nền thay đổi chậm (crescendo) để chỉ còn các nhịp đánh
+    env = np.maximum(flux - uniform_filter1d(flux, size=16), 0.0)
+    peak = env.max()
+    return (env / peak if peak > 0 else env).astype(np.float32), frame_rate
+
+
+def estimate_tempo(env: np.ndarray, frame_rate: float, min_bpm: float = 60.0, max_bpm: float = 200.0,
+                   prior_bpm: float = 120.0) -> float:
+    """
+    Tempo từ autocorrelation của onset envelope (tính qua FFT), nhân với prior
+    log-Gauss quanh prior_bpm để tránh nhầm sang nửa / gấp đôi tempo.
+    Trả về chu kỳ beat tính theo frame (số thực).
+    """
+    n = len(env)
+    spec = np.fft.rfft(env - env.mean(), 2 * n)
+    # Chia cho số mẫu chồng nhau: lag lớn không bị thiệt so với lag nhỏ
+    acf = np.fft.irfft(spec * np.conj(spec))[:n] / np.arange(n, 0, -1)
+
+    min_lag = max(1, int(np.floor(60.0 * frame_rate / max_bpm)))
+    max_lag = min(n - 1, int(np.ceil(60.0 * frame_rate / min_bpm)))
+    if max_lag <= min_lag:
+        return 60.0 * frame_rate / prior_bpm
+    lags = np.arange(min_lag, max_lag + 1)
+    bpm = 60.0 * frame_rate / lags
+    weights = np.exp(-0.5 * (np.log2(bpm / prior_bpm) / 1.0) ** 2)
+    period = float(lags[int(np.argmax(acf[lags] * weights))])
+
+    # Chu kỳ sai 1/10 frame đã lệch cả beat sau vài phút: tinh chỉnh bằng đỉnh ACF
+    # tại các bội m * period (độ phân giải ~1/m frame). Cửa sổ tìm đỉnh hẹp hơn
+    # 1/4 chu kỳ để không bắt nhầm đỉnh nửa beat (off-beat).
+    half_width = int(np.clip(period / 4, 1, 3))
+    m = 1
+    while True:
+        center = int(round(m * period))
+        lo, hi = max(1, center - half_width), min(n - 2, center + half_width)
+        if hi <= lo:
+            break
+        peak = lo + int(np.argmax(acf[lo:hi + 1]))
+        a, b, c = acf[peak - 1:peak + 2]
+        denom = a - 2 * b + c
+        period = (peak + (0.5 * (a - c) / denom if denom < 0 else 0.0)) / m
+        if m * 2 * period >= n / 2:
+            break
+        m *= 2
+    return period
+
+
+def beat_phase(env: np.ndarray, period: float) -> float:
+    """Pha (frame) của lưới beat: tổng envelope tại phase + k * period lớn nhất."""
+    n_phases = max(1, int(np.ceil(period)))
+    k = np.arange(int((len(env) - 1) // period) + 1)
+    idx = np.rint(np.arange(n_phases)[:, None] + k[None, :] * period).astype(int)
+    valid = idx < len(env)
+    scores = np.where(valid, env[np.minimum(idx, len(env) - 1)], 0.0).sum(axis=1)
+    best = int(np.argmax(scores))
+    if n_phases < 3:
+        return float(best)
+    # Nội suy parabol (điểm số tuần hoàn theo pha) -> pha chính xác dưới 1 frame
+    a, b, c = scores[best - 1], scores[best], scores[(best + 1) % n_phases]
+    denom = a - 2 * b + c
+    return float(best + (0.5 * (a - c) / denom if denom < 0 else 0.0)) % period
+
+
+def analyze(samples: np.ndarray, sr: int, min_bpm: float = 60.0, max_bpm: float = 200.0) -> BeatGrid:
+    duration = len(samples) / sr
+    env, frame_rate = onset_envelope(samples, sr)
+    if len(env) < 4 or env.max() <= 0:
+        return BeatGrid(tempo_bpm=0.0, period=0.0, offset=0.0, duration=duration)
+
+    period = estimate_tempo(env, frame_rate, min_bpm, max_bpm)
+    # Cửa sổ FFT (tâm tại frame) "thấy" onset sớm hơn ~nửa cửa sổ trừ 1 hop -> bù lại
+    lag = (N_FFT // 2 - HOP) / HOP
+    phase = (beat_phase(env, period) + lag) % period
+    beats = (phase + np.arange(int((len(env) - 1 - phase) // period) + 1) * period) / frame_rate
+
+    peaks, _ = find_peaks(env, height=env.mean() + env.std(), distance=max(1, int(0.05 * frame_rate)))
+    return BeatGrid(
+        tempo_bpm=round(60.0 * frame_rate / period, 3),
+        period=period / frame_rate,
+        offset=phase / frame_rate,
+        duration=duration,
+        beats=np.round(beats, 4).tolist(),
+        onsets=np.round((peaks + lag) / frame_rate, 4).tolist(),
+    )
+
+
+def best_offset(cut_times, grid: BeatGrid, steps: int = 200) -> float:
+    """
+    Độ lệch bắt đầu nhạc (0..period) sao cho các điểm cắt rơi gần beat nhất
+    (khoảng cách trung bình tới beat gần nhất, tính cho mọi ứng viên 1 lần).
+    """
+    if grid.period <= 0 or len(cut_times) == 0:
+        return 0.0
+    offsets = np.linspace(0.0, grid.period, steps, endpoint=False)
+    # Lưới đều -> khoảng cách tới beat gần nhất chỉ phụ thuộc pha theo modulo period
+    phase = (np.asarray(cut_times)[None, :] + offsets[:, None] - grid.offset) % grid.period
+    dist = np.minimum(phase, grid.period - phase).mean(axis=1)
+    return float(offsets[int(np.argmin(dist))])
+
+
+# --------------------------------------------------
+# Sidecar <audio>.beats.json, cùng kiểu với <audio>.loudness.json
+# --------------------------------------------------
+def grid_path(audio_path: Path) -> Path:
+    audio_path = Path(audio_path)
+    return audio_path.with_name(audio_path.stem + ".beats.json")
+
+
+def analyze_file(audio_path: Path, min_bpm: float = 60.0, max_bpm: float = 200.0) -> BeatGrid:
+    import soundfile as sf
+
+    samples, sr = sf.read(str(audio_path), dtype="float32", always_2d=False)
+    grid = analyze(samples, sr, min_bpm, max_bpm)
+    st = Path(audio_path).stat()
+    grid.source_size, grid.source_mtime = st.st_size, st.st_mtime
+    grid_path(audio_path).write_text(json.dumps(asdict(grid)), encoding="utf-8")
+    return grid
+
+
+def load_beat_grid(audio_path: Path, min_bpm: float = 60.0, max_bpm: float = 200.0) -> BeatGrid:
+    """Đọc sidecar; nếu thiếu hoặc nhạc đã đổi thì phân tích lại."""
+    audio_path = Path(audio_path)
+    path = grid_path(audio_path)
+    if path.exists():
+        try:
+            grid = BeatGrid(**json.loads(path.read_text(encoding="utf-8")))
+            st = audio_path.stat()
+            if grid.source_size == st.st_size and grid.source_mtime == st.st_mtime:
+                return grid
+        except Exception:
+            pass
+    logger.info(f"Analysing beats: {audio_path.name}")
+    return analyze_file(audio_path, min_bpm, max_bpm)
+
+
+def music_beat_grid(music_path: Path, cfg: dict):
+    """Lưới beat của nhạc nền nếu bật beat_sync và nhạc đã có; ngược lại None."""
+    if not cfg.get("enabled", False) or not Path(music_path).exists():
+        return None
+    grid = load_beat_grid(music_path, float(cfg.get("min_bpm", 60)), float(cfg.get("max_bpm", 200)))
+    if grid.period <= 0:
+        logger.warning(f"No beat found in {Path(music_path).name}, cuts are not snapped")
+        return None
+    return grid
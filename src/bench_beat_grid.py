@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import numpy as np
+
+from beat_grid import analyze
+
+
+def synthetic_track(bpm: float, seconds: float, sr: int, offset: float = 0.3, seed: int = 0):
+    """Track giả: kick trên mỗi beat, hi-hat ở nửa beat, nền nhiễu. Trả về (stereo, beat_times)."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    mono = 0.05 * rng.standard_normal(n).astype(np.float32)
+    beats = np.arange(offset, seconds, 60.0 / bpm)
+
+    kick_len, hat_len = int(0.05 * sr), int(0.02 * sr)
+    t = np.arange(kick_len) / sr
+    kick = (0.8 * np.sin(2 * np.pi * 60 * t) * np.exp(-t / 0.01)).astype(np.float32)
+    hat = (0.15 * rng.standard_normal(hat_len) * np.exp(-np.arange(hat_len) / (0.003 * sr))).astype(np.float32)
+    for starts, sound in ((beats, kick), (beats + 30.0 / bpm, hat)):
+        idx = (starts * sr).astype(int)
+        for i in idx[idx + len(sound) < n]:
+            mono[i:i + len(sound)] += sound
+    return np.stack([mono, mono], axis=1), beats
+
+
+def beat_error(found, truth):
+    """Khoảng cách từ mỗi beat thật tới beat tìm được gần nhất (giây)."""
+    found = np.asarray(found)
+    if len(found) == 0:
+        return np.full(len(truth), np.inf)
+    i = np.clip(np.searchsorted(found, truth), 1, len(found) - 1)
+    return np.minimum(np.abs(found[i] - truth), np.abs(found[i - 1] - truth))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Speed / accuracy benchmark of beat_grid.analyze.")
+    ap.add_argument("--minutes", type=float, nargs="+", default=[1, 3, 5, 10])
+    ap.add_argument("--bpm", type=float, nargs="+", default=[90, 128, 140.7])
+    ap.add_argument("--sr", type=int, default=44100)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--audio", default=None, help="Time a real audio file instead of synthetic tracks")
+    args = ap.parse_args()
+
+    if args.audio:
+        import soundfile as sf
+
+        samples, sr = sf.read(args.audio, dtype="float32")
+        start = time.perf_counter()
+        grid = analyze(samples, sr)
+        elapsed = time.perf_counter() - start
+        print(f"{args.audio}: {len(samples) / sr:.1f}s audio | {elapsed * 1000:.0f} ms "
+              f"(x{len(samples) / sr / elapsed:.0f} realtime) | tempo {grid.tempo_bpm:.2f} BPM "
+              f"| {len(grid.beats)} beats, {len(grid.onsets)} onsets")
+        return
+
+    print(f"sr={args.sr} stereo | best of {args.repeat} runs")
+    for minutes in args.minutes:
+        for bpm in args.bpm:
+            samples, truth = synthetic_track(bpm, minutes * 60, args.sr)
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                grid = analyze(samples, args.sr)
+                times.append(time.perf_counter() - start)
+            best = min(times)
+            err = beat_error(grid.beats, truth)
+            # Nửa / gấp đôi tempo vẫn đúng pha nên vẫn dùng được để snap cắt
+            print(
+                f"{minutes:4.0f} min {bpm:6.1f} BPM: {best * 1000:7.0f} ms (x{minutes * 60 / best:5.0f} realtime) "
+                f"| tempo {grid.tempo_bpm:7.2f} | beat error median {np.median(err) * 1000:5.1f} ms, "
+                f"p95 {np.percentile(err, 95) * 1000:5.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from sentence_transformers import SentenceTransformer
+
+from clip_onnx import OnnxClipImageEncoder
+from common import FRAMES_DIR, SUBPLOTS_DIR, configs
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def timed(fn, n_images):
+    start = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - start
+    return out, n_images / elapsed
+
+
+def topk_agreement(ref: np.ndarray, test: np.ndarray, queries: np.ndarray, k: int) -> float:
+    """Tỉ lệ trùng top-k trung bình giữa 2 bộ embedding với cùng các query text."""
+    ref_top = np.argsort(-(queries @ ref.T), axis=1)[:, :k]
+    test_top = np.argsort(-(queries @ test.T), axis=1)[:, :k]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, test_top)]))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Accuracy + throughput of ONNX CLIP image encoders vs PyTorch fp32.")
+    ap.add_argument("--frames", default=str(FRAMES_DIR), help="Folder with extracted .jpg frames")
+    ap.add_argument("--limit", type=int, default=256)
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--query", action="append", help="Text query (defaults to project subplots)")
+    args = ap.parse_args()
+
+    paths = sorted(Path(args.frames).rglob("*.jpg"))[:args.limit]
+    if not paths:
+        raise SystemExit(f"No frames found in {args.frames}. Run frame.py first.")
+    images = [Image.open(p).convert("RGB") for p in paths]
+
+    queries = args.query or [p.read_text(encoding="utf-8").strip() for p in sorted(SUBPLOTS_DIR.glob("scene_*/subplot.txt"))]
+    if not queries:
+        queries = ["a team fight in a game", "a character casting a spell", "a loading screen"]
+
+    model_id = configs["frame_ranking"]["model_id"]
+    model = SentenceTransformer(model_id, device="cpu")
+    q_emb = normalize(model.encode(queries, convert_to_numpy=True, show_progress_bar=False))
+
+    print(f"Model: {model_id} | frames: {len(images)} | queries: {len(queries)} | k={args.k}")
+
+    ref, ref_fps = timed(
+        lambda: model.encode(images, batch_size=args.batch_size, convert_to_numpy=True, show_progress_bar=False),
+        len(images),
+    )
+    ref = normalize(ref)
+    print(f"torch fp32 : {ref_fps:7.1f} frames/s")
+
+    for name, quantized in (("onnx fp32", False), ("onnx int8", True)):
+        encoder = OnnxClipImageEncoder(model, model_id, quantized=quantized)
+        emb, fps = timed(lambda: encoder.encode(images, args.batch_size), len(images))
+        emb = normalize(emb)
+        cos = np.sum(ref * emb, axis=1)
+        agree = topk_agreement(ref, emb, q_emb, min(args.k, len(images)))
+        print(
+            f"{name:<11}: {fps:7.1f} frames/s (x{fps / ref_fps:.2f}) | cosine vs fp32 mean={cos.mean():.4f} "
+            f"min={cos.min():.4f} | top-{args.k} agreement={agree:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
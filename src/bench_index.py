@@ -0,0 +1,72 @@
+import argparse
+import time
+
+import numpy as np
+
+from vector_index import ExactIndex, IVFIndex
+
+
+def synthetic_embeddings(n: int, dim: int, n_clusters: int = 512, seed: int = 0) -> np.ndarray:
+    """Embedding giả có cấu trúc cụm (giống frame của nhiều cảnh / video)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    return centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def load_embeddings(path: str) -> np.ndarray:
+    import torch
+
+    return torch.load(path)["emb"].float().numpy()
+
+
+def timed_search(index, queries, k):
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    return ids, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Recall / latency benchmark: IVF index vs brute force.")
+    ap.add_argument("--n", type=int, default=200_000, help="Number of synthetic vectors")
+    ap.add_argument("--dim", type=int, default=512)
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--n-lists", type=int, default=1024)
+    ap.add_argument("--n-probe", type=int, nargs="+", default=[4, 8, 16, 32])
+    ap.add_argument("--emb", default=None, help="Use a saved frame_embeddings.pt instead of synthetic data")
+    args = ap.parse_args()
+
+    data = load_embeddings(args.emb) if args.emb else synthetic_embeddings(args.n, args.dim)
+    n, dim = data.shape
+    rng = np.random.default_rng(1)
+    queries = data[rng.choice(n, args.queries, replace=False)] + 0.1 * rng.standard_normal(
+        (args.queries, dim)
+    ).astype(np.float32)
+    ids = np.arange(n)
+
+    print(f"Vectors: {n} x {dim} | queries: {args.queries} | k={args.k}")
+
+    exact = ExactIndex(dim)
+    exact.add(data, ids)
+    truth, exact_ms = timed_search(exact, queries, args.k)
+    print(f"exact          : {exact_ms:8.2f} ms/query | recall@{args.k} = 1.000")
+
+    start = time.perf_counter()
+    ivf = IVFIndex(dim, n_lists=args.n_lists)
+    ivf.train(data[rng.choice(n, min(n, args.n_lists * 39), replace=False)])
+    ivf.add(data, ids)
+    print(f"ivf build      : {time.perf_counter() - start:8.2f} s ({len(ivf.centroids)} lists)")
+
+    for n_probe in args.n_probe:
+        ivf.n_probe = n_probe
+        found, ivf_ms = timed_search(ivf, queries, args.k)
+        recall = np.mean([len(set(f) & set(t)) / args.k for f, t in zip(found, truth)])
+        print(
+            f"ivf n_probe={n_probe:<3}: {ivf_ms:8.2f} ms/query | recall@{args.k} = {recall:.3f} "
+            f"| speedup x{exact_ms / ivf_ms:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
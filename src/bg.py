@@ -1,18 +1,10 @@
-import os
 import json
+import asyncio
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import google.generativeai as genai
-from moviepy.editor import (
-    VideoFileClip,
-    AudioFileClip,
-    CompositeAudioClip,
-    TextClip,
-    ColorClip,
-    CompositeVideoClip,
-    concatenate_videoclips,
-)
-
 from TTS.api import TTS
 from common import (
     ROOT,
@@ -21,7 +13,12 @@ from common import (
     VOICES_DIR,
     TRAILER_DIR,
     configs,
+    get_ffmpeg_exe,
 )
+from llm_client import make_client
+from subplot import INTRO_OUTRO_PATH, generate_intro_outro_async
+from loudness import gain_to_target, load_stats
+from text_card import create_text_card
 
 N_SUBPLOTS = configs["subplot"]["n_subplots"]
 INTRO_DIR = PROJECT_DIR / "intro"
@@ -31,6 +28,10 @@ ASSETS_MUSIC_DIR = ROOT / "assets" / "music"
 MAIN_TRAILER_PATH = TRAILER_DIR / "trailer_1.mp4"
 FINAL_TRAILER_PATH = TRAILER_DIR / "trailer_ai_final.mp4"
 
+# Khung hình chung của bản cuối (intro/outro là 1920x1080, trailer được scale + pad)
+FINAL_SIZE = (1920, 1080)
+FINAL_FPS = 30
+
 INTRO_DIR.mkdir(parents=True, exist_ok=True)
 OUTRO_DIR.mkdir(parents=True, exist_ok=True)
 ASSETS_MUSIC_DIR.mkdir(parents=True, exist_ok=True)
@@ -45,91 +46,37 @@ def load_all_subplots():
     return "\n\n".join(texts)
 
 
-def configure_gemini():
-    if "GEMINI_API_KEY" not in os.environ:
-        raise RuntimeError(
-            "Bạn chưa đặt biến môi trường GEMINI_API_KEY.\n"
-            "Hãy chạy:\n\nexport GEMINI_API_KEY=\"YOUR_API_KEY\"\n"
-        )
-    genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-
-
 def call_gemini_for_intro_outro(plot_text: str) -> dict:
-    configure_gemini()
-
-    model = genai.GenerativeModel("gemini-1.5-flash")
-
-    prompt = f"""
-You are an expert cinematic trailer narrator.
-Read this game plot and produce:
+    # subplot.py đã sinh intro/outro song song với subplot -> dùng lại nếu có
+    if INTRO_OUTRO_PATH.exists():
+        return json.loads(INTRO_OUTRO_PATH.read_text(encoding="utf-8"))
 
-1. "tone": Emotional tone (few words)
-2. "intro_text": 7–12 sec spoken intro
-3. "outro_text": 5–9 sec spoken outro
-4. "music_style": type of music fitting the trailer
-
-Return ONLY JSON.
-
-Plot:
-\"\"\"
-{plot_text}
-\"\"\"
-"""
-
-    response = model.generate_content(
-        prompt,
-        generation_config={"temperature": 0.9, "max_output_tokens": 500},
-    )
-
-    text = response.text.strip()
-
-    try:
-        return json.loads(text)
-    except:
-        start = text.find("{")
-        end = text.rfind("}")
-        if start == -1 or end == -1:
-            raise RuntimeError(f"Gemini trả về JSON sai:\n{text}")
-        return json.loads(text[start:end+1])
+    return asyncio.run(generate_intro_outro_async(make_client(), plot_text))
 
 
 def get_tts():
-    tts = TTS(model_id=configs["voice"]["model_id"]).to(configs["voice"]["device"])
+    tts = TTS(model_name=configs["voice"]["model_id"]).to(configs["voice"]["device"])
     return tts
 
 
+# Model TTS không an toàn khi gọi từ nhiều thread -> intro/outro lần lượt dùng chung 1 model
+_tts_lock = threading.Lock()
+
+
 def tts_to_file(tts, text, out):
     out.parent.mkdir(parents=True, exist_ok=True)
-    tts.tts_to_file(text=text, file_path=str(out))
+    with _tts_lock:
+        tts.tts_to_file(
+            text=text,
+            speaker_wav=configs["voice"]["reference_voice_path"],
+            language=configs["voice"]["tts_language"],
+            file_path=str(out),
+        )
 
 
 def create_text_video(text, audio_path, out_path, style="dark"):
-    audio = AudioFileClip(str(audio_path))
-    dur = audio.duration
-
-    if style == "light":
-        bg_color = (240, 240, 240)
-        text_color = "black"
-    else:
-        bg_color = (0, 0, 0)
-        text_color = "white"
-
-    w, h = 1920, 1080
-
-    bg = ColorClip(size=(w, h), duration=dur, color=bg_color)
-    txt = TextClip(
-        text,
-        fontsize=60,
-        color=text_color,
-        method="caption",
-        size=(int(w * 0.8), None),
-        align="center",
-    ).set_position("center").set_duration(dur).fadein(0.8).fadeout(0.8)
-
-    video = CompositeVideoClip([bg, txt]).set_audio(audio)
-
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    video.write_videofile(str(out_path), fps=30, codec="libx264", audio_codec="aac")
+    # Vẽ chữ 1 lần bằng Pillow, ffmpeg lặp ảnh tĩnh + fade (không cần ImageMagick)
+    create_text_card(text, audio_path, out_path, style=style, size=(1920, 1080), fps=30, fade_sec=0.8)
 
 
 def choose_music(music_style):
@@ -145,72 +92,109 @@ def choose_music(music_style):
     return candidates[0]
 
 
-def add_music(video_path, music_path, out_path, vol=0.12):
-    video = VideoFileClip(str(video_path))
-    voice_audio = video.audio
-
-    music = AudioFileClip(str(music_path)).volumex(vol)
-
-    if music.duration < video.duration:
-        loops = (video.duration // music.duration) + 1
-        from moviepy.editor import concatenate_audioclips
-        music = concatenate_audioclips([music] * int(loops))
+def prepare_music(music_style):
+    """Chọn file nhạc + tính gain (từ thống kê loudness nếu bật). Trả về (path, gain) hoặc None."""
+    music_file = choose_music(music_style)
+    if not music_file:
+        return None
 
-    music = music.subclip(0, video.duration)
-    final_audio = CompositeAudioClip([voice_audio, music])
+    loud_cfg = configs.get("loudness", {})
+    if loud_cfg.get("enabled", False):
+        music_target = float(loud_cfg.get("target_lufs", -16.0)) - float(loud_cfg.get("music_below_voice_lu", 14.0))
+        try:
+            return music_file, gain_to_target(load_stats(music_file), music_target)
+        except Exception as e:
+            print(f"Cannot measure loudness of {music_file.name}: {e}")
+    return music_file, 0.12
+
+
+def final_encode(videos, out_path, music=None):
+    """
+    Một lần encode duy nhất: scale/pad mọi video về FINAL_SIZE, concat, trộn nhạc
+    (lặp bằng -stream_loop, cắt theo độ dài video) rồi ghi ra out_path.
+    """
+    w, h = FINAL_SIZE
+    cmd = [get_ffmpeg_exe(), "-y", "-loglevel", "error"]
+    for v in videos:
+        cmd += ["-i", str(v)]
+
+    filters = []
+    for i in range(len(videos)):
+        filters.append(
+            f"[{i}:v]scale={w}:{h}:force_original_aspect_ratio=decrease,"
+            f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={FINAL_FPS},format=yuv420p[v{i}]"
+        )
+        filters.append(f"[{i}:a]aresample=44100,aformat=channel_layouts=stereo[a{i}]")
+    concat_inputs = "".join(f"[v{i}][a{i}]" for i in range(len(videos)))
+    filters.append(f"{concat_inputs}concat=n={len(videos)}:v=1:a=1[v][a]")
+
+    audio_out = "[a]"
+    if music is not None:
+        music_file, gain = music
+        m = len(videos)
+        cmd += ["-stream_loop", "-1", "-i", str(music_file)]
+        filters.append(f"[{m}:a]aresample=44100,aformat=channel_layouts=stereo,volume={gain:.4f}[m]")
+        filters.append("[a][m]amix=inputs=2:duration=first:normalize=0[mix]")
+        audio_out = "[mix]"
+        loud_cfg = configs.get("loudness", {})
+        if loud_cfg.get("enabled", False):
+            limit = 10 ** (float(loud_cfg.get("ceiling_db", -1.0)) / 20)
+            filters.append(f"[mix]alimiter=limit={limit:.4f}[out]")
+            audio_out = "[out]"
+
+    cmd += [
+        "-filter_complex", ";".join(filters),
+        "-map", "[v]", "-map", audio_out,
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "20",
+        "-c:a", "aac", "-b:a", "192k",
+        "-movflags", "+faststart",
+        str(out_path),
+    ]
+    subprocess.run(cmd, check=True)
 
-    final = video.set_audio(final_audio)
-    final.write_videofile(str(out_path), codec="libx264", audio_codec="aac")
 
 def main():
     print("Đang load subplot...")
     plot = load_all_subplots()
 
-    print("Đang gọi Gemini để tạo intro/outro…")
-    gem = call_gemini_for_intro_outro(plot)
+    # Load model TTS song song với lúc chờ Gemini
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        tts_future = pool.submit(get_tts)
 
-    tone = gem["tone"]
-    intro_text = gem["intro_text"]
-    outro_text = gem["outro_text"]
-    music_style = gem["music_style"]
+        print("Đang gọi Gemini để tạo intro/outro…")
+        gem = call_gemini_for_intro_outro(plot)
 
-    print("Intro:", intro_text)
-    print("Outro:", outro_text)
-    print("Music:", music_style)
+        tone = gem["tone"]
+        intro_text = gem["intro_text"]
+        outro_text = gem["outro_text"]
+        music_style = gem["music_style"]
 
-    print("Đang TTS intro/outro...")
-    tts = get_tts()
-    intro_wav = INTRO_DIR / "intro.wav"
-    outro_wav = OUTRO_DIR / "outro.wav"
+        print("Intro:", intro_text)
+        print("Outro:", outro_text)
+        print("Music:", music_style)
 
-    tts_to_file(tts, intro_text, intro_wav)
-    tts_to_file(tts, outro_text, outro_wav)
+        style = "light" if "light" in tone.lower() else "dark"
+        intro_wav, intro_mp4 = INTRO_DIR / "intro.wav", INTRO_DIR / "intro.mp4"
+        outro_wav, outro_mp4 = OUTRO_DIR / "outro.wav", OUTRO_DIR / "outro.mp4"
 
-    print("Đang tạo video intro/outro...")
-    style = "light" if "light" in tone.lower() else "dark"
+        # Task graph: tts(intro) -> card(intro), tts(outro) -> card(outro), music độc lập.
+        # TTS dùng chung model nên chạy lần lượt; card intro render trong lúc TTS outro.
+        music_future = pool.submit(prepare_music, music_style)
 
-    intro_mp4 = INTRO_DIR / "intro.mp4"
-    outro_mp4 = OUTRO_DIR / "outro.mp4"
+        def make_card(text, wav, mp4):
+            tts_to_file(tts_future.result(), text, wav)
+            create_text_video(text, wav, mp4, style)
+            return mp4
 
-    create_text_video(intro_text, intro_wav, intro_mp4, style)
-    create_text_video(outro_text, outro_wav, outro_mp4, style)
+        print("Đang TTS + tạo video intro/outro...")
+        intro_future = pool.submit(make_card, intro_text, intro_wav, intro_mp4)
+        outro_future = pool.submit(make_card, outro_text, outro_wav, outro_mp4)
 
-    print("Đang ghép intro + trailer + outro...")
-    intro_clip = VideoFileClip(str(intro_mp4))
-    main_clip = VideoFileClip(str(MAIN_TRAILER_PATH))
-    outro_clip = VideoFileClip(str(outro_mp4))
+        videos = [intro_future.result(), MAIN_TRAILER_PATH, outro_future.result()]
+        music = music_future.result()
 
-    merged = concatenate_videoclips([intro_clip, main_clip, outro_clip], method="compose")
-
-    mid_path = TRAILER_DIR / "trailer_nomusic.mp4"
-    merged.write_videofile(str(mid_path), codec="libx264", audio_codec="aac")
-
-    print("Đang thêm nhạc nền...")
-    music_file = choose_music(music_style)
-    if music_file:
-        add_music(mid_path, music_file, FINAL_TRAILER_PATH)
-    else:
-        mid_path.rename(FINAL_TRAILER_PATH)
+    print("Đang ghép intro + trailer + outro" + (" + nhạc nền..." if music else "..."))
+    final_encode(videos, FINAL_TRAILER_PATH, music)
 
     print("Done! Trailer cuối cùng:")
     print(FINAL_TRAILER_PATH)
@@ -0,0 +1,111 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from common import CACHE_DIR, configs
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ONNX_CACHE_DIR = CACHE_DIR / "onnx"
+
+# frame_ranking.backend -> có quantize int8 hay không
+ONNX_BACKENDS = {"onnx": False, "onnx-int8": True}
+
+
+class _ImageTower(torch.nn.Module):
+    """Chỉ phần ảnh của CLIP: pixel_values -> image_embeds (giống SentenceTransformer)."""
+
+    def __init__(self, clip_model):
+        super().__init__()
+        self.clip_model = clip_model
+
+    def forward(self, pixel_values):
+        return self.clip_model.get_image_features(pixel_values=pixel_values)
+
+
+def export_image_tower(st_model, out_path: Path) -> Path:
+    """Export CLIP image tower của SentenceTransformer sang ONNX (batch động)."""
+    clip_model = st_model[0].model
+    image_size = clip_model.config.vision_config.image_size
+    tower = _ImageTower(clip_model).cpu().eval()
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    dummy = torch.randn(1, 3, image_size, image_size)
+    logger.info(f"Exporting CLIP image tower to ONNX: {out_path.name}")
+    torch.onnx.export(
+        tower,
+        (dummy,),
+        str(out_path),
+        input_names=["pixel_values"],
+        output_names=["image_embeds"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+        opset_version=14,
+    )
+    return out_path
+
+
+def quantize_int8(fp32_path: Path, int8_path: Path) -> Path:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    logger.info(f"Quantizing (dynamic int8): {int8_path.name}")
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    return int8_path
+
+
+class OnnxClipImageEncoder:
+    """
+    Encoder ảnh CLIP chạy bằng ONNX Runtime trên CPU (fp32 hoặc int8).
+    Model ONNX được export một lần và cache trong .cache/onnx/.
+    """
+
+    def __init__(self, st_model, model_id: str, quantized: bool = True, num_threads: int | None = None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("ONNX backend requires onnxruntime. Run: pip install onnx onnxruntime")
+
+        safe_id = model_id.replace("/", "_")
+        fp32_path = ONNX_CACHE_DIR / f"{safe_id}_image_fp32.onnx"
+        int8_path = ONNX_CACHE_DIR / f"{safe_id}_image_int8.onnx"
+
+        if not fp32_path.exists():
+            export_image_tower(st_model, fp32_path)
+        if quantized and not int8_path.exists():
+            quantize_int8(fp32_path, int8_path)
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.model_path = int8_path if quantized else fp32_path
+        self.session = ort.InferenceSession(
+            str(self.model_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.processor = st_model[0].processor
+        logger.info(f"ONNX image encoder ready: {self.model_path.name}")
+
+    def preprocess(self, images) -> np.ndarray:
+        return self.processor(images=images, return_tensors="np")["pixel_values"].astype(np.float32)
+
+    def infer(self, pixel_values: np.ndarray) -> np.ndarray:
+        return self.session.run(["image_embeds"], {"pixel_values": pixel_values})[0]
+
+    def encode(self, images, batch_size: int = 32) -> np.ndarray:
+        out = [
+            self.infer(self.preprocess(images[i:i + batch_size]))
+            for i in range(0, len(images), batch_size)
+        ]
+        return np.concatenate(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+
+def load_image_encoder(st_model):
+    """Encoder ONNX theo frame_ranking.backend, hoặc None nếu dùng PyTorch."""
+    ranking_cfg = configs["frame_ranking"]
+    backend = ranking_cfg.get("backend", "torch")
+    if backend == "torch":
+        return None
+    if backend not in ONNX_BACKENDS:
+        raise ValueError(f"Unknown frame_ranking.backend: {backend}")
+    return OnnxClipImageEncoder(st_model, ranking_cfg["model_id"], quantized=ONNX_BACKENDS[backend])
@@ -1,5 +1,7 @@
+import os
 import yaml
 import shutil
+import hashlib
 import logging
 from pathlib import Path
 
@@ -41,16 +43,40 @@ def parse_configs(configs_path: Path):
 # 1. Load các cấu hình cơ bản
 configs = parse_configs(CONFIGS_PATH)
 
+def merge_configs(base: dict, override: dict) -> dict:
+    """Gộp override vào base theo từng key lồng nhau (dict con được gộp, giá trị khác bị thay)."""
+    merged = dict(base)
+    for key, value in (override or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_configs(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
 # =========================================================
 # CẤU HÌNH ĐƯỜNG DẪN (ĐỒNG BỘ VỚI UI)
 # =========================================================
 project_dir_name = configs.get("project_dir", "projects")
-project_name = configs.get("project_name", "LOL")
+# TRAILER_PROJECT: chạy nhiều project song song (batch_generate.py) mà không sửa configs.yaml
+project_name = os.environ.get("TRAILER_PROJECT") or configs.get("project_name", "LOL")
 
 PROJECT_DIR = ROOT / project_dir_name / project_name
+
+# Cấu hình riêng của project (vd. giọng đọc / nhạc của 1 biến thể), ghi đè configs.yaml gốc
+PROJECT_CONFIGS_PATH = PROJECT_DIR / "configs.yaml"
+if PROJECT_CONFIGS_PATH.exists():
+    configs = merge_configs(configs, parse_configs(PROJECT_CONFIGS_PATH))
+
 VIDEO_PATH = PROJECT_DIR / "video_input.mp4"
 
 configs["video_path"] = str(VIDEO_PATH) 
+
+# Nhiều video nguồn: `video_inputs` trong configs (đường dẫn tương đối theo ROOT),
+# mặc định chỉ dùng video_input.mp4 của project
+VIDEO_INPUTS = [
+    p if p.is_absolute() else ROOT / p
+    for p in (Path(v) for v in configs.get("video_inputs") or [])
+] or [VIDEO_PATH]
 configs["project_dir"] = project_dir_name
 configs["project_name"] = project_name
 configs.setdefault("voice", {})
@@ -71,6 +97,9 @@ TRAILER_DIR = PROJECT_DIR / "trailers"
 # Cập nhật frames_dir vào config cho image_retrieval.py
 configs["frames_dir"] = str(FRAMES_DIR)
 
+# Cache dùng chung giữa các project (proxy video, ...)
+CACHE_DIR = ROOT / ".cache"
+
 def ensure_directories():
     """Tạo tất cả các thư mục cần thiết nếu chưa có."""
     dirs = [
@@ -89,11 +118,23 @@ def ensure_directories():
 # Tạo thư mục ngay khi import file này
 ensure_directories()
 
-def clean_project_data():
+def clean_project_data(scenes=None):
     """
     Hàm dọn dẹp dữ liệu cũ trước khi chạy mới.
     Giữ lại video gốc và plot đầu vào.
+    scenes: chỉ xoá voice / clip / audio_clip của các scene này (vd. ["scene_2"])
+    để lần chạy tới làm lại riêng chúng, các scene khác được dùng lại.
     """
+    if scenes:
+        logger.info(f"--- CLEANING SCENE OUTPUTS: {', '.join(scenes)} ---")
+        for scene_name in scenes:
+            for folder in (VOICES_DIR, CLIPS_DIR, AUDIO_CLIPS_DIR):
+                scene_dir = folder / scene_name
+                if scene_dir.exists():
+                    shutil.rmtree(scene_dir, ignore_errors=True)
+                    logger.info(f"Deleted: {folder.name}/{scene_name}")
+        return
+
     logger.info("--- CLEANING UP OLD PROJECT DATA ---")
     
     targets = [
@@ -115,21 +156,45 @@ def clean_project_data():
         
         # Tạo lại thư mục rỗng ngay lập tức
         folder.mkdir(parents=True, exist_ok=True)
+
+    # Không còn output nào để dùng lại
+    state_path = PROJECT_DIR / ".scene_state.json"
+    if state_path.exists():
+        state_path.unlink()
     
     logger.info("--- CLEANUP COMPLETED ---\n")
 
 def get_fps(video_path: Path):
-    """Lấy FPS của video dùng MoviePy."""
+    """FPS của video, đọc từ probe cache (video_probe.py) thay vì mở VideoFileClip."""
     try:
-        from moviepy.editor import VideoFileClip
-        clip = VideoFileClip(str(video_path))
-        fps = clip.fps
-        clip.close()
-        return fps
+        from video_probe import probe_video
+        return probe_video(video_path).fps
     except Exception as e:
         logger.error(f"Error loading FPS: {e}")
         return 24  # Fallback mặc định
 
+def get_ffmpeg_exe() -> str:
+    """Return the ffmpeg binary bundled with imageio-ffmpeg, or the one on PATH."""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+def file_fingerprint(path: Path, sample_size: int = 1 << 20) -> str:
+    """
+    Hash nhanh cho file video lớn: size + 3 mẫu (đầu / giữa / cuối).
+    Đủ để phân biệt các video input mà không phải đọc hết vài GB.
+    """
+    path = Path(path)
+    size = path.stat().st_size
+    h = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in (0, max(0, size // 2 - sample_size // 2), max(0, size - sample_size)):
+            f.seek(offset)
+            h.update(f.read(sample_size))
+    return h.hexdigest()[:16]
+
 def list_scenes(folder: Path):
     """
     Trả về danh sách các thư mục scene (ví dụ: scene_1, scene_2) đã được sắp xếp.
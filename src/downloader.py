@@ -0,0 +1,351 @@
+import hashlib
+import json
+import logging
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+
+from common import CACHE_DIR, configs
+from mp4_index import top_level_layout
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CACHE_DIR = CACHE_DIR / "downloads"
+
+
+class IntegrityError(ValueError):
+    """File tải về sai kích thước hoặc sai sha256."""
+
+
+@dataclass
+class RemoteInfo:
+    size: int             # 0 = server không báo Content-Length
+    accepts_ranges: bool
+    etag: str = ""
+
+
+class Transport:
+    """
+    Lớp truyền tải mà Downloader dùng; thay bằng bản khác (vd. server HTTP local
+    khi kiểm thử) mà không phải sửa logic chia chunk / resume / cache.
+    """
+
+    def probe(self, url: str) -> RemoteInfo:
+        raise NotImplementedError
+
+    def read_range(self, url: str, start: int, end=None):
+        """Các block bytes từ start tới end (bao gồm end); end=None -> tới hết file."""
+        raise NotImplementedError
+
+
+class RequestsTransport(Transport):
+    """HTTP qua 1 requests.Session (giữ kết nối, pool đủ cho số worker)."""
+
+    def __init__(self, session=None, pool_size: int = 8, timeout: float = 30.0, block_size: int = 1 << 16):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.timeout = timeout
+        self.block_size = block_size
+
+    def probe(self, url: str) -> RemoteInfo:
+        # Một số CDN không trả Content-Length cho HEAD -> hỏi thử 1 byte bằng Range
+        with self.session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            etag = r.headers.get("ETag", "")
+            if r.status_code == 206 and "/" in r.headers.get("Content-Range", ""):
+                total = r.headers["Content-Range"].rsplit("/", 1)[1]
+                return RemoteInfo(int(total) if total.isdigit() else 0, True, etag)
+            return RemoteInfo(int(r.headers.get("Content-Length") or 0), False, etag)
+
+    def read_range(self, url: str, start: int, end=None):
+        headers = {}
+        if start or end is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            if headers and r.status_code != 206:
+                raise IOError(f"Server ignored Range request ({r.status_code})")
+            yield from r.iter_content(self.block_size)
+
+
+def sha256_file(path: Path, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _write_json(path: Path, data: dict) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    tmp.replace(path)
+
+
+def _replace(src: Path, dst: Path, timeout: float = 30.0) -> None:
+    """os.replace, chờ thêm khi file đang bị tiến trình khác mở (Windows không cho rename)."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            src.replace(dst)
+            return
+        except PermissionError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def progress_path_for(dest: Path) -> Path:
+    """Sidecar của file đang tải progressive: <dest>.progress"""
+    dest = Path(dest)
+    return dest.with_name(dest.name + ".progress")
+
+
+def read_progress(dest: Path):
+    """
+    Trạng thái tải progressive của dest, None nếu không có download nào đang chạy:
+    path (file đang ghi), size, available (số byte liên tục từ đầu file đã có),
+    layout (xem mp4_index.top_level_layout), ts (lần cập nhật cuối).
+    """
+    try:
+        return json.loads(progress_path_for(dest).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+class ProgressPublisher:
+    """Cập nhật <dest>.progress mỗi khi phần liên tục ở đầu file dài thêm."""
+
+    def __init__(self, dest: Path, part_path: Path, size: int):
+        self.path = progress_path_for(dest)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.part_path = part_path
+        self.size = size
+        self.layout = None
+        self.available = -1
+
+    def update(self, available: int) -> None:
+        if available <= self.available:
+            return
+        self.available = available
+        if self.layout is None and available > 0:
+            self.layout = top_level_layout(self.part_path, available)
+        _write_json(self.path, {
+            "path": str(self.part_path), "size": self.size,
+            "available": available, "layout": self.layout, "ts": time.time(),
+        })
+
+    def close(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+class Downloader:
+    """
+    Tải file theo các chunk Range song song vào .cache/downloads/ (khóa theo URL).
+    - Cache: URL đã tải xong chỉ copy ra đích, không tải lại cho project mới.
+    - Resume: chunk đã xong được ghi vào <key>.state.json, lần sau chỉ tải chunk còn thiếu.
+    - Integrity: mỗi chunk phải đủ số byte, cả file được kiểm tra kích thước + sha256.
+    """
+
+    def __init__(self, transport: Transport = None, cache_dir: Path = DOWNLOAD_CACHE_DIR,
+                 workers: int = None, chunk_size: int = None, retries: int = None):
+        cfg = configs.get("video_retrieval", {}).get("download", {})
+        self.workers = int(workers or cfg.get("workers", 4))
+        self.chunk_size = int(chunk_size or float(cfg.get("chunk_mb", 8)) * (1 << 20))
+        self.retries = int(retries if retries is not None else cfg.get("retries", 3))
+        self.transport = transport or RequestsTransport(pool_size=self.workers)
+        self.cache_dir = Path(cache_dir)
+
+    def _paths(self, key: str):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+        base = self.cache_dir / name
+        return base.with_suffix(".bin"), base.with_suffix(".json"), base.with_suffix(".part"), base.with_suffix(".state.json")
+
+    def cached(self, key: str, sha256: str = None):
+        """File trong cache nếu còn nguyên vẹn (đúng kích thước / hash đã ghi), ngược lại None."""
+        data_path, meta_path, _, _ = self._paths(key)
+        if not (data_path.exists() and meta_path.exists()):
+            return None
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except ValueError:
+            return None
+        st = data_path.stat()
+        if st.st_size != meta["size"] or (sha256 and sha256.lower() != meta["sha256"]):
+            return None
+        if st.st_mtime != meta.get("mtime"):
+            # File cache bị đụng tới -> băm lại trước khi tin
+            if sha256_file(data_path) != meta["sha256"]:
+                return None
+            meta["mtime"] = st.st_mtime
+            _write_json(meta_path, meta)
+        return data_path
+
+    def fetch(self, url: str, dest: Path = None, sha256: str = None, cache_key: str = None,
+              progressive: bool = False) -> Path:
+        """
+        Tải url (hoặc lấy từ cache) rồi copy ra dest nếu có; trả về đường dẫn file.
+        cache_key: khóa cache thay cho url, dùng khi url là link ký tạm thời
+        (vd. stream YouTube) còn nội dung thì cố định theo link gốc.
+        progressive: ghi <dest>.progress trong lúc tải để bước sau đọc dần phần đầu file
+        (chunk được tải theo thứ tự nên phần liên tục từ đầu file tăng đều).
+        """
+        key = cache_key or url
+        path = self.cached(key, sha256)
+        publisher = None
+        if path is not None:
+            logger.info(f"Using cached download: {path.name}")
+        else:
+            if progressive and dest is not None:
+                publisher = lambda part_path, size: ProgressPublisher(dest, part_path, size)
+            path = self._download(url, key, sha256, publisher)
+
+        if dest is None:
+            return path
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # Copy (không hard link): project có thể ghi đè video_input.mp4 tại chỗ
+        tmp = dest.with_name(dest.name + ".tmp")
+        shutil.copyfile(path, tmp)
+        tmp.replace(dest)
+        # dest đã hoàn chỉnh -> bước đọc progressive chuyển sang đọc dest
+        progress_path_for(dest).unlink(missing_ok=True)
+        return dest
+
+    def _download(self, url: str, key: str, sha256: str = None, publisher=None) -> Path:
+        data_path, meta_path, part_path, state_path = self._paths(key)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        info = self.transport.probe(url)
+
+        state = None
+        if state_path.exists() and part_path.exists():
+            try:
+                state = json.loads(state_path.read_text(encoding="utf-8"))
+            except ValueError:
+                state = None
+        if not state or state["size"] != info.size or state["chunk_size"] != self.chunk_size \
+                or (info.etag and state.get("etag") and info.etag != state["etag"]):
+            state = {"key": key, "size": info.size, "etag": info.etag, "chunk_size": self.chunk_size, "done": []}
+            part_path.unlink(missing_ok=True)
+
+        progress = publisher(part_path, info.size) if publisher else None
+        try:
+            if info.accepts_ranges and info.size > 0:
+                self._fetch_chunks(url, info.size, part_path, state, state_path, progress)
+            else:
+                logger.info("Server does not support ranges, downloading in one stream")
+                self._fetch_stream(url, part_path, progress)
+        except Exception:
+            if progress:
+                progress.close()
+            raise
+
+        size = part_path.stat().st_size
+        digest = sha256_file(part_path)
+        if (info.size and size != info.size) or (sha256 and digest != sha256.lower()):
+            part_path.unlink(missing_ok=True)
+            state_path.unlink(missing_ok=True)
+            if progress:
+                progress.close()
+            raise IntegrityError(f"Downloaded file does not match (size {size}/{info.size}, sha256 {digest})")
+
+        # Bước progressive có thể vẫn đang mở .part để đọc nốt các frame cuối
+        _replace(part_path, data_path, timeout=600.0 if progress else 30.0)
+        state_path.unlink(missing_ok=True)
+        _write_json(meta_path, {
+            "url": url, "key": key, "size": size, "sha256": digest,
+            "etag": info.etag, "mtime": data_path.stat().st_mtime,
+        })
+        logger.info(f"Download complete: {size / (1 << 20):.1f} MB")
+        return data_path
+
+    def _fetch_chunks(self, url, size, part_path, state, state_path, progress=None):
+        n_chunks = (size + self.chunk_size - 1) // self.chunk_size
+        done = set(state["done"])
+        pending = [i for i in range(n_chunks) if i not in done]
+        if done:
+            logger.info(f"Resuming download: {len(done)}/{n_chunks} chunks already on disk")
+        if not part_path.exists():
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+        _write_json(state_path, state)
+
+        lock = threading.Lock()
+
+        def publish():
+            if progress is None:
+                return
+            contiguous = 0
+            while contiguous in done:
+                contiguous += 1
+            progress.update(min(contiguous * self.chunk_size, size))
+
+        publish()
+
+        def fetch_chunk(i):
+            start = i * self.chunk_size
+            end = min(start + self.chunk_size, size) - 1
+            length = end + 1 - start
+            for attempt in range(self.retries + 1):
+                try:
+                    written = 0
+                    with open(part_path, "r+b") as f:
+                        f.seek(start)
+                        for block in self.transport.read_range(url, start, end):
+                            # Server gửi thừa (bỏ qua Range end) -> bỏ phần thừa, không ghi đè chunk sau
+                            block = block[: length - written]
+                            f.write(block)
+                            written += len(block)
+                            if written >= length:
+                                break
+                    if written < length:
+                        raise IOError(f"Chunk {i} truncated ({written}/{length} bytes)")
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        raise
+                    logger.warning(f"Chunk {i} failed ({e}), retrying...")
+                    time.sleep(min(2 ** attempt, 10))
+            with lock:
+                state["done"].append(i)
+                done.add(i)
+                _write_json(state_path, state)
+                publish()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(fetch_chunk, i) for i in pending]
+            for n, fut in enumerate(as_completed(futures), 1):
+                fut.result()
+                if n % max(1, len(futures) // 10) == 0:
+                    logger.info(f"Downloaded {n_chunks - len(pending) + n}/{n_chunks} chunks")
+
+    def _fetch_stream(self, url, part_path, progress=None):
+        for attempt in range(self.retries + 1):
+            try:
+                written = 0
+                with open(part_path, "wb") as f:
+                    for block in self.transport.read_range(url, 0):
+                        f.write(block)
+                        written += len(block)
+                        if progress and written - progress.available >= self.chunk_size:
+                            f.flush()
+                            progress.update(written)
+                if progress:
+                    progress.update(written)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Download failed ({e}), retrying...")
+                time.sleep(min(2 ** attempt, 10))
@@ -0,0 +1,222 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class TorchClipEncoder:
+    """Tách SentenceTransformer CLIP thành preprocess (CPU) và infer (model)."""
+
+    def __init__(self, st_model):
+        from sentence_transformers.util import batch_to_device
+
+        self.model = st_model
+        self._to_device = batch_to_device
+
+    def preprocess(self, images):
+        return self.model.tokenize(images)
+
+    def infer(self, features) -> np.ndarray:
+        features = self._to_device(features, self.model.device)
+        with torch.no_grad():
+            out = self.model.forward(features)["sentence_embedding"]
+        return out.float().cpu().numpy()
+
+
+@dataclass
+class QueueDepth:
+    """Độ sâu queue lấy mẫu mỗi lần get (chỉ giữ tổng / max, không giữ lịch sử)."""
+    total: int = 0
+    samples: int = 0
+    max: int = 0
+
+    def sample(self, depth: int) -> None:
+        self.total += depth
+        self.samples += 1
+        self.max = max(self.max, depth)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.samples if self.samples else 0.0
+
+
+@dataclass
+class PipelineStats:
+    n_images: int = 0
+    n_failed: int = 0
+    n_batches: int = 0
+    elapsed_sec: float = 0.0
+    decode_sec: float = 0.0       # tổng thời gian decode (cộng dồn các worker)
+    preprocess_sec: float = 0.0
+    infer_sec: float = 0.0
+    decoded_queue_depth: QueueDepth = field(default_factory=QueueDepth)
+    batch_queue_depth: QueueDepth = field(default_factory=QueueDepth)
+
+    @property
+    def images_per_sec(self) -> float:
+        return self.n_images / self.elapsed_sec if self.elapsed_sec else 0.0
+
+    def summary(self) -> dict:
+        data = asdict(self)
+        for name in ("decoded_queue_depth", "batch_queue_depth"):
+            depth = getattr(self, name)
+            data.pop(name)
+            data[f"{name}_mean"] = depth.mean
+            data[f"{name}_max"] = depth.max
+        data["images_per_sec"] = self.images_per_sec
+        return data
+
+    def log(self) -> None:
+        s = self.summary()
+        logger.info(
+            f"Embedded {self.n_images} frames in {self.elapsed_sec:.1f}s ({s['images_per_sec']:.1f} frames/s) | "
+            f"decode {self.decode_sec:.1f}s, preprocess {self.preprocess_sec:.1f}s, infer {self.infer_sec:.1f}s | "
+            f"queue depth decoded={s['decoded_queue_depth_mean']:.1f}/{s['decoded_queue_depth_max']}, "
+            f"batches={s['batch_queue_depth_mean']:.1f}/{s['batch_queue_depth_max']}"
+        )
+
+
+def _load_image(path: Path):
+    try:
+        with Image.open(path) as img:
+            return img.convert("RGB")
+    except Exception as e:
+        logger.error(f"Failed to load {path}: {e}")
+        return None
+
+
+def embed_pipelined(paths, encoder, batch_size: int = 32, n_decoders: int = 4, prefetch_batches: int = 4):
+    """
+    Decode -> preprocess -> infer chạy chồng lên nhau qua các queue có giới hạn:
+    - n_decoders thread đọc ảnh (bounded queue ~ prefetch_batches * batch_size ảnh)
+    - 1 thread gom batch và preprocess thành tensor (bounded queue prefetch_batches batch)
+    - thread gọi hàm này chạy model trên từng batch
+    RAM đỉnh chỉ phụ thuộc kích thước queue, không phụ thuộc số frame.
+
+    Trả về (embeddings (N_valid, D), valid_indices, PipelineStats).
+    """
+    stats = PipelineStats()
+    start = time.perf_counter()
+    lock = threading.Lock()
+    stop = threading.Event()
+    errors = []
+
+    def put(q, item):
+        # put có timeout để thread không kẹt mãi khi phía sau đã dừng vì lỗi
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    todo = queue.Queue()
+    for i, p in enumerate(paths):
+        todo.put((i, p))
+    decoded = queue.Queue(maxsize=max(1, prefetch_batches * batch_size))
+    batches = queue.Queue(maxsize=max(1, prefetch_batches))
+
+    def decode_worker():
+        try:
+            while not stop.is_set():
+                try:
+                    i, p = todo.get_nowait()
+                except queue.Empty:
+                    break
+                t0 = time.perf_counter()
+                img = _load_image(p)
+                with lock:
+                    stats.decode_sec += time.perf_counter() - t0
+                put(decoded, (i, img))
+        finally:
+            put(decoded, _DONE)
+
+    def preprocess_worker():
+        pending_idx, pending_img = [], []
+
+        def flush():
+            t0 = time.perf_counter()
+            features = encoder.preprocess(pending_img)
+            stats.preprocess_sec += time.perf_counter() - t0
+            put(batches, (list(pending_idx), features))
+            pending_idx.clear()
+            pending_img.clear()
+
+        try:
+            finished = 0
+            while finished < n_decoders and not stop.is_set():
+                try:
+                    item = decoded.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                stats.decoded_queue_depth.sample(decoded.qsize())
+                if item is _DONE:
+                    finished += 1
+                    continue
+                i, img = item
+                if img is None:
+                    stats.n_failed += 1
+                    continue
+                pending_idx.append(i)
+                pending_img.append(img)
+                if len(pending_img) == batch_size:
+                    flush()
+            if pending_img:
+                flush()
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(batches, _DONE)
+
+    threads = [threading.Thread(target=decode_worker, daemon=True) for _ in range(n_decoders)]
+    threads.append(threading.Thread(target=preprocess_worker, daemon=True))
+    for t in threads:
+        t.start()
+
+    out_idx, out_emb = [], []
+    try:
+        while not stop.is_set():
+            try:
+                item = batches.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            stats.batch_queue_depth.sample(batches.qsize())
+            if item is _DONE:
+                break
+            idx, features = item
+            t0 = time.perf_counter()
+            out_emb.append(encoder.infer(features))
+            stats.infer_sec += time.perf_counter() - t0
+            out_idx.extend(idx)
+            stats.n_batches += 1
+    except BaseException:
+        stop.set()
+        raise
+
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+    stats.n_images = len(out_idx)
+    stats.elapsed_sec = time.perf_counter() - start
+
+    if not out_emb:
+        return np.zeros((0, 0), dtype=np.float32), [], stats
+
+    # Batch có thể về không theo thứ tự path -> sắp lại theo index gốc
+    emb = np.concatenate(out_emb)
+    order = np.argsort(out_idx)
+    return emb[order], [out_idx[j] for j in order], stats
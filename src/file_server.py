@@ -0,0 +1,167 @@
+import ipaddress
+import logging
+import mimetypes
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 16
+# Chỉ phục vụ file media: thư mục project còn có log, state, config (có thể chứa API key)
+MEDIA_SUFFIXES = frozenset({".mp4", ".webm", ".mov", ".mkv", ".m4a", ".mp3", ".wav", ".jpg", ".jpeg", ".png"})
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def parse_range(header: str, size: int):
+    """
+    'bytes=start-end' -> (start, end) bao gồm cả end, hoặc None nếu không hợp lệ.
+    Hỗ trợ dạng mở ('bytes=100-') và suffix ('bytes=-500'); chỉ 1 khoảng.
+    """
+    m = RANGE_RE.match(header.strip())
+    if not m or size == 0:
+        return None
+    start, end = m.groups()
+    if start == "":
+        if end == "":
+            return None
+        length = min(int(end), size)
+        return size - length, size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        return None
+    return start, end
+
+
+class FileServer:
+    """
+    HTTP server nhỏ (thread riêng) phục vụ file trong các thư mục / file cho phép,
+    chỉ với đuôi trong `suffixes`. Có Range request để trình duyệt seek video mà
+    không tải hết file, và đọc file theo chunk nên RAM không phụ thuộc kích thước video.
+    """
+
+    def __init__(self, roots, host: str = "127.0.0.1", port: int = 0, public_url: str = "",
+                 suffixes=MEDIA_SUFFIXES):
+        # Link mặc định http://localhost:<port> chỉ đúng khi trình duyệt chạy cùng máy:
+        # mở server ra ngoài mà không có public_url thì mọi client khác sẽ không phát được video
+        if not public_url and not is_loopback(host):
+            raise ValueError(
+                f"File server listens on {host} but ui.file_server_public_url is not set: browsers on "
+                f"other machines would fetch videos from their own localhost. Set it to the URL clients "
+                f"use to reach port {port} (e.g. http://<server>:{port} or the reverse-proxy path)."
+            )
+        # Root là thư mục hoặc 1 file (vd. video input), có thể chưa tồn tại lúc khởi động
+        self.roots = {f"r{i}": Path(r).resolve() for i, r in enumerate(roots)}
+        self.suffixes = {s.lower() for s in suffixes}
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.public_url = (public_url or f"http://localhost:{self.port}").rstrip("/")
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self) -> "FileServer":
+        self.thread.start()
+        logger.info(f"File server listening on port {self.port}")
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url_for(self, path: Path, download: bool = False) -> str:
+        path = Path(path).resolve()
+        if path.suffix.lower() not in self.suffixes:
+            raise ValueError(f"{path.name} is not a served media type")
+        for key, root in self.roots.items():
+            if path == root:
+                url = f"{self.public_url}/{key}/{quote(path.name)}"
+            elif path.is_relative_to(root):
+                url = f"{self.public_url}/{key}/{quote(path.relative_to(root).as_posix())}"
+            else:
+                continue
+            return url + "?download=1" if download else url
+        raise ValueError(f"{path} is not under a served directory")
+
+    def resolve(self, url_path: str):
+        """URL path -> file thật, None nếu không nằm trong root cho phép hoặc không phải file media."""
+        key, _, rel = unquote(url_path).lstrip("/").partition("/")
+        root = self.roots.get(key)
+        if root is None or not rel:
+            return None
+        path = root if rel == root.name and root.is_file() else (root / rel).resolve()
+        if not path.is_relative_to(root) or not path.is_file() or path.suffix.lower() not in self.suffixes:
+            return None
+        return path
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                self._serve(send_body=False)
+
+            def do_GET(self):
+                self._serve(send_body=True)
+
+            def _serve(self, send_body: bool):
+                url = urlparse(self.path)
+                path = server.resolve(url.path)
+                if path is None:
+                    self.send_error(404)
+                    return
+
+                size = path.stat().st_size
+                start, end = 0, size - 1
+                status = 200
+                if "Range" in self.headers:
+                    byte_range = parse_range(self.headers["Range"], size)
+                    if byte_range is None:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{size}")
+                        self.end_headers()
+                        return
+                    start, end = byte_range
+                    status = 206
+
+                length = end - start + 1 if size else 0
+                self.send_response(status)
+                self.send_header("Content-Type", mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(length))
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                if "download" in parse_qs(url.query):
+                    self.send_header("Content-Disposition", f'attachment; filename="{path.name}"')
+                self.end_headers()
+                if not send_body:
+                    return
+
+                with open(path, "rb") as f:
+                    f.seek(start)
+                    remaining = length
+                    while remaining > 0:
+                        data = f.read(min(CHUNK_SIZE, remaining))
+                        if not data:
+                            break
+                        try:
+                            self.wfile.write(data)
+                        except (BrokenPipeError, ConnectionResetError):
+                            # Trình duyệt huỷ request khi seek sang chỗ khác
+                            return
+                        remaining -= len(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
@@ -1,13 +1,20 @@
 import logging
 import shutil
 import json
+import time
 from pathlib import Path
 
 import cv2
-from scenedetect import VideoManager, SceneManager
+import numpy as np
+from scenedetect import VideoManager, SceneManager, StatsManager
 from scenedetect.detectors import ContentDetector
 
-from common import FRAMES_DIR, PROJECT_DIR, configs
+from common import FRAMES_DIR, VIDEO_INPUTS, VIDEO_PATH, configs
+from downloader import read_progress
+from frame_catalog import FrameCatalog
+from mp4_index import video_sample_ends
+from proxy import working_video
+from video_probe import VideoMeta, probe_video
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__file__)
@@ -15,67 +22,322 @@ logger = logging.getLogger(__file__)
 logger.info("\nStarting scene-aware frame sampling\n")
 
 def detect_scenes(video_path: str):
+    """
+    Trả về (scene_list, motion): scene_list là các cặp (start_frame, end_frame),
+    motion[i] là mức thay đổi hình ảnh trung bình (content_val của
+    ContentDetector) của scene thứ i.
+    """
     logger.info(f"Detecting scenes in video: {video_path}")
     video_manager = VideoManager([video_path])
-    scene_manager = SceneManager()
+    stats_manager = StatsManager()
+    scene_manager = SceneManager(stats_manager)
 
     scene_manager.add_detector(ContentDetector(threshold=27.0))
     video_manager.set_downscale_factor()
     video_manager.start()
     
     scene_manager.detect_scenes(frame_source=video_manager)
-    scene_list = scene_manager.get_scene_list()
+    n_frames = video_manager.get_duration()[0].get_frames()
+    video_manager.release()
+    return collect_scenes(scene_manager, stats_manager, n_frames)
+
+def collect_scenes(scene_manager, stats_manager, n_frames: int):
+    scene_list = [(start.get_frames(), end.get_frames()) for start, end in scene_manager.get_scene_list()]
+
+    # Không có điểm cắt nào -> cả video là 1 scene
+    if not scene_list and n_frames > 0:
+        scene_list = [(0, n_frames)]
     
     logger.info(f"Detected {len(scene_list)} scenes.\n")
-    return scene_list
+    return scene_list, scene_motion(stats_manager, scene_list)
 
-def extract_keyframes(video_path: str, scene_list):
-    if FRAMES_DIR.exists():
-        shutil.rmtree(FRAMES_DIR)
-    FRAMES_DIR.mkdir(parents=True, exist_ok=True)
+def progressive_enabled() -> bool:
+    return bool(configs.get("video_retrieval", {}).get("progressive", False))
+
+def wait_for_source(video_path: Path, timeout: float) -> bool:
+    """Progressive: bước download chạy song song, chờ nó tạo video hoặc file .progress."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if video_path.exists() or read_progress(video_path):
+            return True
+        time.sleep(1.0)
+    return False
+
+def check_progress(video_path: Path):
+    """Trạng thái tải hiện tại; lỗi nếu download đã dừng mà video chưa hoàn chỉnh."""
+    progress = read_progress(video_path)
+    if progress is None:
+        if not video_path.exists():
+            raise RuntimeError(f"Download of {video_path.name} stopped before completing")
+        return None
+    stale_sec = float(configs.get("video_retrieval", {}).get("progressive_wait_sec", 600))
+    if time.time() - progress.get("ts", 0) > stale_sec:
+        # .progress còn sót lại từ lần tải bị kill giữa chừng
+        raise RuntimeError(f"Download of {video_path.name} made no progress for {stale_sec:.0f}s")
+    return progress
+
+def wait_for_download(video_path: Path, poll_sec: float = 1.0):
+    while not video_path.exists():
+        check_progress(video_path)
+        time.sleep(poll_sec)
+
+def detect_scenes_progressive(video_path: Path, poll_sec: float = 1.0):
+    """
+    Detect scene trên file đang tải (MP4 fast-start: moov nằm đầu file nên biết trước
+    vị trí byte của mọi frame). Mỗi vòng chỉ decode tới frame cuối mà dữ liệu đã
+    tải liên tục tới, trừ một khoảng an toàn cho B-frame; SceneManager giữ trạng thái
+    giữa các lần gọi nên kết quả giống hệt khi chạy trên file hoàn chỉnh.
+    File không phải fast-start -> chờ tải xong rồi detect như bình thường.
+    """
+    progress = check_progress(video_path)
+    while progress and progress["layout"] is None:
+        time.sleep(poll_sec)
+        progress = check_progress(video_path)
+
+    if progress is None or progress["layout"] != "faststart":
+        if progress:
+            logger.info(f"{video_path.name} is not fast-start ({progress['layout']}), waiting for the full download")
+        wait_for_download(video_path, poll_sec)
+        return detect_scenes(str(working_video(video_path)))
+
+    part_path = Path(progress["path"])
+    sample_ends = video_sample_ends(part_path)
+    n_frames = len(sample_ends)
+    margin = int(configs.get("video_retrieval", {}).get("progressive_margin_frames", 48))
+
+    logger.info(f"Detecting scenes progressively in: {part_path} ({n_frames} frames)")
+    video_manager = VideoManager([str(part_path)])
+    stats_manager = StatsManager()
+    scene_manager = SceneManager(stats_manager)
+    scene_manager.add_detector(ContentDetector(threshold=27.0))
+    video_manager.set_downscale_factor()
+    video_manager.start()
+
+    position = 0
+    while position < n_frames:
+        progress = check_progress(video_path)
+        if progress is None:
+            # .progress đã bị xoá sau khi video hoàn chỉnh
+            available = sample_ends[-1]
+        else:
+            available = progress["available"]
+        if available >= sample_ends[-1]:
+            end = n_frames
+        else:
+            end = int(np.searchsorted(sample_ends, available, side="right")) - margin
+
+        if end > position:
+            scene_manager.detect_scenes(frame_source=video_manager, end_time=end)
+            position = end
+            logger.info(f"Scene detection: {position}/{n_frames} frames")
+        else:
+            time.sleep(poll_sec)
+
+    video_manager.release()
+    wait_for_download(video_path, poll_sec)
+    return collect_scenes(scene_manager, stats_manager, n_frames)
+
+def frame_metric(stats_manager, name: str, n_frames: int) -> np.ndarray:
+    """
+    Metric theo frame dạng mảng, đọc 1 lượt từ bảng {frame: {metric: value}} mà
+    StatsManager lưu sẵn (không gọi get_metrics cho từng frame của VOD dài vài giờ).
+    Frame không có metric = 0.
+    """
+    values = np.zeros(n_frames, dtype=np.float32)
+    frame_metrics = getattr(stats_manager, "_frame_metrics", None)
+    if frame_metrics is None:
+        # PySceneDetect không còn bảng nội bộ -> đọc từng frame qua API công khai
+        for f in range(n_frames):
+            metric = stats_manager.get_metrics(f, [name])[0]
+            if metric is not None:
+                values[f] = metric
+        return values
+    pairs = np.array(
+        [(f, m[name]) for f, m in frame_metrics.items() if m.get(name) is not None and 0 <= f < n_frames],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    values[pairs[:, 0].astype(np.int64)] = pairs[:, 1]
+    return values
+
+def scene_motion(stats_manager, scene_list) -> np.ndarray:
+    """Trung bình content_val theo từng scene (tổng theo đoạn bằng np.add.reduceat)."""
+    if not scene_list:
+        return np.zeros(0)
+
+    n_frames = scene_list[-1][1]
+    values = frame_metric(stats_manager, "content_val", n_frames)
 
+    starts = np.array([start for start, _ in scene_list])
+    lengths = np.maximum(np.diff(np.append(starts, n_frames)), 1)
+    return np.add.reduceat(values, starts) / lengths
+
+def allocate_frame_budget(durations, motions, budget: int, min_per_scene: int = 1,
+                          max_per_scene: int = 12, flicker_sec: float = 1.0) -> np.ndarray:
+    """
+    Chia tổng số frame (budget) cho các scene theo trọng số độ dài x mức chuyển động.
+    - Scene "nháy" (ngắn hơn flicker_sec) chỉ được tối đa 1 frame.
+    - Nếu số scene vượt budget, các scene có trọng số thấp nhất bị bỏ (0 frame).
+    """
+    durations = np.asarray(durations, dtype=np.float64)
+    motions = np.asarray(motions, dtype=np.float64)
+    n = len(durations)
+    if n == 0 or budget <= 0:
+        return np.zeros(n, dtype=int)
+
+    # Chuẩn hóa motion quanh trung vị, giới hạn để 1 scene không chiếm hết budget
+    rel_motion = np.clip(motions / (np.median(motions) + 1e-6), 0.25, 4.0)
+    weights = durations * rel_motion
+
+    flicker = durations < flicker_sec
+    cap = np.where(flicker, 1, max_per_scene)
+    counts = np.where(flicker, 1, min(min_per_scene, max_per_scene)).astype(int)
+
+    if counts.sum() > budget:
+        # Không đủ budget cho mỗi scene 1 frame: giữ các scene có trọng số cao nhất
+        keep = np.argsort(-weights)[:budget]
+        out = np.zeros(n, dtype=int)
+        out[keep] = 1
+        return out
+
+    remaining = budget - counts.sum()
+    growable = ~flicker
+    if remaining > 0 and growable.any():
+        share = np.where(growable, weights, 0.0)
+        extra = np.floor(remaining * share / share.sum()).astype(int)
+        counts = np.minimum(counts + extra, cap)
+
+    return counts
+
+def sample_positions(start_frame: int, end_frame: int, n: int) -> list[int]:
+    """n vị trí cách đều trong scene, tránh 3 frame ở mỗi biên (blur / chuyển cảnh)."""
+    if n <= 0:
+        return []
+    lo = start_frame + 3
+    hi = max(lo, end_frame - 3)
+    if n == 1:
+        return [(start_frame + end_frame) // 2]
+    return list(dict.fromkeys(np.linspace(lo, hi, n).round().astype(int).tolist()))
+
+class ExactFrameReader:
+    """
+    Đọc đúng frame index yêu cầu (tăng dần) dựa trên keyframe index của VideoMeta:
+    chỉ seek khi có keyframe nằm giữa vị trí hiện tại và frame cần đọc (seek thẳng tới
+    keyframe đó nên luôn chính xác), còn lại decode tiếp bằng grab() không cần seek.
+    """
+
+    def __init__(self, cap, meta: VideoMeta):
+        self.cap = cap
+        self.meta = meta
+        self.pos = None  # frame index mà lần grab/read kế tiếp sẽ trả về
+
+    def read(self, target: int):
+        key = self.meta.keyframe_before(target)
+        if self.pos is None or target < self.pos or key > self.pos:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, key)
+            self.pos = key
+        while self.pos < target:
+            if not self.cap.grab():
+                return None
+            self.pos += 1
+        ok, frame = self.cap.read()
+        self.pos += 1
+        return frame if ok else None
+
+def extract_keyframes(video_path: str, scene_list, motion, out_dir: Path, budget: int, meta: VideoMeta):
+    """
+    Lấy mẫu frame cho từng scene, lưu ảnh vào out_dir/scene_x/frame_k.jpg.
+    Trả về các dòng (frame_idx, timestamp, scene, image_path) cho FrameCatalog.
+    """
     cap = cv2.VideoCapture(video_path)
+    reader = ExactFrameReader(cap, meta)
+    fps = meta.fps
 
-    for idx, (start, end) in enumerate(scene_list, start=1):
-        scene_dir = FRAMES_DIR / f"scene_{idx}"
-        scene_dir.mkdir(parents=True, exist_ok=True)
-        
-        start_frame = start.get_frames()
-        end_frame = end.get_frames()
-        mid_frame = (start_frame + end_frame) // 2
+    sampling_cfg = configs.get("frame_sampling", {})
+    durations = [(end - start) / fps for start, end in scene_list]
+    counts = allocate_frame_budget(
+        durations,
+        motion,
+        budget=budget,
+        min_per_scene=int(sampling_cfg.get("min_per_scene", 1)),
+        max_per_scene=int(sampling_cfg.get("max_per_scene", 12)),
+        flicker_sec=float(sampling_cfg.get("flicker_sec", 1.0)),
+    )
+    logger.info(f"Frame budget: {int(counts.sum())} frames over {len(scene_list)} scenes.")
+
+    rows = []
+    for idx, ((start, end), n_frames) in enumerate(zip(scene_list, counts), start=1):
+        keyframes = sample_positions(start, end, int(n_frames))
+        if not keyframes:
+            continue
 
-        keyframes = list(dict.fromkeys([
-            start_frame + 3,  # Skip boundary blur
-            mid_frame,        # Best scene representation
-            end_frame - 3     # Avoid next scene transition
-        ]))
+        scene_dir = out_dir / f"scene_{idx}"
+        scene_dir.mkdir(parents=True, exist_ok=True)
 
         logger.info(f"Scene {idx}: extracting {len(keyframes)} keyframes.")
 
         for kf in keyframes:
             if kf < 0:
                 continue
-            cap.set(cv2.CAP_PROP_POS_FRAMES, kf)
-            ret, frame = cap.read()
-            if ret:
+            frame = reader.read(kf)
+            if frame is not None:
                 out_path = scene_dir / f"frame_{kf}.jpg"
                 cv2.imwrite(str(out_path), frame)
+                rows.append((kf, kf / fps, idx, out_path))
 
     cap.release()
     cv2.destroyAllWindows()
+    return rows
+
+def main():
+    # Progressive: video_input.mp4 đang được bước download tải song song
+    progressive = progressive_enabled()
+    wait_sec = float(configs.get("video_retrieval", {}).get("progressive_wait_sec", 600))
+    videos = [
+        v for v in VIDEO_INPUTS
+        if v.exists() or (progressive and v == VIDEO_PATH and wait_for_source(v, wait_sec))
+    ]
+    for missing in set(VIDEO_INPUTS) - set(videos):
+        logger.error(f"Không tìm thấy file video tại {missing}")
+    if not videos:
+        return
+
+    if FRAMES_DIR.exists():
+        shutil.rmtree(FRAMES_DIR)
+    FRAMES_DIR.mkdir(parents=True, exist_ok=True)
 
-# --- MAIN ---
-ROOT = Path(__file__).resolve().parents[1]
-video_path = ROOT / "projects" / "LOL" / "video_input.mp4"
+    # 1. Detect scene cho mọi video trước để chia budget theo độ dài
+    analyses = []
+    for video_path in videos:
+        print(f"DEBUG: Đang xử lý video tại: {video_path}")
+        if progressive and not video_path.exists():
+            # Đọc dần file đang tải; proxy (nếu bật) được dựng sau khi tải xong
+            scenes, motion = detect_scenes_progressive(video_path)
+            source = working_video(video_path)
+        else:
+            # Proxy mode: phân tích trên bản proxy (frame index khớp với video gốc)
+            source = working_video(video_path)
+            scenes, motion = detect_scenes(str(source))
+        analyses.append((video_path, source, scenes, motion))
 
-if not video_path.exists():
-    video_path = Path(configs["video_path"])
+    total_frames = sum(scenes[-1][1] for _, _, scenes, _ in analyses if scenes) or 1
+    budget = int(configs.get("frame_sampling", {}).get("frame_budget", 600))
 
-print(f"DEBUG: Đang xử lý video tại: {video_path}")
+    # 2. Trích frame + ghi catalog (frame_id -> video, frame index, timestamp, scene)
+    with FrameCatalog() as catalog:
+        catalog.reset()
+        for n, (video_path, source, scenes, motion) in enumerate(analyses, start=1):
+            if not scenes:
+                continue
+            video_budget = max(1, round(budget * scenes[-1][1] / total_frames))
+            # fps / duration / keyframe index lấy từ probe cache (không mở thêm reader)
+            meta = probe_video(source)
+            rows = extract_keyframes(
+                str(source), scenes, motion, FRAMES_DIR / f"video_{n}", video_budget, meta
+            )
+            video_id = catalog.add_video(video_path, meta.fps, meta.duration)
+            catalog.add_frames(video_id, rows)
 
-if not video_path.exists():
-    logger.error(f"Không tìm thấy file video tại {video_path}")
-else:
-    scenes = detect_scenes(str(video_path))
-    extract_keyframes(str(video_path), scenes)
     logger.info("\nScene detection completed\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from common import PROJECT_DIR
+
+# Catalog frame của mọi video input trong project
+FRAME_CATALOG_PATH = PROJECT_DIR / "frame_catalog.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id    INTEGER PRIMARY KEY,
+    path        TEXT UNIQUE NOT NULL,
+    fps         REAL NOT NULL,
+    duration    REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS frames (
+    frame_id    INTEGER PRIMARY KEY,
+    video_id    INTEGER NOT NULL REFERENCES videos(video_id),
+    frame_idx   INTEGER NOT NULL,
+    timestamp   REAL NOT NULL,
+    scene       INTEGER NOT NULL,
+    image_path  TEXT NOT NULL,
+    emb_row     INTEGER NOT NULL DEFAULT -1
+);
+CREATE INDEX IF NOT EXISTS frames_by_video ON frames(video_id, frame_idx);
+"""
+
+
+@dataclass
+class FrameRecord:
+    frame_id: int
+    video_id: int
+    video_path: Path
+    frame_idx: int
+    timestamp: float
+    scene: int
+    image_path: Path
+    emb_row: int
+
+
+@dataclass
+class VideoRecord:
+    video_id: int
+    path: Path
+    fps: float
+    duration: float
+
+
+class FrameCatalog:
+    """
+    Bảng tra frame_id -> (video nguồn, frame index, timestamp, scene, dòng embedding).
+    Lưu trong SQLite để mọi bước (frame, image_retrieval, make_clip) dùng chung,
+    thay cho việc suy ra thông tin từ tên file ảnh.
+    """
+
+    def __init__(self, db_path: Path = FRAME_CATALOG_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def reset(self) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM frames")
+            self.conn.execute("DELETE FROM videos")
+
+    # ---------- videos ----------
+    def add_video(self, path: Path, fps: float, duration: float) -> int:
+        """Thêm (hoặc ghi đè) video; frame cũ của video đó bị xóa."""
+        path = str(Path(path).resolve())
+        with self.conn:
+            row = self.conn.execute("SELECT video_id FROM videos WHERE path = ?", (path,)).fetchone()
+            if row:
+                self.conn.execute("DELETE FROM frames WHERE video_id = ?", (row[0],))
+                self.conn.execute(
+                    "UPDATE videos SET fps = ?, duration = ? WHERE video_id = ?", (fps, duration, row[0])
+                )
+                return row[0]
+            cur = self.conn.execute(
+                "INSERT INTO videos (path, fps, duration) VALUES (?, ?, ?)", (path, fps, duration)
+            )
+            return cur.lastrowid
+
+    def videos(self) -> list[VideoRecord]:
+        rows = self.conn.execute("SELECT video_id, path, fps, duration FROM videos ORDER BY video_id")
+        return [VideoRecord(vid, Path(p), fps, dur) for vid, p, fps, dur in rows]
+
+    # ---------- frames ----------
+    def add_frames(self, video_id: int, rows) -> None:
+        """rows: iterable (frame_idx, timestamp, scene, image_path)."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO frames (video_id, frame_idx, timestamp, scene, image_path) VALUES (?, ?, ?, ?, ?)",
+                [(video_id, int(f), float(t), int(s), str(p)) for f, t, s, p in rows],
+            )
+
+    def set_embedding_rows(self, frame_ids, emb_rows) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE frames SET emb_row = ? WHERE frame_id = ?",
+                [(int(r), int(f)) for f, r in zip(frame_ids, emb_rows)],
+            )
+
+    _FRAME_QUERY = (
+        "SELECT f.frame_id, f.video_id, v.path, f.frame_idx, f.timestamp, f.scene, f.image_path, f.emb_row "
+        "FROM frames f JOIN videos v ON v.video_id = f.video_id"
+    )
+
+    @staticmethod
+    def _record(row) -> FrameRecord:
+        fid, vid, vpath, fidx, ts, scene, img, emb = row
+        return FrameRecord(fid, vid, Path(vpath), fidx, ts, scene, Path(img), emb)
+
+    def frames(self) -> list[FrameRecord]:
+        rows = self.conn.execute(self._FRAME_QUERY + " ORDER BY f.frame_id")
+        return [self._record(r) for r in rows]
+
+    def get(self, frame_id: int) -> FrameRecord | None:
+        row = self.conn.execute(self._FRAME_QUERY + " WHERE f.frame_id = ?", (int(frame_id),)).fetchone()
+        return self._record(row) if row else None
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """Các cột số dạng numpy (theo thứ tự frame_id) để xử lý vector hóa."""
+        rows = self.conn.execute(
+            "SELECT frame_id, video_id, frame_idx, timestamp, scene, emb_row FROM frames ORDER BY frame_id"
+        ).fetchall()
+        cols = np.array(rows, dtype=np.float64).reshape(-1, 6)
+        return {
+            "frame_id": cols[:, 0].astype(np.int64),
+            "video_id": cols[:, 1].astype(np.int64),
+            "frame_idx": cols[:, 2].astype(np.int64),
+            "timestamp": cols[:, 3],
+            "scene": cols[:, 4].astype(np.int64),
+            "emb_row": cols[:, 5].astype(np.int64),
+        }
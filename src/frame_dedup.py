@@ -0,0 +1,100 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Số bit 1 của mọi giá trị uint8, dùng để tính khoảng cách Hamming theo byte
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Kích thước ảnh xám thu nhỏ cho từng loại hash
+_HASH_INPUT_SIZE = {"dhash": (9, 8), "phash": (32, 32)}
+
+
+def _load_small_gray(path: Path, size: tuple[int, int]):
+    try:
+        with Image.open(path) as img:
+            return np.asarray(img.convert("L").resize(size, Image.BILINEAR), dtype=np.float32)
+    except Exception as e:
+        logger.error(f"Failed to load {path}: {e}")
+        return None
+
+
+def _hash_bits(stack: np.ndarray, method: str) -> np.ndarray:
+    """stack: (N, H, W) ảnh xám -> (N, 64) bit, tính cho cả lô một lần."""
+    if method == "dhash":
+        # So sánh từng pixel với pixel bên phải: (N, 8, 9) -> (N, 8, 8)
+        bits = stack[:, :, 1:] > stack[:, :, :-1]
+    elif method == "phash":
+        from scipy.fft import dctn
+
+        low = dctn(stack, axes=(1, 2), norm="ortho")[:, :8, :8]
+        flat = low.reshape(len(low), -1)
+        # Bỏ hệ số DC khi lấy trung vị
+        median = np.median(flat[:, 1:], axis=1, keepdims=True)
+        bits = flat > median
+    else:
+        raise ValueError(f"Unknown hash method: {method}")
+    return bits.reshape(len(stack), 64)
+
+
+def compute_hashes(frame_paths: list[Path], method: str = "dhash", workers: int = 8):
+    """
+    Trả về (hashes, valid_paths): hashes là mảng (N, 8) uint8 (64 bit / frame).
+    Ảnh lỗi bị bỏ qua.
+    """
+    size = _HASH_INPUT_SIZE[method]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        smalls = list(pool.map(lambda p: _load_small_gray(p, size), frame_paths))
+
+    valid = [(arr, p) for arr, p in zip(smalls, frame_paths) if arr is not None]
+    if not valid:
+        return np.zeros((0, 8), dtype=np.uint8), []
+
+    arrs, valid_paths = zip(*valid)
+    bits = _hash_bits(np.stack(arrs), method)
+    return np.packbits(bits, axis=1), list(valid_paths)
+
+
+def hamming_to_all(h: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+    """Khoảng cách Hamming từ 1 hash (8,) tới mọi hash (N, 8)."""
+    return _POPCOUNT[np.bitwise_xor(hashes, h)].sum(axis=1, dtype=np.int32)
+
+
+def cluster_hashes(hashes: np.ndarray, max_distance: int) -> np.ndarray:
+    """
+    Gom cụm tham lam theo thứ tự frame: frame đầu tiên chưa thuộc cụm nào
+    làm đại diện, mọi frame chưa gán có Hamming <= max_distance vào cụm đó.
+    Trả về assign[i] = index của frame đại diện cho frame i.
+    """
+    n = len(hashes)
+    assign = np.full(n, -1, dtype=np.int64)
+    for i in range(n):
+        if assign[i] >= 0:
+            continue
+        close = (hamming_to_all(hashes[i], hashes) <= max_distance) & (assign < 0)
+        assign[close] = i
+    return assign
+
+
+def dedup_frames(frame_paths: list[Path], max_distance: int = 6, method: str = "dhash"):
+    """
+    Trả về (rep_paths, clusters): danh sách frame đại diện cần embed và
+    map {đại diện: [các frame trong cụm]} để map ngược kết quả về từng frame.
+    """
+    hashes, valid_paths = compute_hashes(frame_paths, method)
+    assign = cluster_hashes(hashes, max_distance)
+
+    clusters: dict[Path, list[Path]] = {}
+    for path, rep_idx in zip(valid_paths, assign):
+        clusters.setdefault(valid_paths[rep_idx], []).append(path)
+
+    rep_paths = list(clusters)
+    logger.info(
+        f"Dedup ({method}, d<={max_distance}): {len(valid_paths)} frames -> {len(rep_paths)} representatives."
+    )
+    return rep_paths, clusters
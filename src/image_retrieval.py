@@ -1,22 +1,41 @@
+import argparse
+import json
 import logging
 import shutil
 from pathlib import Path
-from multiprocessing import Pool, cpu_count
+from multiprocessing import cpu_count
 
+import numpy as np
 import torch
-from PIL import Image
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
 
 from common import (
     FRAMES_RANKING_DIR,
     FRAMES_DIR,
+    PROJECT_DIR,
     SUBPLOTS_DIR,
     configs,
+    file_fingerprint,
 )
+from clip_onnx import load_image_encoder
+from embed_pipeline import TorchClipEncoder, embed_pipelined
+from frame_catalog import FrameCatalog
+from frame_dedup import dedup_frames
+from ranking_manifest import RANKING_MANIFEST_PATH, RankingManifest
+from vector_index import load_index, sync_index, top_k_indices
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__file__)
 
+# Embedding của frame được lưu lại để bước ranking (cần subplot) chạy riêng
+FRAME_EMB_PATH = PROJECT_DIR / "frame_embeddings.pt"
+# Thông lượng / độ sâu queue của lần embed gần nhất
+EMBED_STATS_PATH = PROJECT_DIR / "embed_stats.json"
+# Vector index trên embedding frame (exact numpy hoặc IVF xấp xỉ)
+FRAME_INDEX_DIR = PROJECT_DIR / "frame_index"
+# Map frame đại diện -> các frame gần trùng (perceptual hash)
+DEDUP_CLUSTERS_PATH = FRAMES_DIR / "dedup_clusters.json"
+
 def load_model():
     model_id = configs["frame_ranking"]["model_id"]  # "clip-ViT-L-14"
     device = configs["frame_ranking"]["device"]      # "cuda" or "cpu"
@@ -26,67 +45,105 @@ def load_model():
     model = SentenceTransformer(model_id, device=device)
     return model
 
-def collect_all_frames():
-    """Collect all frames from frames/scene_x."""
-    frame_paths = []
-
-    for scene_dir in sorted(FRAMES_DIR.glob("scene_*"), key=lambda x: int(x.name.split("_")[1])):
-        for img in sorted(scene_dir.glob("*.jpg")):
-            frame_paths.append(img)
-
-    logger.info(f"Collected {len(frame_paths)} frames.")
-    return frame_paths
-
-def load_image(path: Path):
-    try:
-        return Image.open(path).convert("RGB")
-    except Exception as e:
-        logger.error(f"Failed to load {path}: {e}")
-        return None
-
-def embed_images(frame_paths, model, batch_size):
-    logger.info(f"Loading {len(frame_paths)} images in parallel...")
-
-    num_workers = max(2, cpu_count() // 2)
-
-    with Pool(processes=num_workers) as pool:
-        loaded_imgs = list(pool.map(load_image, frame_paths))
-
-    valid_pairs = [(img, path) for img, path in zip(loaded_imgs, frame_paths) if img is not None]
-
-    if not valid_pairs:
+def collect_all_frames(catalog: FrameCatalog):
+    """Collect all frames (of every input video) registered by frame.py."""
+    records = [r for r in catalog.frames() if r.image_path.exists()]
+
+    logger.info(f"Collected {len(records)} frames from {len(catalog.videos())} videos.")
+    return records
+
+def embed_images(frame_paths, model, batch_size, image_encoder=None):
+    """
+    Embed ảnh qua pipeline decode -> preprocess -> infer (embed_pipeline).
+    image_encoder: encoder ONNX (clip_onnx) thay cho model PyTorch nếu có.
+    """
+    ranking_cfg = configs["frame_ranking"]
+    encoder = image_encoder or TorchClipEncoder(model)
+
+    logger.info(f"Embedding {len(frame_paths)} images (pipelined decode / preprocess / CLIP)...")
+    emb, valid_idx, stats = embed_pipelined(
+        frame_paths,
+        encoder,
+        batch_size=batch_size,
+        n_decoders=int(ranking_cfg.get("decode_workers", max(2, cpu_count() // 2))),
+        prefetch_batches=int(ranking_cfg.get("prefetch_batches", 4)),
+    )
+    stats.log()
+    EMBED_STATS_PATH.write_text(json.dumps(stats.summary(), indent=2), encoding="utf-8")
+
+    if not valid_idx:
         raise RuntimeError("No valid frames found to embed.")
 
-    imgs, valid_paths = zip(*valid_pairs)
-    imgs = list(imgs)
-    valid_paths = list(valid_paths)
-
-    logger.info(f"Valid frames: {len(imgs)}. Starting CLIP embedding...")
-
-    all_embs = []
-
-    for i in range(0, len(imgs), batch_size):
-        batch = imgs[i:i + batch_size]
-        emb = model.encode(batch, convert_to_tensor=True, batch_size=batch_size, show_progress_bar=False)
-        all_embs.append(emb)
-
-    frame_emb = torch.cat(all_embs, dim=0)
+    frame_emb = torch.from_numpy(emb)
+    valid_paths = [frame_paths[i] for i in valid_idx]
     logger.info(f"Created {frame_emb.shape[0]} embeddings.")
 
     return frame_emb, valid_paths
 
 
-def embed_text(query, model):
-    return model.encode([query], convert_to_tensor=True, show_progress_bar=False)
-
-def retrieve_best_frames(query, model, frame_emb, frame_paths, top_k):
-    q_emb = embed_text(query, model)
-    hits = util.semantic_search(q_emb, frame_emb, top_k=top_k)[0]
-
-    return [(hit["score"], frame_paths[hit["corpus_id"]]) for hit in hits]
-
-def process_all_subplots(model, frame_emb, frame_paths):
-    top_k = configs["frame_ranking"]["n_retrieved_images"]
+def save_frame_embeddings(frame_emb, row_frame_ids, row_paths):
+    """Dòng i của embedding tương ứng frame_id row_frame_ids[i] trong catalog."""
+    torch.save(
+        {
+            "emb": frame_emb.cpu(),
+            "frame_ids": list(row_frame_ids),
+            "paths": [str(p) for p in row_paths],
+        },
+        FRAME_EMB_PATH,
+    )
+    logger.info(f"Saved frame embeddings to {FRAME_EMB_PATH.name}")
+
+def load_frame_embeddings():
+    if not FRAME_EMB_PATH.exists():
+        raise FileNotFoundError(f"{FRAME_EMB_PATH} not found. Run with --stage embed first.")
+    data = torch.load(FRAME_EMB_PATH)
+    return data["emb"], data["frame_ids"], [Path(p) for p in data["paths"]]
+
+def build_frame_index(frame_emb, row_paths):
+    """
+    Index embedding frame; id trong index = số thứ tự dòng trong frame_embeddings.pt.
+    Incremental: mở index đã lưu và chỉ add các dòng mới (vd. thêm video nguồn) nếu
+    các dòng cũ vẫn là cùng ảnh (path + fingerprint), cùng model; đổi kind / dim /
+    tham số / model thì build lại.
+    """
+    ranking_cfg = configs["frame_ranking"]
+    kind = ranking_cfg.get("index", "exact")
+    params = {}
+    if kind == "ivf":
+        params = {
+            "n_lists": int(ranking_cfg.get("index_n_lists", 256)),
+            "n_probe": int(ranking_cfg.get("index_n_probe", 8)),
+        }
+
+    index, n_added = sync_index(
+        FRAME_INDEX_DIR,
+        frame_emb.cpu().float().numpy(),
+        [f"{p}:{file_fingerprint(p)}" for p in row_paths],
+        kind,
+        tag=f"{ranking_cfg['model_id']}|{ranking_cfg.get('backend', 'torch')}",
+        **params,
+    )
+    logger.info(f"{kind} frame index: {len(index)} vectors ({n_added} added).")
+    return index
+
+def retrieve_best_frames(row_scores, top_k):
+    """
+    Top-k (argpartition) trên ma trận điểm subplot x embedding row mà index đã chấm.
+    Trả về list (mỗi subplot) các [(score, embedding row)] theo thứ tự điểm giảm dần;
+    dòng index không chấm (-inf, ngoài các cụm IVF được probe) bị bỏ.
+    """
+    if len(row_scores) == 0:
+        return []
+    top = top_k_indices(row_scores, top_k)
+    return [
+        [(float(row[i]), int(i)) for i in cols if np.isfinite(row[i])]
+        for row, cols in zip(row_scores, top)
+    ]
+
+def process_all_subplots(model, index, row_frame_ids, row_paths):
+    """Xếp hạng frame cho mọi subplot, ghi kết quả vào ranking manifest."""
+    ranking_cfg = configs["frame_ranking"]
+    top_k = ranking_cfg["n_retrieved_images"]
 
     if FRAMES_RANKING_DIR.exists():
         shutil.rmtree(FRAMES_RANKING_DIR)
@@ -94,33 +151,113 @@ def process_all_subplots(model, frame_emb, frame_paths):
 
     subplot_files = sorted(SUBPLOTS_DIR.glob("scene_*/*.txt"),
                            key=lambda p: int(p.parent.name.split("_")[1]))
+    scene_names = [f.parent.name for f in subplot_files]
+    texts = [f.read_text().strip() for f in subplot_files]
 
-    for subplot_file in subplot_files:
-        text = subplot_file.read_text().strip()
-        scene_name = subplot_file.parent.name
+    with FrameCatalog() as catalog:
+        cols = catalog.arrays()
 
-        logger.info(f"Retrieving frames for: {scene_name}")
+    # Điểm subplot x embedding row do index chấm (exact: mọi dòng, ivf: chỉ các
+    # cụm được probe), rồi mở rộng ra mọi frame trong catalog (frame gần trùng
+    # dùng chung dòng embedding của đại diện). Dòng không được chấm = -1.
+    q = model.encode(texts, convert_to_numpy=True, show_progress_bar=False) if texts else np.zeros((0, index.dim))
+    row_scores = index.score_rows(q, len(row_frame_ids))
 
-        ranked = retrieve_best_frames(text, model, frame_emb, frame_paths, top_k)
+    has_row = cols["emb_row"] >= 0
+    scores = np.full((len(texts), len(cols["frame_id"])), -1.0, dtype=np.float32)
+    scores[:, has_row] = np.where(np.isfinite(row_scores), row_scores, -1.0)[:, cols["emb_row"][has_row]]
 
-        out_dir = FRAMES_RANKING_DIR / scene_name
-        out_dir.mkdir(parents=True, exist_ok=True)
+    col_of = {int(fid): j for j, fid in enumerate(cols["frame_id"])}
+    topk_cols = np.full((len(texts), top_k), -1, dtype=np.int64)
+    topk_scores = np.full((len(texts), top_k), -1.0, dtype=np.float32)
 
-        for score, frame_path in ranked:
-            score_str = f"{score:.4f}"
-            out_path = out_dir / f"{score_str}_{frame_path.name}"
-            shutil.copy(frame_path, out_path)
+    for i, (scene_name, ranked) in enumerate(zip(scene_names, retrieve_best_frames(row_scores, top_k))):
+        logger.info(f"Retrieving frames for: {scene_name}")
+
+        for j, (score, row) in enumerate(ranked):
+            topk_cols[i, j] = col_of[row_frame_ids[row]]
+            topk_scores[i, j] = score
+
+        # Ảnh copy chỉ để debug: <score>_<frame_id>.jpg
+        if ranking_cfg.get("debug_copy_images", False):
+            out_dir = FRAMES_RANKING_DIR / scene_name
+            out_dir.mkdir(parents=True, exist_ok=True)
+            for score, row in ranked:
+                shutil.copy(row_paths[row], out_dir / f"{score:.4f}_{row_frame_ids[row]}.jpg")
+
+    RankingManifest(
+        scene_names=scene_names,
+        frame_ids=cols["frame_id"],
+        video_ids=cols["video_id"],
+        timestamps=cols["timestamp"],
+        scores=scores,
+        topk_cols=topk_cols,
+        topk_scores=topk_scores,
+    ).save(RANKING_MANIFEST_PATH)
+    logger.info(f"Saved ranking manifest: {len(scene_names)} subplots x {scores.shape[1]} frames.")
+
+def run_embed_stage(model):
+    """Bước chỉ cần video: embed toàn bộ frame (chạy song song với bước LLM)."""
+    with FrameCatalog() as catalog:
+        records = collect_all_frames(catalog)
+        all_frames = [r.image_path for r in records]
+
+        # Gộp frame gần trùng (HUD tĩnh, menu, loading) -> chỉ embed frame đại diện
+        ranking_cfg = configs["frame_ranking"]
+        if ranking_cfg.get("dedup", True):
+            rep_frames, clusters = dedup_frames(
+                all_frames,
+                max_distance=int(ranking_cfg.get("dedup_max_distance", 6)),
+                method=ranking_cfg.get("dedup_method", "dhash"),
+            )
+            DEDUP_CLUSTERS_PATH.write_text(
+                json.dumps({str(rep): [str(m) for m in members] for rep, members in clusters.items()}, indent=2),
+                encoding="utf-8",
+            )
+        else:
+            rep_frames, clusters = all_frames, {p: [p] for p in all_frames}
+
+        batch_size = configs["frame_ranking"]["similarity_batch_size"]
+        frame_emb, valid_rep_paths = embed_images(
+            rep_frames, model, batch_size, image_encoder=load_image_encoder(model)
+        )
+
+        # Mọi frame trong cụm dùng chung dòng embedding của frame đại diện
+        frame_id_of = {r.image_path: r.frame_id for r in records}
+        row_of = {path: row for row, path in enumerate(valid_rep_paths)}
+        member_ids, member_rows = [], []
+        for rep, members in clusters.items():
+            if rep in row_of:
+                member_ids += [frame_id_of[m] for m in members]
+                member_rows += [row_of[rep]] * len(members)
+        catalog.set_embedding_rows(member_ids, member_rows)
+
+    row_frame_ids = [frame_id_of[p] for p in valid_rep_paths]
+    save_frame_embeddings(frame_emb, row_frame_ids, valid_rep_paths)
+    index = build_frame_index(frame_emb, valid_rep_paths)
+    return index, row_frame_ids, valid_rep_paths
+
+def run_rank_stage(model, index=None, row_frame_ids=None, row_paths=None):
+    """Bước cần subplot: xếp hạng frame theo từng subplot."""
+    if index is None:
+        _, row_frame_ids, row_paths = load_frame_embeddings()
+        index = load_index(FRAME_INDEX_DIR)
+    process_all_subplots(model, index, row_frame_ids, row_paths)
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Embed frames and rank them against subplots.")
+    ap.add_argument("--stage", choices=["embed", "rank", "all"], default="all")
+    args = ap.parse_args()
+
     logger.info("\nStarting Frame Retrieval Pipeline\n")
 
     model = load_model()
 
-    all_frames = collect_all_frames()
-
-    batch_size = configs["frame_ranking"]["similarity_batch_size"]
-    frame_emb, valid_frame_paths = embed_images(all_frames, model, batch_size)
-
-    process_all_subplots(model, frame_emb, valid_frame_paths)
+    if args.stage == "embed":
+        run_embed_stage(model)
+    elif args.stage == "rank":
+        run_rank_stage(model)
+    else:
+        run_rank_stage(model, *run_embed_stage(model))
 
     logger.info("\n##### Frame Retrieval Completed Successfully #####\n")
@@ -1,7 +1,12 @@
 from pathlib import Path
+import numpy as np
 # Thêm AudioFileClip, CompositeAudioClip, afx để xử lý nhạc
-from moviepy.editor import VideoFileClip, concatenate_videoclips, AudioFileClip, CompositeAudioClip, afx
+from moviepy.editor import AudioFileClip, CompositeAudioClip, afx
+from beat_grid import best_offset, music_beat_grid
 from common import AUDIO_CLIPS_DIR, TRAILER_DIR, configs
+from loudness import gain_to_target, limit_audio, load_stats
+from video_probe import probe_video
+from video_reader import concat_videos, open_video, log_peak_memory
 
 # --- CẤU HÌNH ---
 # Số subplot (scene)
@@ -9,6 +14,9 @@ n_subplots = configs["subplot"]["n_subplots"]
 # Định nghĩa đường dẫn file nhạc (nằm cùng cấp với các folder output trong project)
 MUSIC_PATH = AUDIO_CLIPS_DIR.parent / "background_music.wav"
 
+# File nối tạm (chưa có nhạc), để ngoài TRAILER_DIR để UI không nhầm là trailer
+JOINED_PATH = AUDIO_CLIPS_DIR / "joined_nomusic.mp4"
+
 TRAILER_DIR.mkdir(parents=True, exist_ok=True)
 clips = []
 print("Collecting scene clips...")
@@ -25,33 +33,62 @@ for i in range(1, n_subplots + 1):
     video_path = scene_clips[0]
     print(f"Scene {i}: Using {video_path}")
 
-    clip = VideoFileClip(str(video_path))
-    clips.append(clip)
+    # Chỉ lưu đường dẫn, không mở reader cho từng clip
+    clips.append(video_path)
 if not clips:
     raise RuntimeError("No clips found to join. Check audio_clip.py output.")
 
 print(f"Joining {len(clips)} scene clips...")
-final = concatenate_videoclips(clips, method="compose")
+concat_videos(clips, JOINED_PATH)
+
+output = TRAILER_DIR / "trailer_1.mp4"
 
 # --- THÊM NHẠC NỀN & LOOP ---
 if MUSIC_PATH.exists():
     print(f"Found background music: {MUSIC_PATH.name}")
-    try:
-        bg_music = AudioFileClip(str(MUSIC_PATH))
-        bg_music = afx.audio_loop(bg_music, duration=final.duration)
-        bg_music = bg_music.volumex(0.5)
-        original_audio = final.audio
-        final_mixed_audio = CompositeAudioClip([original_audio, bg_music])
-        final = final.set_audio(final_mixed_audio)
-        print("Background music added and looped successfully.")
-        
-    except Exception as e:
-        print(f"Error adding background music: {e}")
+    with open_video(JOINED_PATH) as final:
+        try:
+            bg_music = AudioFileClip(str(MUSIC_PATH))
+
+            # Beat sync: bắt đầu nhạc lệch 1 đoạn sao cho các điểm cắt giữa scene rơi đúng beat
+            grid = music_beat_grid(MUSIC_PATH, configs.get("beat_sync", {}))
+            if grid is not None:
+                cuts = np.cumsum([probe_video(clip).duration for clip in clips])[:-1]
+                offset = best_offset(cuts, grid)
+                if 0 < offset < bg_music.duration:
+                    bg_music = bg_music.subclip(offset)
+                print(f"Beat sync: {grid.tempo_bpm:.1f} BPM, music starts at {offset:.3f}s")
+            bg_music = afx.audio_loop(bg_music, duration=final.duration)
+
+            # Voice mỗi scene đã ở target_lufs (audio_clip.py) -> đặt nhạc thấp hơn
+            # một khoảng cố định, gain lấy từ thống kê music_gen.py đã ghi sẵn
+            loud_cfg = configs.get("loudness", {})
+            if loud_cfg.get("enabled", False):
+                music_target = float(loud_cfg.get("target_lufs", -16.0)) - float(loud_cfg.get("music_below_voice_lu", 14.0))
+                music_gain = gain_to_target(load_stats(MUSIC_PATH), music_target)
+                print(f"Music gain: {music_gain:.3f} (target {music_target:.1f} LUFS)")
+            else:
+                music_gain = 0.5
+            bg_music = bg_music.volumex(music_gain)
+            original_audio = final.audio
+            final_mixed_audio = CompositeAudioClip([original_audio, bg_music])
+            if loud_cfg.get("enabled", False):
+                ceiling_db = float(loud_cfg.get("ceiling_db", -1.0))
+                final_mixed_audio = final_mixed_audio.fl(
+                    lambda gf, t: limit_audio(gf, t, final.duration, ceiling_db)
+                )
+            final = final.set_audio(final_mixed_audio)
+            print("Background music added and looped successfully.")
+
+        except Exception as e:
+            print(f"Error adding background music: {e}")
+
+        # --- XUẤT FILE ---
+        final.write_videofile(str(output), codec="libx264", audio_codec="aac")
+    JOINED_PATH.unlink(missing_ok=True)
 else:
     print("No background music found. Skipping.")
-
-# --- XUẤT FILE ---
-output = TRAILER_DIR / "trailer_1.mp4"
-final.write_videofile(str(output), codec="libx264", audio_codec="aac")
+    JOINED_PATH.replace(output)
 
 print(f"Trailer created → {output}")
+log_peak_memory("join_clip")
@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from pathlib import Path
+from typing import Callable
+
+from common import CACHE_DIR, configs
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_DIR = CACHE_DIR / "llm"
+
+# Danh sách ưu tiên (Model ổn định trước)
+MODEL_PRIORITIES = [
+    "models/gemini-1.5-flash",
+    "models/gemini-1.5-pro",
+    "models/gemini-pro",
+    "models/gemini-1.0-pro",
+]
+
+
+class RateLimitError(RuntimeError):
+    """Backend báo hết quota (HTTP 429) - lỗi có thể thử lại."""
+
+
+def _write_json(path: Path, data) -> None:
+    """Ghi qua file tạm rồi replace: nhiều tiến trình (batch) dùng chung 1 cache."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+def _read_json(path: Path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self):
+        import google.generativeai as genai
+        from google.api_core import exceptions
+
+        api_key = os.getenv("GEMINI_API_KEY") or configs.get("gemini_api_key")
+        if not api_key:
+            raise RuntimeError("Thiếu GEMINI_API_KEY.")
+        genai.configure(api_key=api_key)
+
+        self._genai = genai
+        self._exceptions = exceptions
+
+    async def list_models(self) -> list[str]:
+        def _list():
+            return [
+                m.name for m in self._genai.list_models()
+                if "generateContent" in m.supported_generation_methods
+            ]
+        return await asyncio.to_thread(_list)
+
+    async def generate(self, model: str, prompt: str, generation_config: dict | None = None) -> str:
+        gm = self._genai.GenerativeModel(model)
+        try:
+            response = await gm.generate_content_async(prompt, generation_config=generation_config)
+        except self._exceptions.ResourceExhausted as e:
+            raise RateLimitError(str(e)) from e
+        return response.text
+
+
+class FakeBackend:
+    """
+    Backend offline để chạy / test pipeline không cần mạng.
+    responder(model, prompt) -> text. Có thể giả lập độ trễ và lỗi 429.
+    """
+    name = "fake"
+
+    def __init__(
+        self,
+        responder: Callable[[str, str], str] | None = None,
+        models: list[str] | None = None,
+        latency: float = 0.0,
+        rate_limit_failures: int = 0,
+    ):
+        self.responder = responder or default_fake_responder
+        self.models = models or list(MODEL_PRIORITIES)
+        self.latency = latency
+        self.rate_limit_failures = rate_limit_failures
+        self.calls = 0
+
+    async def list_models(self) -> list[str]:
+        return list(self.models)
+
+    async def generate(self, model: str, prompt: str, generation_config: dict | None = None) -> str:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_limit_failures > 0:
+            self.rate_limit_failures -= 1
+            raise RateLimitError("fake quota exceeded")
+        return self.responder(model, prompt)
+
+
+def default_fake_responder(model: str, prompt: str) -> str:
+    """Trả lời "hợp lệ" cho 2 prompt của pipeline dựa trên nội dung prompt."""
+    if '"intro_text"' in prompt:
+        return json.dumps({
+            "tone": "dark, epic",
+            "intro_text": "A new legend rises.",
+            "outro_text": "Join the battle.",
+            "music_style": "epic orchestral",
+        })
+
+    plot = prompt.rsplit("PLOT:", 1)[-1].strip()
+    m = re.search(r"exactly (\d+) subplots", prompt)
+    n = int(m.group(1)) if m else 6
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", plot) if s.strip()] or [plot]
+    return json.dumps([sentences[i % len(sentences)] for i in range(n)])
+
+
+class AsyncLLMClient:
+    """
+    Lớp gọi LLM bất đồng bộ:
+    - giới hạn số request đồng thời (semaphore) + timeout mỗi request
+    - retry với exponential backoff + jitter khi bị 429 / timeout
+    - cache danh sách model (TTL) và cache response theo hash(model, prompt, config)
+    """
+
+    def __init__(
+        self,
+        backend,
+        cache_dir: Path = LLM_CACHE_DIR,
+        max_concurrency: int = 4,
+        timeout: float = 60.0,
+        max_retries: int = 4,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0,
+        model_list_ttl: float = 24 * 3600,
+        cache_responses: bool = True,
+    ):
+        self.backend = backend
+        self.cache_dir = Path(cache_dir)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.model_list_ttl = model_list_ttl
+        self.cache_responses = cache_responses
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._models: list[str] | None = None
+
+    # ---------- model list ----------
+    async def list_models(self) -> list[str]:
+        if self._models is not None:
+            return self._models
+
+        cache_path = self.cache_dir / f"models_{self.backend.name}.json"
+        cached = _read_json(cache_path)
+        if cached and time.time() - cached.get("fetched_at", 0) < self.model_list_ttl:
+            self._models = cached["models"]
+            return self._models
+
+        self._models = await self.backend.list_models()
+        _write_json(cache_path, {"fetched_at": time.time(), "models": self._models})
+        return self._models
+
+    async def pick_model(self, priorities: list[str] = MODEL_PRIORITIES) -> str:
+        try:
+            available = await self.list_models()
+        except Exception as e:
+            logger.error(f"Lỗi khi dò tìm model: {e}")
+            return "models/gemini-pro"
+
+        for p in priorities:
+            if p in available:
+                logger.info(f"-> Đã chọn model: {p}")
+                return p
+        if available:
+            return available[0]
+        raise RuntimeError("Không tìm thấy model nào hỗ trợ generateContent.")
+
+    # ---------- generation ----------
+    def _cache_path(self, model: str, prompt: str, generation_config: dict | None) -> Path:
+        key = json.dumps([model, prompt, generation_config or {}], sort_keys=True)
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.cache_dir / "responses" / f"{digest}.json"
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # "Full jitter": ngẫu nhiên trong [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def generate(
+        self,
+        prompt: str,
+        model: str | None = None,
+        generation_config: dict | None = None,
+        parse: Callable[[str], object] | None = None,
+    ):
+        """
+        parse: hàm parse / kiểm tra response của caller. Response chỉ được cache khi
+        parse thành công; response cache mà parse lỗi thì bị xoá và gọi lại model.
+        Trả về parse(text) nếu có, ngược lại text.
+        """
+        model = model or await self.pick_model()
+        parse = parse or (lambda text: text)
+
+        cache_path = self._cache_path(model, prompt, generation_config)
+        cached = _read_json(cache_path) if self.cache_responses else None
+        if cached is not None:
+            try:
+                result = parse(cached["text"])
+                logger.info(f"LLM cache hit ({model})")
+                return result
+            except Exception as e:
+                logger.warning(f"Cached LLM response is invalid ({e}), regenerating")
+                cache_path.unlink(missing_ok=True)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    text = await asyncio.wait_for(
+                        self.backend.generate(model, prompt, generation_config),
+                        timeout=self.timeout,
+                    )
+                break
+            except (RateLimitError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise RuntimeError("Đã hết số lần thử lại (Max Retries).") from e
+                delay = self._backoff_delay(attempt)
+                reason = "Hết Quota (429)" if isinstance(e, RateLimitError) else "Timeout"
+                logger.warning(f"{reason}. Đang nghỉ {delay:.1f}s rồi thử lại...")
+                await asyncio.sleep(delay)
+
+        # Parse lỗi -> ném lỗi và không cache, lần chạy sau sẽ gọi lại model
+        result = parse(text)
+        if self.cache_responses:
+            _write_json(cache_path, {"model": model, "text": text})
+        return result
+
+
+def make_client() -> AsyncLLMClient:
+    """Tạo client theo mục `llm` trong configs.yaml."""
+    llm_cfg = configs.get("llm", {})
+    backend_name = llm_cfg.get("backend", "gemini")
+
+    if backend_name == "fake":
+        backend = FakeBackend()
+    elif backend_name == "gemini":
+        backend = GeminiBackend()
+    else:
+        raise ValueError(f"Unknown llm backend: {backend_name}")
+
+    return AsyncLLMClient(
+        backend,
+        max_concurrency=int(llm_cfg.get("max_concurrency", 4)),
+        timeout=float(llm_cfg.get("timeout_sec", 60)),
+        max_retries=int(llm_cfg.get("max_retries", 4)),
+        backoff_base=float(llm_cfg.get("backoff_base_sec", 2)),
+        backoff_max=float(llm_cfg.get("backoff_max_sec", 60)),
+        model_list_ttl=float(llm_cfg.get("model_list_ttl_hours", 24)) * 3600,
+        cache_responses=bool(llm_cfg.get("cache_responses", True)),
+    )
@@ -0,0 +1,300 @@
+import json
+import logging
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+from scipy.ndimage import minimum_filter1d, uniform_filter1d
+from scipy.signal import lfilter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ITU-R BS.1770: block 400ms, chồng 75%, gate tuyệt đối -70 LUFS, gate tương đối -10 LU
+BLOCK_SEC = 0.4
+BLOCK_STEP_SEC = 0.1
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+
+
+@dataclass
+class LoudnessStats:
+    integrated_lufs: float   # -inf nếu im lặng
+    peak_db: float           # sample peak (dBFS)
+    duration: float
+    sample_rate: int
+    source_size: int = 0     # để biết file audio đã bị ghi đè sau khi đo
+    source_mtime: float = 0.0
+
+
+def k_weighting_filters(sr: int):
+    """Hai biquad K-weighting (high shelf + high pass) tính lại cho sample rate bất kỳ."""
+    # High shelf (+4 dB trên ~1.7 kHz)
+    gain_db, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    k = np.tan(np.pi * fc / sr)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    shelf_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    # High pass (~38 Hz)
+    q, fc = 0.5003270373238773, 38.13547087602444
+    k = np.tan(np.pi * fc / sr)
+    a0 = 1 + k / q + k * k
+    hp_b = [1.0, -2.0, 1.0]
+    hp_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return (shelf_b, shelf_a), (hp_b, hp_a)
+
+
+def _as_channels(samples: np.ndarray) -> np.ndarray:
+    """(N,) hoặc (N, C) -> (C, N) float64."""
+    x = np.asarray(samples, dtype=np.float64)
+    return x[None, :] if x.ndim == 1 else x.T
+
+
+def _lufs(power):
+    with np.errstate(divide="ignore"):
+        return -0.691 + 10 * np.log10(power)
+
+
+def gated_loudness(powers: np.ndarray) -> float:
+    """Loudness tích hợp từ năng lượng các block (gate tuyệt đối rồi gate tương đối)."""
+    if len(powers) == 0:
+        return float("-inf")
+    loud = _lufs(powers)
+
+    gated = powers[loud > ABSOLUTE_GATE_LUFS]
+    if len(gated) == 0:
+        return float("-inf")
+    relative_gate = _lufs(gated.mean()) + RELATIVE_GATE_LU
+
+    gated = powers[(loud > ABSOLUTE_GATE_LUFS) & (loud > relative_gate)]
+    return float(_lufs(gated.mean()))
+
+
+class LoudnessMeter:
+    """
+    Đo loudness theo từng chunk (giữ trạng thái filter + phần block còn dở),
+    để đo được audio đang sinh / đang ghi mà không cần giữ cả file trong RAM.
+    Chỉ lưu năng lượng mỗi block (10 số / giây).
+    """
+
+    def __init__(self, sr: int):
+        self.sr = int(sr)
+        (self.shelf_b, self.shelf_a), (self.hp_b, self.hp_a) = k_weighting_filters(sr)
+        self.block = int(round(BLOCK_SEC * sr))
+        self.step = int(round(BLOCK_STEP_SEC * sr))
+        self.zi = None
+        self.pending = None   # bình phương tín hiệu từ đầu block kế tiếp trở đi
+        self.powers = []
+        self.peak = 0.0
+        self.n_samples = 0
+
+    def add(self, samples: np.ndarray) -> None:
+        x = _as_channels(samples)
+        if x.shape[1] == 0:
+            return
+        if self.zi is None:
+            self.zi = (np.zeros((x.shape[0], 2)), np.zeros((x.shape[0], 2)))
+            self.pending = np.zeros((x.shape[0], 0))
+        self.peak = max(self.peak, float(np.max(np.abs(x))))
+        self.n_samples += x.shape[1]
+
+        y, zi_shelf = lfilter(self.shelf_b, self.shelf_a, x, axis=1, zi=self.zi[0])
+        y, zi_hp = lfilter(self.hp_b, self.hp_a, y, axis=1, zi=self.zi[1])
+        self.zi = (zi_shelf, zi_hp)
+
+        sq = np.concatenate([self.pending, y ** 2], axis=1)
+        n_blocks = (sq.shape[1] - self.block) // self.step + 1 if sq.shape[1] >= self.block else 0
+        if n_blocks:
+            # Mean square mọi block cùng lúc bằng cumsum
+            csum = np.concatenate([np.zeros((sq.shape[0], 1)), np.cumsum(sq, axis=1)], axis=1)
+            starts = np.arange(n_blocks) * self.step
+            self.powers.extend(((csum[:, starts + self.block] - csum[:, starts]) / self.block).sum(axis=0))
+            sq = sq[:, n_blocks * self.step:]
+        self.pending = sq
+
+    def block_powers(self) -> np.ndarray:
+        if not self.powers and self.pending is not None and self.pending.shape[1]:
+            # Audio ngắn hơn 1 block: coi cả đoạn là 1 block
+            return np.array([self.pending.mean(axis=1).sum()])
+        return np.array(self.powers)
+
+    def stats(self) -> "LoudnessStats":
+        with np.errstate(divide="ignore"):
+            peak_db = float(20 * np.log10(self.peak)) if self.peak > 0 else float("-inf")
+        return LoudnessStats(
+            integrated_lufs=gated_loudness(self.block_powers()),
+            peak_db=peak_db,
+            duration=self.n_samples / self.sr,
+            sample_rate=self.sr,
+        )
+
+
+def integrated_loudness(samples: np.ndarray, sr: int) -> float:
+    return measure(samples, sr).integrated_lufs
+
+
+def measure(samples: np.ndarray, sr: int) -> LoudnessStats:
+    meter = LoudnessMeter(sr)
+    meter.add(samples)
+    return meter.stats()
+
+
+def db_to_gain(db: float) -> float:
+    return float(10 ** (db / 20))
+
+
+def gain_to_target(stats: LoudnessStats, target_lufs: float, max_gain_db: float = 24.0) -> float:
+    """Hệ số nhân để đưa audio về target_lufs (giới hạn max_gain_db cho đoạn gần im lặng)."""
+    if not np.isfinite(stats.integrated_lufs):
+        return 1.0
+    return db_to_gain(min(target_lufs - stats.integrated_lufs, max_gain_db))
+
+
+def limiter_gain(samples: np.ndarray, sr: float, ceiling_db: float = -1.0,
+                 attack_ms: float = 5.0, release_ms: float = 50.0) -> np.ndarray:
+    """
+    Gain theo từng mẫu của limiter nhìn trước (lookahead), giống alimiter của ffmpeg:
+    gain cần thiết = min(1, ceiling / |x|), giữ mức thấp nhất trong cửa sổ
+    [n - release, n + attack) rồi làm mượt bằng trung bình trượt dài attack.
+    Mỗi giá trị trung bình đều <= gain cần thiết tại n nên đỉnh không vượt ceiling,
+    còn gain đổi dần trong vài ms thay vì bẻ dạng sóng như clipper.
+    """
+    x = np.asarray(samples, dtype=np.float64)
+    peak = np.abs(x).max(axis=1) if x.ndim > 1 else np.abs(x)
+    need = np.minimum(1.0, db_to_gain(ceiling_db) / np.maximum(peak, 1e-12))
+    if len(need) == 0 or need.min() >= 1.0:
+        return np.ones(len(need))
+    attack = max(1, int(round(sr * attack_ms / 1000)))
+    release = max(1, int(round(sr * release_ms / 1000)))
+    size = attack + release
+    held = minimum_filter1d(need, size, mode="nearest", origin=release - size // 2)
+    return uniform_filter1d(held, attack, mode="nearest", origin=(attack - 1) // 2)
+
+
+def _apply_gain(x: np.ndarray, gain: np.ndarray, ceiling_db: float) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float64)
+    out = x * (gain[:, None] if x.ndim > 1 else gain)
+    # Sai số làm tròn của trung bình trượt
+    ceiling = db_to_gain(ceiling_db)
+    return np.clip(out, -ceiling, ceiling)
+
+
+class Limiter:
+    """
+    Limiter chạy theo block liên tiếp (ghi file theo sf.blocks): giữ lại phần đuôi
+    làm ngữ cảnh và trễ đầu ra đúng 1 cửa sổ attack để luôn nhìn trước được.
+    Gọi flush() ở cuối để lấy phần còn lại.
+    """
+
+    def __init__(self, sr: int, ceiling_db: float = -1.0, attack_ms: float = 5.0, release_ms: float = 50.0):
+        self.sr = int(sr)
+        self.ceiling_db = ceiling_db
+        self.attack_ms, self.release_ms = attack_ms, release_ms
+        self.attack = max(1, int(round(sr * attack_ms / 1000)))
+        self.context = self.attack + max(1, int(round(sr * release_ms / 1000)))
+        self.buf = None
+        self.done = 0   # số mẫu đầu buf đã xuất (chỉ còn làm ngữ cảnh)
+
+    def _gain(self, buf):
+        return limiter_gain(buf, self.sr, self.ceiling_db, self.attack_ms, self.release_ms)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        block = np.asarray(block, dtype=np.float64)
+        buf = block if self.buf is None else np.concatenate([self.buf, block])
+        ready = len(buf) - self.attack
+        if ready <= self.done:
+            self.buf = buf
+            return buf[:0]
+        out = _apply_gain(buf[self.done:ready], self._gain(buf)[self.done:ready], self.ceiling_db)
+        keep = max(0, ready - self.context)
+        self.buf, self.done = buf[keep:], ready - keep
+        return out
+
+    def flush(self) -> np.ndarray:
+        if self.buf is None:
+            return np.zeros(0)
+        buf, self.buf = self.buf, None
+        return _apply_gain(buf[self.done:], self._gain(buf)[self.done:], self.ceiling_db)
+
+
+def limit_audio(get_frame, t, duration: float, ceiling_db: float = -1.0,
+                attack_ms: float = 5.0, release_ms: float = 50.0) -> np.ndarray:
+    """
+    Limiter cho clip.fl(lambda gf, t: limit_audio(gf, t, clip.duration)) của MoviePy:
+    đọc thêm ngữ cảnh trước / sau chunk từ get_frame nên không có trạng thái
+    mà vẫn nối liền giữa các chunk.
+    """
+    t = np.asarray(t, dtype=np.float64)
+    if t.ndim == 0 or len(t) < 2:
+        return soft_clip(get_frame(t), ceiling_db)
+    fps = 1.0 / (t[1] - t[0])
+    attack = max(1, int(round(fps * attack_ms / 1000)))
+    before = attack + max(1, int(round(fps * release_ms / 1000)))
+    t_ext = np.concatenate([t[0] - np.arange(before, 0, -1) / fps, t, t[-1] + np.arange(1, attack + 1) / fps])
+    t_ext = np.clip(t_ext, 0.0, max(0.0, duration - 1.0 / fps))
+    x = np.asarray(get_frame(t_ext), dtype=np.float64)
+    gain = limiter_gain(x, fps, ceiling_db, attack_ms, release_ms)[before:before + len(t)]
+    return _apply_gain(x[before:before + len(t)], gain, ceiling_db)
+
+
+def soft_clip(samples: np.ndarray, ceiling_db: float = -1.0, knee_db: float = 1.0) -> np.ndarray:
+    """
+    Clipper mềm không trạng thái (tanh trong knee_db cuối dưới ceiling). Chỉ dùng
+    khi không có ngữ cảnh cho limiter (1 frame lẻ); knee hẹp để đỉnh bình thường
+    không bị bẻ méo.
+    """
+    ceiling = db_to_gain(ceiling_db)
+    threshold = db_to_gain(ceiling_db - knee_db)
+    x = np.asarray(samples, dtype=np.float64)
+    mag = np.abs(x)
+    over = mag > threshold
+    if not over.any():
+        return x
+    room = ceiling - threshold
+    out = x.copy()
+    out[over] = np.sign(x[over]) * (threshold + room * np.tanh((mag[over] - threshold) / room))
+    return out
+
+
+# --------------------------------------------------
+# Sidecar <audio>.loudness.json, ghi ngay khi audio được sinh ra
+# --------------------------------------------------
+def stats_path(audio_path: Path) -> Path:
+    audio_path = Path(audio_path)
+    return audio_path.with_name(audio_path.stem + ".loudness.json")
+
+
+def save_stats(audio_path: Path, stats: LoudnessStats) -> LoudnessStats:
+    st = Path(audio_path).stat()
+    stats.source_size, stats.source_mtime = st.st_size, st.st_mtime
+    stats_path(audio_path).write_text(json.dumps(asdict(stats), indent=2), encoding="utf-8")
+    return stats
+
+
+def measure_file(audio_path: Path) -> LoudnessStats:
+    import soundfile as sf
+
+    # Đọc theo block để file dài (nhạc nền) không phải nằm trọn trong RAM
+    meter = LoudnessMeter(sf.info(str(audio_path)).samplerate)
+    for block in sf.blocks(str(audio_path), blocksize=1 << 16, dtype="float64"):
+        meter.add(block)
+    return save_stats(audio_path, meter.stats())
+
+
+def load_stats(audio_path: Path) -> LoudnessStats:
+    """Đọc sidecar; nếu thiếu hoặc audio đã đổi thì đo lại (chỉ đọc wav, không decode video)."""
+    audio_path = Path(audio_path)
+    path = stats_path(audio_path)
+    if path.exists():
+        try:
+            stats = LoudnessStats(**json.loads(path.read_text(encoding="utf-8")))
+            st = audio_path.stat()
+            if stats.source_size == st.st_size and stats.source_mtime == st.st_mtime:
+                return stats
+        except Exception:
+            pass
+    logger.info(f"Measuring loudness: {audio_path.name}")
+    return measure_file(audio_path)
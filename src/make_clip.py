@@ -1,51 +1,82 @@
 import logging 
-import re
+import sys
+import json
 from pathlib import Path
-from moviepy.editor import VideoFileClip, AudioFileClip
+from moviepy.editor import AudioFileClip
 
+from beat_grid import music_beat_grid
 from common import (
     CLIPS_DIR,
+    PROJECT_DIR,
     VOICES_DIR, 
     SUBPLOTS_DIR,
-    FRAMES_RANKING_DIR,
     list_scenes,
     configs
 )
+from frame_catalog import FrameCatalog
+from proxy import proxy_enabled, working_video
+from ranking_manifest import RANKING_MANIFEST_PATH, RankingManifest
+from scene_state import SceneState, content_key, subplot_text
+from segment_scorer import best_window
+from video_reader import open_video, log_peak_memory
 
-# Lấy đường dẫn video gốc
-ROOT = Path(__file__).resolve().parents[1]
-VIDEO_PATH = ROOT / "projects" / "LOL" / "video_input.mp4"
+# Danh sách đoạn đã chọn, dùng để render lại full-res từ video gốc
+SEGMENTS_PATH = CLIPS_DIR / "segments.json"
+# Nhạc nền (music_gen.py); nếu có thì điểm cắt giữa các scene được kéo tới beat gần nhất
+MUSIC_PATH = PROJECT_DIR / "background_music.wav"
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_ranked_candidates(scene_name: str, fps: float):
+def get_ranked_candidates(scene_name: str, manifest: RankingManifest | None, catalog: FrameCatalog):
     """
-    Đọc danh sách các frame đã được AI chấm điểm từ folder frames_ranking.
-    Trả về danh sách các ứng viên: [(score, timestamp_start, frame_idx), ...]
+    Đọc top-k frame đã được AI chấm điểm từ ranking manifest.
+    Trả về danh sách các ứng viên: [(score, FrameRecord), ...]
     Sắp xếp từ điểm cao xuống thấp.
     """
-    ranking_dir = FRAMES_RANKING_DIR / scene_name
-    if not ranking_dir.exists():
+    if manifest is None:
         return []
-    
-    files = list(ranking_dir.glob("*.jpg"))
-    candidates = []
 
-    for f in files:
-        # Tên file dạng: 0.8521_frame_1500.jpg
-        match = re.match(r"([\d\.]+)_frame_(\d+)\.jpg", f.name)
-        if match:
-            score = float(match.group(1))
-            frame_idx = int(match.group(2))
-            
-            # Chuyển đổi frame index sang giây (Timestamp)
-            timestamp = frame_idx / fps
-            candidates.append((score, timestamp, frame_idx))
+    candidates = []
+    for score, frame_id in manifest.top_frames(scene_name):
+        record = catalog.get(frame_id)
+        if record is not None:
+            candidates.append((score, record))
     
     # Sắp xếp giảm dần theo điểm số (Score cao nhất lên đầu)
     return sorted(candidates, key=lambda x: x[0], reverse=True)
 
+def best_scene_segment(scene_name: str, manifest: RankingManifest | None, videos, voice_dur: float, used_segments: dict):
+    """
+    Chấm điểm cả đoạn thay vì 1 frame: trượt cửa sổ dài đúng voice_dur trên
+    timeline điểm CLIP của từng video nguồn, lấy đoạn có điểm trung bình cao nhất.
+    Trả về (video_path, start, mean_score) hoặc None.
+    """
+    if manifest is None:
+        return None
+    row = manifest.scene_row(scene_name)
+    if row is None:
+        return None
+
+    step = configs["clip"].get("timeline_step", 0.25)
+    best = None
+    for video in videos:
+        # Bỏ các frame không có embedding (điểm -1)
+        cols = (manifest.video_ids == video.video_id) & (manifest.scores[row] > -1)
+        if not cols.any():
+            continue
+        found = best_window(
+            manifest.timestamps[cols],
+            manifest.scores[row, cols],
+            video.duration,
+            voice_dur,
+            used_segments.get(video.path, []),
+            step=step,
+        )
+        if found is not None and (best is None or found[1] > best[2]):
+            best = (video.path, found[0], found[1])
+    return best
+
 def is_overlapping(start, duration, used_segments, buffer=2.0):
     """
     Kiểm tra xem đoạn video dự kiến (start -> start + duration)
@@ -60,6 +91,107 @@ def is_overlapping(start, duration, used_segments, buffer=2.0):
             return True
     return False
 
+def write_clip(source_video, scene_name: str, start_t: float, end_t: float):
+    """Cắt đoạn [start_t, end_t] từ source_video, tắt tiếng và lưu vào clips/scene_x/clip.mp4."""
+    # Cắt đoạn video
+    final_clip = source_video.subclip(start_t, end_t)
+
+    # Tắt tiếng video gốc (để audio_clip.py lo phần tiếng sau)
+    final_clip = final_clip.set_audio(None) 
+
+    # Tạo folder scene đầu ra
+    out_dir = CLIPS_DIR / scene_name
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_path = out_dir / "clip.mp4"
+
+    final_clip.write_videofile(
+        str(out_path),
+        codec="libx264",
+        audio_codec="aac",
+        fps=24,
+        logger=None
+    )
+    logger.info(f"--> Saved {scene_name}: {start_t:.1f}s to {end_t:.1f}s")
+
+def render_full_resolution():
+    """
+    Render lại các đoạn đã chọn (segments.json) từ video gốc ở độ phân giải đầy đủ.
+    Dùng sau khi đã duyệt bản preview dựng từ proxy. Key "clip" của các scene này
+    bị xoá: clip trên đĩa không còn là bản proxy mà key mô tả, nên lần chạy bước
+    clip sau sẽ cắt lại mọi scene cùng một độ phân giải.
+    """
+    if not SEGMENTS_PATH.exists():
+        logger.error(f"No {SEGMENTS_PATH.name} found. Run make_clip.py first.")
+        return
+
+    segments = json.loads(SEGMENTS_PATH.read_text(encoding="utf-8"))
+    logger.info(f"Re-rendering {len(segments)} segments at full resolution from the original videos...")
+
+    state = SceneState()
+    for seg in segments:
+        state.forget("clip", seg["scene"])
+        try:
+            with open_video(Path(seg["source"]), audio=False) as original_video:
+                write_clip(original_video, seg["scene"], seg["start"], seg["end"])
+        except Exception as e:
+            logger.error(f"Error processing {seg['scene']}: {e}")
+
+    log_peak_memory("make_clip")
+    logger.info("Full-resolution clip rendering finished.")
+
+def clip_key(scene_name: str, voice_path: Path, manifest: RankingManifest | None, sources_key: str,
+             grid=None, timeline: float = 0.0) -> str:
+    """
+    Clip của scene phụ thuộc subplot, kết quả ranking của scene, các video nguồn,
+    voice (độ dài đoạn cắt), chế độ proxy và lưới beat. Khi cắt theo beat, độ dài
+    đoạn còn phụ thuộc vị trí bắt đầu của scene trên timeline trailer.
+    """
+    ranking = manifest.scene_fingerprint(scene_name) if manifest is not None else "no-ranking"
+    beat = () if grid is None else (grid.tempo_bpm, grid.offset, round(timeline, 3))
+    return content_key(subplot_text(scene_name), ranking, sources_key, voice_path, proxy_enabled(), *beat)
+
+def voice_duration(voice_path: Path) -> float:
+    voice = AudioFileClip(str(voice_path))
+    duration = voice.duration
+    voice.close()
+    return duration
+
+def snapped_duration(grid, timeline: float, voice_dur: float, max_extend: float) -> float:
+    """Độ dài đoạn cắt: voice_dur, hoặc kéo tới beat ngay sau đó (phần dư là nhạc + hình)."""
+    if grid is None:
+        return voice_dur
+    return grid.snap_up(timeline + voice_dur, max_extend) - timeline
+
+def load_kept_segments(story_scenes, state: SceneState, manifest, sources_key: str, grid=None,
+                       max_extend: float = 0.0):
+    """
+    Incremental: đoạn đã cắt của các scene không đổi (theo segments.json lần trước).
+    Scene đã đổi bị xoá khỏi state để không bao giờ được coi là còn dùng được.
+    Khi cắt theo beat, duyệt theo thứ tự timeline: scene trước đổi độ dài thì
+    các scene sau lệch vị trí và được cắt (snap) lại.
+    Trả về {scene_name: segment}.
+    """
+    if not SEGMENTS_PATH.exists():
+        return {}
+    previous = {seg["scene"]: seg for seg in json.loads(SEGMENTS_PATH.read_text(encoding="utf-8"))}
+
+    kept = {}
+    timeline = 0.0
+    for scene_dir in story_scenes:
+        scene_name = scene_dir.name
+        voice_path = VOICES_DIR / scene_name / "audio_1.wav"
+        if not voice_path.exists():
+            continue
+        key = clip_key(scene_name, voice_path, manifest, sources_key, grid, timeline)
+        if scene_name in previous and state.is_current("clip", scene_name, key, CLIPS_DIR / scene_name / "clip.mp4"):
+            kept[scene_name] = previous[scene_name]
+            timeline += previous[scene_name]["end"] - previous[scene_name]["start"]
+        else:
+            state.forget("clip", scene_name)
+            if grid is not None:
+                timeline += snapped_duration(grid, timeline, voice_duration(voice_path), max_extend)
+    return kept
+
 def main():
     logger.info("Starting SMART video clip creation (Anti-Overlap Mode)...")
     
@@ -71,23 +203,52 @@ def main():
     
     # --- DANH SÁCH CÁC ĐOẠN ĐÃ DÙNG ---
     # Đây là bí quyết chống lặp: lưu lại start/end của các cảnh trước
-    used_segments = []
-    used_frame_indices = set()
-
-    # Load Video gốc
-    try:
-        original_video = VideoFileClip(str(VIDEO_PATH))
-        video_duration = original_video.duration
-        video_fps = original_video.fps
-    except Exception as e:
-        logger.error(f"Could not load input video at {VIDEO_PATH}: {e}")
+    # (theo từng video nguồn: {video_path: [(start, end), ...]})
+    used_segments = {}
+    used_frame_ids = set()
+    selected = []
+
+    # Các video nguồn + độ dài lấy từ FrameCatalog (do frame.py ghi)
+    catalog = FrameCatalog()
+    videos = catalog.videos()
+    if not videos:
+        logger.error("Frame catalog has no videos. Did frame.py run correctly?")
         return
+    durations = {v.path: v.duration for v in videos}
+
+    manifest = None
+    if RANKING_MANIFEST_PATH.exists():
+        manifest = RankingManifest.load(RANKING_MANIFEST_PATH)
+    else:
+        logger.warning("No ranking manifest found, every scene will use fallback zoning.")
 
-    # Fallback zoning (Chia vùng dự phòng nếu AI không tìm được ảnh)
-    zone_duration = video_duration / num_story_scenes if num_story_scenes > 0 else 10
+    # Beat sync: đoạn cắt dài tới beat đầu tiên sau khi voice hết (tối đa max_extend_beats beat)
+    beat_cfg = configs.get("beat_sync", {})
+    grid = music_beat_grid(MUSIC_PATH, beat_cfg)
+    max_extend = 0.0
+    if grid is not None:
+        max_extend = float(beat_cfg.get("max_extend_beats", 1.0)) * grid.period
+        logger.info(f"Beat sync on: {grid.tempo_bpm:.1f} BPM, cuts extended by at most {max_extend:.2f}s")
+    # Vị trí trên timeline trailer (tổng độ dài các đoạn trước đó)
+    timeline = 0.0
+
+    # Scene không đổi giữ nguyên đoạn cũ; các đoạn này được tính là đã dùng
+    # để scene được chọn lại không cắt trùng vào
+    state = SceneState()
+    # Đổi / thêm video nguồn (cùng path nhưng khác nội dung) -> mọi scene cắt lại
+    sources_key = content_key(*[v.path for v in videos])
+    kept = load_kept_segments(story_scenes, state, manifest, sources_key, grid, max_extend)
+    for seg in kept.values():
+        used_segments.setdefault(Path(seg["source"]), []).append((seg["start"], seg["end"]))
 
     for i, scene_dir in enumerate(story_scenes):
         scene_name = scene_dir.name # ví dụ: scene_1
+
+        if scene_name in kept:
+            logger.info(f"[{scene_name}] Unchanged, reusing existing clip")
+            selected.append(kept[scene_name])
+            timeline += kept[scene_name]["end"] - kept[scene_name]["start"]
+            continue
         
         # --- 1. LẤY AUDIO VOICE ---
         voice_path = VOICES_DIR / scene_name / "audio_1.wav"
@@ -95,29 +256,47 @@ def main():
             logger.warning(f"No voice for {scene_name}, skipping.")
             continue
             
-        voice = AudioFileClip(str(voice_path))
-        voice_dur = voice.duration
+        voice_dur = voice_duration(voice_path)
+        scene_start = timeline
+        clip_dur = snapped_duration(grid, timeline, voice_dur, max_extend)
         
         # --- 2. CHIẾN THUẬT CHỌN ĐIỂM BẮT ĐẦU (CHỐNG TRÙNG) ---
         start_t = None
         
-        # Lấy danh sách ứng viên từ AI (đã sort từ xịn nhất -> kém nhất)
-        candidates = get_ranked_candidates(scene_name, video_fps)
-        
-        
         found_candidate = False
-        for score, ts, frame_idx in candidates:
+
+        # 2a) Chọn cả đoạn có điểm trung bình cao nhất (segment scoring)
+        if configs["clip"].get("segment_scoring", True):
+            segment = best_scene_segment(scene_name, manifest, videos, clip_dur, used_segments)
+            if segment is not None:
+                video_path, start_t, mean_score = segment
+                logger.info(
+                    f"[{scene_name}] AI Selected segment: {video_path.name} "
+                    f"{start_t:.2f}s -> {start_t + clip_dur:.2f}s | Mean score {mean_score:.4f}"
+                )
+                found_candidate = True
+
+        # 2b) Không có đoạn hợp lệ -> thử từng frame top-k như cũ
+        # Lấy danh sách ứng viên từ AI (đã sort từ xịn nhất -> kém nhất)
+        candidates = [] if found_candidate else get_ranked_candidates(scene_name, manifest, catalog)
+
+        for score, frame in candidates:
         # 1) Nếu frame này đã được dùng cho subplot trước -> bỏ qua
-            if frame_idx in used_frame_indices:
+            if frame.frame_id in used_frame_ids:
                 logger.info(
-                    f"[{scene_name}] Skip frame {frame_idx} (already used in previous scene)"
+                    f"[{scene_name}] Skip frame {frame.frame_idx} (already used in previous scene)"
                 )
                 continue
         # 2) Nếu không overlap về thời gian với các đoạn trước -> chọn
-            if not is_overlapping(ts, voice_dur, used_segments):
+            ts = frame.timestamp
+            if not is_overlapping(ts, clip_dur, used_segments.get(frame.video_path, [])):
                 start_t = ts
-                used_frame_indices.add(frame_idx)
-                logger.info(f"[{scene_name}] AI Selected: frame {frame_idx} | Score {score:.4f} at {ts:.2f}s (Unique)")
+                video_path = frame.video_path
+                used_frame_ids.add(frame.frame_id)
+                logger.info(
+                    f"[{scene_name}] AI Selected: {video_path.name} frame {frame.frame_idx} "
+                    f"| Score {score:.4f} at {ts:.2f}s (Unique)"
+                )
                 found_candidate = True
                 break
         
@@ -125,15 +304,19 @@ def main():
             # Nếu tất cả ứng viên AI đều bị trùng (hoặc không có ứng viên)
             # -> Dùng chiến thuật Fallback Zoning: Tìm một vùng trống
             logger.warning(f"[{scene_name}] All AI frames overlapped or none found. Finding empty zone...")
-            
+
+            # Chia vùng dự phòng trên các video nguồn lần lượt
+            video_path = videos[i % len(videos)].path
+            video_duration = durations[video_path]
+            zone_duration = video_duration / num_story_scenes if num_story_scenes > 0 else 10
             zone_start = i * zone_duration
             
             # Thử tìm điểm trống bằng cách dò (Brute force search đơn giản)
             fallback_t = zone_start
             retries = 0
-            while is_overlapping(fallback_t, voice_dur, used_segments) and retries < 20:
+            while is_overlapping(fallback_t, clip_dur, used_segments.get(video_path, [])) and retries < 20:
                 fallback_t += 5.0 # Dịch đi 5s mỗi lần để tìm đất trống
-                if fallback_t > video_duration - voice_dur: 
+                if fallback_t > video_duration - clip_dur: 
                     fallback_t = 0 # Quay vòng về đầu nếu hết video
                 retries += 1
             
@@ -141,43 +324,35 @@ def main():
             logger.warning(f"-> Fallback used at {start_t:.2f}s")
 
         # --- 3. TÍNH TOÁN ĐIỂM KẾT THÚC ---
-        end_t = start_t + voice_dur
+        video_duration = durations[video_path]
+        end_t = start_t + clip_dur
         
         # Xử lý tràn video (nếu đoạn cắt vượt quá độ dài video gốc)
         if end_t > video_duration:
             end_t = video_duration
-            start_t = max(0, end_t - voice_dur)
+            start_t = max(0, end_t - clip_dur)
 
         # --- 4. CẬP NHẬT DANH SÁCH ĐÃ DÙNG ---
-        used_segments.append((start_t, end_t))
+        used_segments.setdefault(video_path, []).append((start_t, end_t))
+        timeline += end_t - start_t
+        selected.append({"scene": scene_name, "source": str(video_path), "start": start_t, "end": end_t})
 
         # --- 5. CẮT VÀ XUẤT FILE ---
+        # Proxy mode: cắt từ proxy của video nguồn
         try:
-            # Cắt đoạn video
-            final_clip = original_video.subclip(start_t, end_t)
-            
-            # Tắt tiếng video gốc (để audio_clip.py lo phần tiếng sau)
-            final_clip = final_clip.set_audio(None) 
-            
-            # Tạo folder scene đầu ra
-            out_dir = CLIPS_DIR / scene_name
-            out_dir.mkdir(parents=True, exist_ok=True)
-            out_path = out_dir / "clip.mp4"
-            
-            final_clip.write_videofile(
-                str(out_path),
-                codec="libx264",
-                audio_codec="aac",
-                fps=24,
-                logger=None
-            )
-            logger.info(f"--> Saved {scene_name}: {start_t:.1f}s to {end_t:.1f}s")
-
+            with open_video(working_video(video_path), audio=False) as source_video:
+                write_clip(source_video, scene_name, start_t, end_t)
+            state.mark("clip", scene_name, clip_key(scene_name, voice_path, manifest, sources_key, grid, scene_start))
         except Exception as e:
             logger.error(f"Error processing {scene_name}: {e}")
 
-    original_video.close()
+    catalog.close()
+    log_peak_memory("make_clip")
+    SEGMENTS_PATH.write_text(json.dumps(selected, indent=2), encoding="utf-8")
     logger.info("Smart Clip Creation (Anti-Overlap) finished.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--full-res" in sys.argv:
+        render_full_resolution()
+    else:
+        main()
\ No newline at end of file
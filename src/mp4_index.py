@@ -0,0 +1,123 @@
+import struct
+from pathlib import Path
+
+import numpy as np
+
+# Box chứa box con (đủ để đi từ moov tới bảng sample của track video)
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+def iter_boxes(f, start: int, end: int):
+    """Các box trong [start, end): (type, offset, header_size, size). Dừng khi header vượt end."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos  # box kéo tới hết file
+        if size < header_size:
+            return
+        yield box_type, pos, header_size, size
+        pos += size
+
+
+def top_level_layout(path: Path, available: int):
+    """
+    Bố cục MP4 dựa trên phần đầu đã có (available byte):
+    - "faststart": moov nằm trước mdat và đã tải đủ -> đọc được khi file còn đang tải
+    - "fragmented": moof/mdat nối tiếp (fMP4)
+    - "moov_at_end": mdat trước moov -> phải chờ tải xong
+    - None: chưa đủ dữ liệu để biết
+    """
+    with open(path, "rb") as f:
+        for box_type, offset, _, size in iter_boxes(f, 0, available):
+            if box_type == b"moov":
+                return "faststart" if offset + size <= available else None
+            if box_type == b"moof":
+                return "fragmented"
+            if box_type == b"mdat":
+                return "moov_at_end"
+    return None
+
+
+def _find(f, start: int, end: int, box_type: bytes):
+    for t, offset, header_size, size in iter_boxes(f, start, end):
+        if t == box_type:
+            return offset + header_size, offset + size
+    return None
+
+
+def _read_full_box(f, payload):
+    """Payload của full box (bỏ version + flags)."""
+    start, end = payload
+    f.seek(start + 4)
+    return f.read(end - start - 4)
+
+
+def video_sample_ends(path: Path) -> np.ndarray:
+    """
+    Byte kết thúc của từng sample video (thứ tự decode), từ bảng stsz/stsc/stco trong moov.
+    Frame thứ k đọc được khi mọi byte trước sample_ends[k] đã tải về.
+    """
+    path = Path(path)
+    with open(path, "rb") as f:
+        file_size = path.stat().st_size
+        moov = _find(f, 0, file_size, b"moov")
+        if moov is None:
+            raise ValueError(f"No moov box in {path.name}")
+
+        for t, offset, header_size, size in iter_boxes(f, *moov):
+            if t != b"trak":
+                continue
+            mdia = _find(f, offset + header_size, offset + size, b"mdia")
+            hdlr = mdia and _find(f, *mdia, b"hdlr")
+            if not hdlr or _read_full_box(f, hdlr)[4:8] != b"vide":
+                continue
+            minf = _find(f, *mdia, b"minf")
+            stbl = minf and _find(f, *minf, b"stbl")
+            if not stbl:
+                continue
+            return _sample_ends(f, stbl)
+    raise ValueError(f"No video track in {path.name}")
+
+
+def _sample_ends(f, stbl) -> np.ndarray:
+    stsz = _read_full_box(f, _find(f, *stbl, b"stsz"))
+    fixed_size, n_samples = struct.unpack(">II", stsz[:8])
+    if fixed_size:
+        sizes = np.full(n_samples, fixed_size, dtype=np.int64)
+    else:
+        sizes = np.frombuffer(stsz[8:8 + 4 * n_samples], dtype=">u4").astype(np.int64)
+
+    stco = _find(f, *stbl, b"stco")
+    if stco:
+        data = _read_full_box(f, stco)
+        n_chunks = struct.unpack(">I", data[:4])[0]
+        chunk_offsets = np.frombuffer(data[4:4 + 4 * n_chunks], dtype=">u4").astype(np.int64)
+    else:
+        data = _read_full_box(f, _find(f, *stbl, b"co64"))
+        n_chunks = struct.unpack(">I", data[:4])[0]
+        chunk_offsets = np.frombuffer(data[4:4 + 8 * n_chunks], dtype=">u8").astype(np.int64)
+
+    stsc = _read_full_box(f, _find(f, *stbl, b"stsc"))
+    n_entries = struct.unpack(">I", stsc[:4])[0]
+    entries = np.frombuffer(stsc[4:4 + 12 * n_entries], dtype=">u4").reshape(-1, 3).astype(np.int64)
+
+    # Số sample trong từng chunk (stsc chỉ ghi chunk đầu của mỗi đoạn, đánh số từ 1)
+    first_chunks = np.append(entries[:, 0] - 1, n_chunks)
+    per_chunk = np.repeat(entries[:, 1], np.diff(first_chunks))[:n_chunks]
+    chunk_of_sample = np.repeat(np.arange(len(per_chunk)), per_chunk)[:n_samples]
+
+    ends = np.cumsum(sizes)
+    chunk_start_index = np.cumsum(per_chunk) - per_chunk
+    bytes_before_chunk = np.append(0, ends)[chunk_start_index[chunk_of_sample]]
+    return chunk_offsets[chunk_of_sample] + ends - bytes_before_chunk
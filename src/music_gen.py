@@ -1,73 +1,239 @@
 import sys
+import shutil
+import hashlib
 import logging
-from pathlib import Path
+import argparse
+import numpy as np
 import torch
-import scipy.io.wavfile
-import numpy as np 
+
+from beat_grid import music_beat_grid
+from common import CACHE_DIR, PROJECT_DIR, VOICES_DIR, configs
+from loudness import Limiter, LoudnessMeter, gain_to_target, load_stats, save_stats
 
 # --- 1. KIỂM TRA THƯ VIỆN ---
 try:
-    from transformers import pipeline
+    import soundfile as sf
+    from transformers import AutoProcessor, MusicgenForConditionalGeneration
 except ImportError:
-    print("ERROR: Missing libraries. Run: pip install transformers scipy torch numpy")
+    print("ERROR: Missing libraries. Run: pip install transformers soundfile torch numpy")
     sys.exit(1)
 
 # --- CẤU HÌNH ---
-ROOT = Path(__file__).resolve().parents[1]
-PROJECT_DIR = ROOT / "projects" / "LOL"
 PROMPT_PATH = PROJECT_DIR / "music_prompt.txt"
 OUTPUT_PATH = PROJECT_DIR / "background_music.wav"
+MUSIC_CACHE_DIR = CACHE_DIR / "music"
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("MusicGen")
 
+def music_cfg() -> dict:
+    cfg = {
+        "model_id": "facebook/musicgen-small",
+        "chunk_sec": 12.0,      # audio mới sinh mỗi lần gọi model
+        "overlap_sec": 2.0,     # đoạn sinh lại để crossfade với chunk trước
+        "context_sec": 6.0,     # audio chunk trước dùng làm audio prompt
+        "default_duration": 30.0,
+    }
+    cfg.update(configs.get("music", {}) or {})
+    return cfg
+
+def voices_duration() -> float:
+    """Tổng độ dài voice các scene ~ độ dài trailer (0 nếu chưa có voice)."""
+    total = 0.0
+    for wav in sorted(VOICES_DIR.glob("scene_*/audio_1.wav")):
+        try:
+            total += sf.info(str(wav)).duration
+        except Exception as e:
+            logger.warning(f"Cannot read {wav}: {e}")
+    return total
+
+def cache_path_for(prompt: str, duration: float, cfg: dict):
+    key = "|".join(str(v) for v in (
+        prompt, round(duration, 1), cfg["model_id"], cfg["chunk_sec"], cfg["overlap_sec"], cfg["context_sec"]
+    ))
+    return MUSIC_CACHE_DIR / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.wav"
+
+class MusicGenerator:
+    """MusicGen sinh tiếp từ audio prompt (đuôi chunk trước) để các chunk nối liền mạch."""
+
+    def __init__(self, model_id: str):
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        logger.info(f"Device: {self.device}")
+        self.processor = AutoProcessor.from_pretrained(model_id)
+        self.model = MusicgenForConditionalGeneration.from_pretrained(model_id).to(self.device)
+        self.sampling_rate = self.model.config.audio_encoder.sampling_rate
+        self.frame_rate = self.model.config.audio_encoder.frame_rate
+
+    def generate(self, prompt: str, seconds: float, audio_prompt=None) -> np.ndarray:
+        """Sinh `seconds` giây audio mới (mono), bỏ phần audio prompt ở đầu output."""
+        kwargs = {"text": [prompt], "padding": True, "return_tensors": "pt"}
+        if audio_prompt is not None:
+            kwargs.update(audio=audio_prompt, sampling_rate=self.sampling_rate)
+        inputs = self.processor(**kwargs).to(self.device)
+
+        with torch.no_grad():
+            out = self.model.generate(**inputs, do_sample=True, max_new_tokens=int(seconds * self.frame_rate))
+        audio = out[0, 0].float().cpu().numpy()
+        if audio_prompt is not None:
+            audio = audio[len(audio_prompt):]
+        return audio
+
+def check_chunk_cfg(cfg: dict) -> None:
+    """Mỗi chunk phải thêm được audio mới sau phần overlap, nếu không vòng sinh không bao giờ dừng."""
+    if cfg["overlap_sec"] < 0 or cfg["chunk_sec"] <= cfg["overlap_sec"]:
+        raise ValueError(
+            f"music.chunk_sec ({cfg['chunk_sec']}) must be greater than music.overlap_sec ({cfg['overlap_sec']}) >= 0"
+        )
+    if cfg["context_sec"] <= 0:
+        raise ValueError(f"music.context_sec must be > 0, got {cfg['context_sec']}")
+
+def generate_chunks(generator: MusicGenerator, prompt: str, duration: float, cfg: dict):
+    """
+    Yield các chunk audio. Chunk k>0 được điều kiện trên đoạn [-context-overlap, -overlap]
+    của chunk trước, nên `overlap` giây đầu của nó trùng thời điểm với `overlap` giây cuối
+    chunk trước -> crossfade được mà không lệch nhịp.
+    """
+    check_chunk_cfg(cfg)
+    sr = generator.sampling_rate
+    overlap = int(cfg["overlap_sec"] * sr)
+    context = int(cfg["context_sec"] * sr)
+
+    audio_prompt = None
+    produced = 0
+    i = 0
+    while produced < duration * sr:
+        i += 1
+        logger.info(f"Generating chunk {i} ({produced / sr:.1f}s / {duration:.1f}s)...")
+        chunk = generator.generate(prompt, cfg["chunk_sec"], audio_prompt)
+        if len(chunk) <= overlap:
+            raise RuntimeError(
+                f"Music chunk {i} is {len(chunk) / sr:.2f}s, not longer than the {cfg['overlap_sec']}s overlap"
+            )
+        yield chunk
+
+        produced += len(chunk) - (overlap if audio_prompt is not None else 0)
+        end = len(chunk) - overlap
+        audio_prompt = chunk[max(0, end - context):end]
+
+def write_crossfaded(chunks, out_file, overlap: int, total: int, meter: LoudnessMeter) -> int:
+    """
+    Nối các chunk bằng crossfade equal-power (cos/sin) rồi ghi thẳng ra out_file.
+    RAM chỉ giữ chunk hiện tại + `overlap` mẫu cuối chưa ghi. Mọi chunk phải dài
+    hơn `overlap` mẫu (xem check_chunk_cfg).
+    """
+    fade = np.linspace(0.0, np.pi / 2, overlap)
+    tail = None
+    written = 0
+
+    def write(samples):
+        nonlocal written
+        samples = samples[:total - written]
+        out_file.write(samples)
+        meter.add(samples)
+        written += len(samples)
+
+    for chunk in chunks:
+        if len(chunk) <= overlap:
+            raise ValueError(f"Chunk of {len(chunk)} samples is not longer than the {overlap}-sample overlap")
+        if tail is not None:
+            n = min(overlap, len(tail), len(chunk))
+            head = tail[:n] * np.cos(fade[:n]) + chunk[:n] * np.sin(fade[:n])
+            chunk = np.concatenate([head, chunk[n:]])
+        if overlap:
+            body, tail = chunk[:-overlap], chunk[-overlap:]
+        else:
+            body, tail = chunk, None
+        write(body)
+        if written >= total:
+            return written
+
+    if tail is not None:
+        write(tail)
+    return written
+
+def generate_music(prompt: str, duration: float, cfg: dict):
+    """Sinh nhạc dài `duration` giây vào cache (.cache/music/), trả về đường dẫn file."""
+    cache_path = cache_path_for(prompt, duration, cfg)
+    if cache_path.exists():
+        logger.info(f"Using cached music: {cache_path.name}")
+        return cache_path
+
+    check_chunk_cfg(cfg)
+    generator = MusicGenerator(cfg["model_id"])
+    sr = generator.sampling_rate
+    MUSIC_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_suffix(".tmp.wav")
+
+    meter = LoudnessMeter(sr)
+    with sf.SoundFile(str(tmp), "w", samplerate=sr, channels=1, subtype="FLOAT") as f:
+        written = write_crossfaded(
+            generate_chunks(generator, prompt, duration, cfg),
+            f,
+            overlap=int(cfg["overlap_sec"] * sr),
+            total=int(duration * sr),
+            meter=meter,
+        )
+    tmp.replace(cache_path)
+    save_stats(cache_path, meter.stats())
+    logger.info(f"Generated {written / sr:.1f}s of music -> {cache_path.name}")
+    return cache_path
+
+def export_music(src_path, out_path):
+    """
+    Chép nhạc từ cache ra project. Nếu bật loudness thì chuẩn hoá về mức nhạc nền
+    (gain từ thống kê đã đo lúc sinh) + limiter nhìn trước, đọc/ghi theo block.
+    """
+    loud_cfg = configs.get("loudness", {})
+    if not loud_cfg.get("enabled", False):
+        shutil.copyfile(src_path, out_path)
+        load_stats(out_path)
+        return
+
+    music_target = float(loud_cfg.get("target_lufs", -16.0)) - float(loud_cfg.get("music_below_voice_lu", 14.0))
+    gain = gain_to_target(load_stats(src_path), music_target)
+    ceiling_db = float(loud_cfg.get("ceiling_db", -1.0))
+
+    info = sf.info(str(src_path))
+    meter = LoudnessMeter(info.samplerate)
+    limiter = Limiter(info.samplerate, ceiling_db)
+    with sf.SoundFile(str(out_path), "w", samplerate=info.samplerate, channels=info.channels, subtype="PCM_16") as out:
+        for block in sf.blocks(str(src_path), blocksize=1 << 16, dtype="float64"):
+            block = limiter.process(block * gain)
+            out.write(block)
+            meter.add(block)
+        block = limiter.flush()
+        if len(block):
+            out.write(block)
+            meter.add(block)
+    # Thống kê cho join_clip.py
+    save_stats(out_path, meter.stats())
+
 def main():
-    logger.info("--- STARTING MUSIC GENERATION (Fixed Shape) ---")
+    cfg = music_cfg()
+    ap = argparse.ArgumentParser(description="Generate background music with MusicGen.")
+    ap.add_argument("--duration", type=float, default=None,
+                    help="Length in seconds (default: total voice duration of the project)")
+    args = ap.parse_args()
+
+    logger.info("--- STARTING MUSIC GENERATION (Chunked) ---")
 
     # 1. Đọc Prompt
-    prompt = "Cinematic game trailer music, epic, orchestral" 
+    prompt = "Cinematic game trailer music, epic, orchestral"
     if PROMPT_PATH.exists():
         text = PROMPT_PATH.read_text(encoding="utf-8").strip()
         if text: prompt = text
-    
-    logger.info(f"Prompt: {prompt}")
-
-    # 2. Quản lý Device (GPU/CPU)
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
-        device = 0
-        logger.info("Device: GPU (Fast)")
-    else:
-        device = -1
-        logger.info("Device: CPU (Slower)")
 
-    try:
-        # 3. Load Model
-        synthesiser = pipeline("text-to-audio", "facebook/musicgen-small", device=device)
-
-        # 4. Sinh nhạc
-        logger.info("Generating sample...")
-        music = synthesiser(
-            prompt, 
-            forward_params={"do_sample": True, "max_new_tokens": 512}
-        )
+    duration = args.duration or voices_duration() or float(cfg["default_duration"])
+    logger.info(f"Prompt: {prompt} | duration: {duration:.1f}s")
 
-        # 5. XỬ LÝ DỮ LIỆU
-        sampling_rate = music["sampling_rate"]
-        audio_data = np.array(music["audio"][0]) 
-
-        if len(audio_data.shape) > 1:
-            audio_data = audio_data.squeeze()
-
-        # Chuẩn hóa biên độ về [-1, 1]
-        max_val = np.max(np.abs(audio_data))
-        if max_val > 0:
-            audio_data = audio_data / max_val
-        audio_data_int16 = (audio_data * 32767).astype(np.int16)
-        
-        # 6. Lưu file
-        scipy.io.wavfile.write(str(OUTPUT_PATH), rate=sampling_rate, data=audio_data_int16)
+    try:
+        music_path = generate_music(prompt, duration, cfg)
+        export_music(music_path, OUTPUT_PATH)
         logger.info(f"SUCCESS: Music saved to {OUTPUT_PATH}")
+        # Phân tích beat 1 lần ngay sau khi sinh (sidecar .beats.json cho make_clip / join_clip)
+        grid = music_beat_grid(OUTPUT_PATH, configs.get("beat_sync", {}))
+        if grid is not None:
+            logger.info(f"Beat grid: {grid.tempo_bpm:.1f} BPM, first beat at {grid.offset:.3f}s")
 
     except Exception as e:
         logger.error(f"Generation Failed: {e}")
@@ -0,0 +1,68 @@
+import json
+import time
+from pathlib import Path
+
+from common import PROJECT_DIR
+
+# Kênh trạng thái giữa trailer_generator.py (ghi) và UI (đọc):
+# mỗi dòng là 1 sự kiện JSON, UI chỉ đọc phần mới thêm kể từ lần poll trước.
+EVENTS_PATH = PROJECT_DIR / ".events.jsonl"
+# Có file này -> orchestrator không khởi chạy bước mới, chờ các bước đang chạy xong rồi dừng
+PAUSE_PATH = PROJECT_DIR / ".pause"
+# stdout/stderr thô của tiến trình chạy nền
+RUNNER_LOG_PATH = PROJECT_DIR / ".runner.log"
+
+
+class EventWriter:
+    """Append sự kiện vào EVENTS_PATH (mỗi lần ghi 1 dòng hoàn chỉnh rồi flush)."""
+
+    def __init__(self, path: Path = EVENTS_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def emit(self, event: str, **fields) -> None:
+        record = {"ts": time.time(), "event": event, **fields}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class EventReader:
+    """Đọc tiếp từ offset lần trước; bỏ qua dòng chưa ghi xong."""
+
+    def __init__(self, path: Path = EVENTS_PATH):
+        self.path = Path(path)
+        self.offset = 0
+
+    def poll(self) -> list:
+        if not self.path.exists():
+            self.offset = 0
+            return []
+        if self.path.stat().st_size < self.offset:
+            # File bị xoá / tạo lại (lần chạy mới)
+            self.offset = 0
+
+        events = []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+        self.offset += end
+        return events
+
+
+def request_pause() -> None:
+    PAUSE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    PAUSE_PATH.touch()
+
+
+def clear_pause() -> None:
+    PAUSE_PATH.unlink(missing_ok=True)
+
+
+def pause_requested() -> bool:
+    return PAUSE_PATH.exists()
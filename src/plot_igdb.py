@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
 import json
 import sys
+import threading
+import time
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from common import CACHE_DIR, configs
 
-IGDB_GAMES_URL = "https://api.igdb.com/v4/games"
+
+IGDB_BASE_URL = "https://api.igdb.com/v4"
+IGDB_GAMES_URL = f"{IGDB_BASE_URL}/games"
+IGDB_CACHE_DIR = CACHE_DIR / "igdb"
+# IGDB: tối đa 10 truy vấn con trong 1 request multiquery, 4 request/giây
+MULTIQUERY_LIMIT = 10
 
 
 def build_query(game_name: str, limit: int = 5) -> str:
@@ -61,39 +71,163 @@ def extract_plot_text(game_obj: dict) -> str:
     return ""
 
 
-def fetch_plot(game_name: str, client_id: str, token: str) -> tuple[str, dict]:
-    headers = {
-        "Client-ID": client_id,
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json",
-    }
+class RateLimiter:
+    """Giãn cách request tối thiểu 1/rate giây (dùng chung giữa các thread)."""
 
-    query = build_query(game_name, limit=8)
-    resp = requests.post(IGDB_GAMES_URL, headers=headers, data=query, timeout=30)
+    def __init__(self, rate_per_sec: float):
+        self.interval = 1.0 / rate_per_sec if rate_per_sec > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
 
-    if resp.status_code != 200:
-        raise RuntimeError(
-            f"IGDB API failed: HTTP {resp.status_code}\n"
-            f"Response: {resp.text[:500]}"
-        )
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
 
-    try:
-        data = resp.json()
-    except Exception:
-        raise RuntimeError(f"IGDB returned non-JSON response: {resp.text[:300]}")
 
-    best = pick_best_game(data, game_name)
-    if not best:
-        raise RuntimeError(f"No IGDB results found for '{game_name}'.")
+class IGDBClient:
+    """
+    Client IGDB dùng lại 1 requests.Session (giữ kết nối), gom nhiều game vào
+    request multiquery, cache response trên đĩa (.cache/igdb/) theo TTL và
+    giới hạn tốc độ theo rate limit của IGDB.
+    """
+
+    def __init__(self, client_id: str, token: str, session: requests.Session = None,
+                 cache_dir: Path = IGDB_CACHE_DIR, cache_ttl_sec: float = None,
+                 rate_per_sec: float = None, timeout: float = 30.0, retries: int = 3):
+        cfg = configs.get("igdb", {})
+        self.session = session or requests.Session()
+        if session is None:
+            self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        self.session.headers.update({
+            "Client-ID": client_id.strip(),
+            "Authorization": f"Bearer {token.strip()}",
+            "Accept": "application/json",
+        })
+        self.cache_dir = Path(cache_dir)
+        self.cache_ttl_sec = float(cache_ttl_sec if cache_ttl_sec is not None
+                                   else float(cfg.get("cache_ttl_hours", 168)) * 3600)
+        self.limiter = RateLimiter(float(rate_per_sec or cfg.get("rate_per_sec", 4)))
+        self.timeout = timeout
+        self.retries = retries
+
+    # --- cache ---
+    def _cache_path(self, endpoint: str, body: str) -> Path:
+        key = hashlib.sha1(f"{endpoint}\n{body}".encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{key}.json"
+
+    def _cache_get(self, endpoint: str, body: str):
+        path = self._cache_path(endpoint, body)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["ts"] > self.cache_ttl_sec:
+            return None
+        return entry["data"]
+
+    def _cache_put(self, endpoint: str, body: str, data) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._cache_path(endpoint, body)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"ts": time.time(), "data": data}, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    # --- HTTP ---
+    def _post(self, endpoint: str, body: str):
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            resp = self.session.post(f"{IGDB_BASE_URL}/{endpoint}", data=body, timeout=self.timeout)
+            if resp.status_code == 429 and attempt < self.retries:
+                # Vượt rate limit -> chờ rồi thử lại
+                time.sleep(float(resp.headers.get("Retry-After") or 2 ** attempt))
+                continue
+            if resp.status_code != 200:
+                raise RuntimeError(
+                    f"IGDB API failed: HTTP {resp.status_code}\n"
+                    f"Response: {resp.text[:500]}"
+                )
+            try:
+                return resp.json()
+            except Exception:
+                raise RuntimeError(f"IGDB returned non-JSON response: {resp.text[:300]}")
+
+    def query(self, endpoint: str, body: str):
+        """1 truy vấn IGDB (có cache)."""
+        data = self._cache_get(endpoint, body)
+        if data is None:
+            data = self._post(endpoint, body)
+            self._cache_put(endpoint, body, data)
+        return data
+
+    def search_games(self, game_names: list, limit: int = 8) -> dict:
+        """
+        Kết quả tìm kiếm cho nhiều game: {tên: [game, ...]}.
+        Game chưa có trong cache được gom thành các request multiquery (10 game / request);
+        cache lưu theo từng truy vấn đơn nên dùng chung với query("games", ...).
+        """
+        results, pending = {}, []
+        for name in dict.fromkeys(game_names):
+            cached = self._cache_get("games", build_query(name, limit))
+            if cached is None:
+                pending.append(name)
+            else:
+                results[name] = cached
+
+        for i in range(0, len(pending), MULTIQUERY_LIMIT):
+            batch = pending[i:i + MULTIQUERY_LIMIT]
+            if len(batch) == 1:
+                results[batch[0]] = self.query("games", build_query(batch[0], limit))
+                continue
+            body = "".join(
+                f'query games "{j}" {{ {build_query(name, limit)} }};' for j, name in enumerate(batch)
+            )
+            for item in self._post("multiquery", body):
+                name = batch[int(item["name"])]
+                results[name] = item.get("result", [])
+                self._cache_put("games", build_query(name, limit), results[name])
+        return results
+
+    def fetch_plots(self, game_names: list) -> dict:
+        """{tên: (plot, game_obj)}; game không tìm thấy / không có plot -> None."""
+        plots = {}
+        for name, found in self.search_games(game_names).items():
+            best = pick_best_game(found, name)
+            plot = extract_plot_text(best) if best else ""
+            plots[name] = (plot, best) if plot else None
+        return plots
+
+    def fetch_plot(self, game_name: str) -> tuple[str, dict]:
+        best = pick_best_game(self.search_games([game_name])[game_name], game_name)
+        if not best:
+            raise RuntimeError(f"No IGDB results found for '{game_name}'.")
+
+        plot = extract_plot_text(best)
+        if not plot:
+            # If no storyline/summary, still return metadata for debugging
+            raise RuntimeError(
+                f"Found game '{best.get('name')}', but it has no storyline/summary in IGDB."
+            )
+
+        return plot, best
 
-    plot = extract_plot_text(best)
-    if not plot:
-        # If no storyline/summary, still return metadata for debugging
-        raise RuntimeError(
-            f"Found game '{best.get('name')}', but it has no storyline/summary in IGDB."
-        )
 
-    return plot, best
+def fetch_plot(game_name: str, client_id: str, token: str) -> tuple[str, dict]:
+    return IGDBClient(client_id, token).fetch_plot(game_name)
+
+
+def save_plot(out_path: Path, plot_text: str, best_obj: dict, save_json: bool = False) -> None:
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(plot_text.strip() + "\n", encoding="utf-8")
+
+    # Optional debug JSON
+    if save_json:
+        jpath = out_path.parent / "igdb_game_debug.json"
+        jpath.write_text(json.dumps(best_obj, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
 def main():
@@ -106,17 +240,9 @@ def main():
     args = ap.parse_args()
 
     out_path = Path(args.out).expanduser().resolve()
-    out_path.parent.mkdir(parents=True, exist_ok=True)
 
     plot_text, best_obj = fetch_plot(args.game, args.client_id, args.token)
-
-    # Save plot
-    out_path.write_text(plot_text.strip() + "\n", encoding="utf-8")
-
-    # Optional debug JSON
-    if args.save_json:
-        jpath = out_path.parent / "igdb_game_debug.json"
-        jpath.write_text(json.dumps(best_obj, ensure_ascii=False, indent=2), encoding="utf-8")
+    save_plot(out_path, plot_text, best_obj, args.save_json)
 
     # Print short log for UI
     name = best_obj.get("name", "Unknown")
@@ -0,0 +1,55 @@
+import logging
+import subprocess
+from pathlib import Path
+
+from common import CACHE_DIR, configs, file_fingerprint, get_ffmpeg_exe
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PREVIEW_CACHE_DIR = CACHE_DIR / "previews"
+
+
+def preview_path_for(video_path: Path) -> Path:
+    """Bản preview trong cache, khóa theo hash của trailer + độ phân giải."""
+    height = int(configs.get("ui", {}).get("preview_height", 480))
+    return PREVIEW_CACHE_DIR / f"{file_fingerprint(video_path)}_{height}p.mp4"
+
+
+def build_preview(video_path: Path) -> Path:
+    """
+    Bản nhỏ của trailer để xem ngay trên trang (có tiếng, faststart để phát
+    khi mới tải một phần). Mỗi trailer chỉ encode một lần (cache theo hash).
+    """
+    video_path = Path(video_path)
+    out_path = preview_path_for(video_path)
+    if out_path.exists():
+        return out_path
+
+    ui_cfg = configs.get("ui", {})
+    height = int(ui_cfg.get("preview_height", 480))
+    crf = int(ui_cfg.get("preview_crf", 30))
+
+    PREVIEW_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_suffix(".tmp.mp4")
+
+    cmd = [
+        get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-i", str(video_path),
+        "-vf", f"scale=-2:{height}",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", str(crf),
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "96k",
+        "-movflags", "+faststart",
+        str(tmp_path),
+    ]
+
+    logger.info(f"Building {height}p preview for {video_path.name}...")
+    try:
+        subprocess.run(cmd, check=True)
+    except Exception:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    tmp_path.replace(out_path)
+    return out_path
@@ -0,0 +1,78 @@
+import logging
+import subprocess
+from pathlib import Path
+
+from common import CACHE_DIR, configs, file_fingerprint, get_ffmpeg_exe
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROXY_CACHE_DIR = CACHE_DIR / "proxies"
+
+
+def proxy_enabled() -> bool:
+    return bool(configs.get("proxy", {}).get("enabled", False))
+
+
+def proxy_path_for(video_path: Path) -> Path:
+    """Đường dẫn proxy trong cache, khóa theo hash của video gốc + độ phân giải."""
+    height = int(configs.get("proxy", {}).get("height", 360))
+    return PROXY_CACHE_DIR / f"{file_fingerprint(video_path)}_{height}p.mp4"
+
+
+def build_proxy(video_path: Path) -> Path:
+    """
+    Tạo bản proxy độ phân giải thấp, toàn bộ là I-frame (GOP = 1) để seek/cắt
+    gần như tức thì. Giữ nguyên fps và độ dài nên frame index / timestamp
+    trên proxy khớp 1-1 với video gốc.
+    Proxy chỉ được tạo một lần cho mỗi video (cache theo hash).
+    """
+    video_path = Path(video_path)
+    out_path = proxy_path_for(video_path)
+    if out_path.exists():
+        logger.info(f"Using cached proxy: {out_path.name}")
+        return out_path
+
+    proxy_cfg = configs.get("proxy", {})
+    height = int(proxy_cfg.get("height", 360))
+    crf = int(proxy_cfg.get("crf", 28))
+
+    PROXY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_suffix(".tmp.mp4")
+
+    cmd = [
+        get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-i", str(video_path),
+        "-an",
+        "-vf", f"scale=-2:{height}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", str(crf),
+        "-g", "1", "-bf", "0",
+        "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart",
+        str(tmp_path),
+    ]
+
+    logger.info(f"Building {height}p proxy for {video_path.name}...")
+    try:
+        subprocess.run(cmd, check=True)
+    except Exception:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    tmp_path.replace(out_path)
+    logger.info(f"Proxy saved to: {out_path}")
+    return out_path
+
+
+def working_video(video_path: Path) -> Path:
+    """Video mà các bước phân tích / cắt clip nên đọc: proxy nếu bật proxy mode."""
+    video_path = Path(video_path)
+    if not proxy_enabled():
+        return video_path
+    return build_proxy(video_path)
+
+
+if __name__ == "__main__":
+    from common import VIDEO_PATH
+
+    build_proxy(VIDEO_PATH)
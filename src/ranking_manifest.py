@@ -0,0 +1,84 @@
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from common import FRAMES_RANKING_DIR
+
+# Kết quả ranking của mọi subplot trong một file (thay cho ảnh copy theo điểm)
+RANKING_MANIFEST_PATH = FRAMES_RANKING_DIR / "ranking.npz"
+
+
+@dataclass
+class RankingManifest:
+    """
+    Ma trận điểm subplot x frame + top-k của từng subplot.
+    Cột j ứng với frame_ids[j] trong FrameCatalog; frame gần trùng (dedup)
+    mang điểm của frame đại diện, còn top-k chỉ gồm frame đại diện.
+    """
+
+    scene_names: list[str]
+    frame_ids: np.ndarray     # (F,) int64
+    video_ids: np.ndarray     # (F,) int64
+    timestamps: np.ndarray    # (F,) float64, giây
+    scores: np.ndarray        # (S, F) float32
+    topk_cols: np.ndarray     # (S, k) int64, index cột; -1 = trống
+    topk_scores: np.ndarray   # (S, k) float32
+
+    def save(self, path: Path = RANKING_MANIFEST_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez_compressed(
+            tmp,
+            scene_names=np.array(self.scene_names),
+            frame_ids=self.frame_ids,
+            video_ids=self.video_ids,
+            timestamps=self.timestamps,
+            scores=self.scores,
+            topk_cols=self.topk_cols,
+            topk_scores=self.topk_scores,
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path = RANKING_MANIFEST_PATH) -> "RankingManifest":
+        with np.load(path) as data:
+            return cls(
+                scene_names=data["scene_names"].tolist(),
+                frame_ids=data["frame_ids"],
+                video_ids=data["video_ids"],
+                timestamps=data["timestamps"],
+                scores=data["scores"],
+                topk_cols=data["topk_cols"],
+                topk_scores=data["topk_scores"],
+            )
+
+    def scene_row(self, scene_name: str) -> int | None:
+        try:
+            return self.scene_names.index(scene_name)
+        except ValueError:
+            return None
+
+    def scene_fingerprint(self, scene_name: str) -> str:
+        """Hash dòng điểm + top-k của scene và các frame (video, timestamp) mà nó chấm."""
+        row = self.scene_row(scene_name)
+        if row is None:
+            return "missing"
+        h = hashlib.sha1()
+        for arr in (self.frame_ids, self.video_ids, self.timestamps, self.scores[row],
+                    self.topk_cols[row], self.topk_scores[row]):
+            h.update(np.ascontiguousarray(arr).tobytes())
+        return h.hexdigest()[:16]
+
+    def top_frames(self, scene_name: str) -> list[tuple[float, int]]:
+        """[(score, frame_id)] của top-k, điểm giảm dần."""
+        row = self.scene_row(scene_name)
+        if row is None:
+            return []
+        return [
+            (float(score), int(self.frame_ids[col]))
+            for score, col in zip(self.topk_scores[row], self.topk_cols[row])
+            if col >= 0
+        ]
@@ -0,0 +1,59 @@
+import hashlib
+import json
+from pathlib import Path
+
+from common import PROJECT_DIR, SUBPLOTS_DIR, file_fingerprint
+
+# Dấu vân tay đầu vào của từng scene ở từng bước (voice / clip / mix).
+# Bước nào thấy key không đổi và file output còn đó thì bỏ qua scene đó.
+SCENE_STATE_PATH = PROJECT_DIR / ".scene_state.json"
+
+
+def content_key(*parts) -> str:
+    """Hash các đầu vào của 1 bước: chuỗi / số giữ nguyên, Path thì lấy fingerprint file."""
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, Path):
+            part = file_fingerprint(part) if part.exists() else "missing"
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+def subplot_text(scene_name: str) -> str:
+    path = SUBPLOTS_DIR / scene_name / "subplot.txt"
+    return path.read_text(encoding="utf-8").strip() if path.exists() else ""
+
+
+class SceneState:
+    """{stage: {scene_name: key}} lưu trong PROJECT_DIR/.scene_state.json."""
+
+    def __init__(self, path: Path = SCENE_STATE_PATH):
+        self.path = Path(path)
+        self.data = {}
+        if self.path.exists():
+            try:
+                self.data = json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception:
+                self.data = {}
+
+    def is_current(self, stage: str, scene_name: str, key: str, *outputs: Path) -> bool:
+        """Scene không đổi: key giống lần trước và mọi output vẫn còn trên đĩa."""
+        return (
+            self.data.get(stage, {}).get(scene_name) == key
+            and all(Path(p).exists() for p in outputs)
+        )
+
+    def mark(self, stage: str, scene_name: str, key: str) -> None:
+        self.data.setdefault(stage, {})[scene_name] = key
+        self.save()
+
+    def forget(self, stage: str, scene_name: str) -> None:
+        self.data.get(stage, {}).pop(scene_name, None)
+        self.save()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.data, indent=2), encoding="utf-8")
+        tmp.replace(self.path)
@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+
+
+def timeline_scores(timestamps, scores, duration: float, step: float = 0.25):
+    """
+    Đưa điểm của các frame đã lấy mẫu lên một lưới thời gian đều (mỗi `step` giây)
+    bằng nội suy tuyến tính. Trả về (grid_t, grid_scores).
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    scores = np.asarray(scores, dtype=np.float64)
+    order = np.argsort(timestamps)
+
+    grid_t = np.arange(0.0, max(duration, step), step)
+    grid_scores = np.interp(grid_t, timestamps[order], scores[order])
+    return grid_t, grid_scores
+
+
+def window_means(values: np.ndarray, window_len: int) -> np.ndarray:
+    """Trung bình trượt độ dài window_len bằng cumsum: O(N) cho mọi vị trí."""
+    if window_len <= 0 or window_len > len(values):
+        return np.zeros(0)
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    return (csum[window_len:] - csum[:-window_len]) / window_len
+
+
+def best_window(timestamps, scores, duration: float, window_sec: float,
+                used_segments=(), step: float = 0.25, buffer: float = 2.0):
+    """
+    Tìm đoạn dài đúng window_sec có điểm trung bình cao nhất, không chồng lên
+    used_segments (cùng quy tắc buffer với make_clip.is_overlapping).
+    Trả về (start, mean_score) hoặc None nếu không có đoạn hợp lệ.
+    """
+    if len(timestamps) == 0 or window_sec > duration:
+        return None
+
+    grid_t, grid_scores = timeline_scores(timestamps, scores, duration, step)
+    n = max(1, math.ceil(window_sec / step))
+    means = window_means(grid_scores, n)
+    if len(means) == 0:
+        return None
+
+    starts = grid_t[:len(means)]
+    valid = starts + window_sec <= duration
+    for u_start, u_end in used_segments:
+        valid &= ~((starts < u_end - buffer) & (starts + window_sec > u_start + buffer))
+
+    if not valid.any():
+        return None
+    best = int(np.argmax(np.where(valid, means, -np.inf)))
+    return float(starts[best]), float(means[best])
@@ -1,86 +1,22 @@
+import asyncio
 import logging
 import shutil
 import json
-import os
-import time
 from pathlib import Path
 
-# Sử dụng thư viện ổn định (google-generativeai)
-import google.generativeai as genai
-from google.api_core import exceptions
-
 from common import PROJECT_DIR, SUBPLOTS_DIR, configs
+from llm_client import AsyncLLMClient, make_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 PLOT_PATH = PROJECT_DIR / "plot.txt"
+# Kết quả intro/outro sinh song song với subplot, bg.py đọc lại file này
+INTRO_OUTRO_PATH = PROJECT_DIR / "intro_outro.json"
+INTRO_OUTRO_CONFIG = {"temperature": 0.9, "max_output_tokens": 500}
 
-def get_best_available_model():
-    try:
-        available_models = []
-        for m in genai.list_models():
-            if 'generateContent' in m.supported_generation_methods:
-                available_models.append(m.name)
-                
-        # Danh sách ưu tiên (Model ổn định trước)
-        priorities = [
-            "models/gemini-1.5-flash",
-            "models/gemini-1.5-pro",
-            "models/gemini-pro",
-            "models/gemini-1.0-pro"
-        ]
-        
-        for p in priorities:
-            if p in available_models:
-                logger.info(f"-> Đã chọn model: {p}")
-                return p
-        
-        # Fallback
-        if available_models:
-            first = available_models[0]
-            return first
-            
-        raise RuntimeError("Không tìm thấy model nào hỗ trợ generateContent.")
-
-    except Exception as e:
-        logger.error(f"Lỗi khi dò tìm model: {e}")
-        return "models/gemini-pro"
-
-def generate_with_retry(model, prompt, retries=3):
-    """
-    Cơ chế thử lại khi bị lỗi Quota (429)
-    """
-    for attempt in range(retries + 1):
-        try:
-            response = model.generate_content(prompt)
-            return response.text
-        except exceptions.ResourceExhausted:
-            # Lỗi 429: Hết lượt gọi -> Chờ và thử lại
-            wait_time = 30 * (attempt + 1)
-            logger.warning(f"Hết Quota (429). Đang nghỉ {wait_time}s rồi thử lại...")
-            time.sleep(wait_time)
-            continue
-        except Exception as e:
-            logger.error(f"Lỗi API: {e}")
-            raise e
-            
-    raise RuntimeError("Đã hết số lần thử lại (Max Retries).")
-
-def generate_subplots_with_gemini(plot: str, n_subplots: int = 6) -> list[str]:
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        api_key = configs.get("gemini_api_key")
-    if not api_key:
-        raise RuntimeError("Thiếu GEMINI_API_KEY.")
-
-    genai.configure(api_key=api_key)
-
-    # 1. Tự chọn model
-    model_name = get_best_available_model()
-    model = genai.GenerativeModel(model_name)
-
-    prompt = f"""
+def build_subplot_prompt(plot: str, n_subplots: int) -> str:
+    return f"""
     You are a plot condensation and structuring assistant for video trailers.
 
     Your task is to produce exactly {n_subplots} subplots suitable for a game trailer,
@@ -120,12 +56,7 @@ def generate_subplots_with_gemini(plot: str, n_subplots: int = 6) -> list[str]:
     {plot}
         """
 
-    logger.info(f"Gửi lệnh cho model {model_name}...")
-    
-    # 2. Gọi API với cơ chế retry
-    text = generate_with_retry(model, prompt)
-    
-    # 3. Xử lý kết quả
+def parse_subplots(text: str, n_subplots: int) -> list[str]:
     text = text.strip()
     if text.startswith("```json"): text = text[7:]
     if text.endswith("```"): text = text[:-3]
@@ -139,6 +70,69 @@ def generate_subplots_with_gemini(plot: str, n_subplots: int = 6) -> list[str]:
 
     return subplots[:n_subplots]
 
+def build_intro_outro_prompt(plot_text: str) -> str:
+    return f"""
+You are an expert cinematic trailer narrator.
+Read this game plot and produce:
+
+1. "tone": Emotional tone (few words)
+2. "intro_text": 7–12 sec spoken intro
+3. "outro_text": 5–9 sec spoken outro
+4. "music_style": type of music fitting the trailer
+
+Return ONLY JSON.
+
+Plot:
+\"\"\"
+{plot_text}
+\"\"\"
+"""
+
+def parse_intro_outro(text: str) -> dict:
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start = text.find("{")
+        end = text.rfind("}")
+        if start == -1 or end == -1:
+            raise RuntimeError(f"Gemini trả về JSON sai:\n{text}")
+        return json.loads(text[start:end+1])
+
+async def generate_subplots_async(client: AsyncLLMClient, plot: str, n_subplots: int = 6) -> list[str]:
+    model_name = await client.pick_model()
+    logger.info(f"Gửi lệnh cho model {model_name}...")
+    return await client.generate(
+        build_subplot_prompt(plot, n_subplots), model=model_name,
+        parse=lambda text: parse_subplots(text, n_subplots),
+    )
+
+async def generate_intro_outro_async(client: AsyncLLMClient, plot: str) -> dict:
+    model_name = await client.pick_model()
+    return await client.generate(
+        build_intro_outro_prompt(plot), model=model_name, generation_config=INTRO_OUTRO_CONFIG,
+        parse=parse_intro_outro,
+    )
+
+def generate_subplots_with_gemini(plot: str, n_subplots: int = 6) -> list[str]:
+    return asyncio.run(generate_subplots_async(make_client(), plot, n_subplots))
+
+async def generate_all(plot: str, n_subplots: int) -> tuple[list[str], dict | None]:
+    """Gửi song song prompt subplot và prompt intro/outro (dùng chung client + cache)."""
+    client = make_client()
+    subplots, intro_outro = await asyncio.gather(
+        generate_subplots_async(client, plot, n_subplots),
+        generate_intro_outro_async(client, plot),
+        return_exceptions=True,
+    )
+    if isinstance(subplots, BaseException):
+        raise subplots
+    if isinstance(intro_outro, BaseException):
+        # Intro/outro là bước phụ: main() xoá file cũ, bg.py sẽ tự gọi lại
+        logger.warning(f"Intro/outro generation failed: {intro_outro}")
+        intro_outro = None
+    return subplots, intro_outro
+
 def save_scenes(subplots: list[str]):
     if SUBPLOTS_DIR.exists():
         shutil.rmtree(SUBPLOTS_DIR)
@@ -166,9 +160,17 @@ def main():
 
     n_subplots = configs.get("subplot", {}).get("n_subplots", 6)
 
-    subplots = generate_subplots_with_gemini(plot_text, n_subplots)
+    subplots, intro_outro = asyncio.run(generate_all(plot_text, n_subplots))
     save_scenes(subplots)
 
+    if intro_outro is not None:
+        INTRO_OUTRO_PATH.write_text(
+            json.dumps(intro_outro, indent=2, ensure_ascii=False), encoding="utf-8"
+        )
+    else:
+        # Không để bg.py dùng nhầm intro/outro của plot trước -> bg.py tự sinh lại
+        INTRO_OUTRO_PATH.unlink(missing_ok=True)
+
     logger.info("\nDONE: Đã tạo kịch bản thành công.\n")
 
 if __name__ == "__main__":
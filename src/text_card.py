@@ -0,0 +1,125 @@
+import logging
+import subprocess
+import tempfile
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+
+from common import configs, get_ffmpeg_exe
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# style -> (màu nền, màu chữ)
+STYLES = {
+    "dark": ((0, 0, 0), (255, 255, 255)),
+    "light": ((240, 240, 240), (0, 0, 0)),
+}
+
+# Thử lần lượt khi không cấu hình text_card.font (Linux / Windows / macOS)
+FONT_CANDIDATES = [
+    "DejaVuSans-Bold.ttf",
+    "DejaVuSans.ttf",
+    "arialbd.ttf",
+    "arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/Library/Fonts/Arial Bold.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
+    "C:/Windows/Fonts/arialbd.ttf",
+]
+
+
+def load_font(size: int):
+    custom = configs.get("text_card", {}).get("font")
+    for name in ([custom] if custom else []) + FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    logger.warning("No TrueType font found, falling back to Pillow's default font")
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1
+        return ImageFont.load_default()
+
+
+def wrap_text(draw, text: str, font, max_width: int) -> list:
+    """Ngắt dòng theo độ rộng pixel thật của font (giống TextClip method='caption')."""
+    lines = []
+    for paragraph in text.splitlines() or [""]:
+        words = paragraph.split()
+        line = ""
+        for word in words:
+            candidate = f"{line} {word}".strip()
+            if line and draw.textlength(candidate, font=font) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def render_card(text: str, size=(1920, 1080), style: str = "dark", font_size: int = 60) -> Image.Image:
+    """Rasterize caption 1 lần: chữ căn giữa, rộng tối đa 80% khung."""
+    bg_color, text_color = STYLES.get(style, STYLES["dark"])
+    w, h = size
+    img = Image.new("RGB", size, bg_color)
+    draw = ImageDraw.Draw(img)
+    font = load_font(font_size)
+
+    lines = wrap_text(draw, text, font, int(w * 0.8))
+    line_h = int(font_size * 1.3)
+    y = (h - line_h * len(lines)) // 2
+    for line in lines:
+        draw.text((w // 2, y + line_h // 2), line, font=font, fill=text_color, anchor="mm")
+        y += line_h
+    return img
+
+
+def audio_duration(audio_path: Path) -> float:
+    import soundfile as sf
+
+    return sf.info(str(audio_path)).duration
+
+
+def create_text_card(text: str, audio_path: Path, out_path: Path, style: str = "dark",
+                     size=(1920, 1080), fps: int = 30, fade_sec: float = 0.8) -> Path:
+    """
+    Card chữ tĩnh + voice: ảnh được vẽ 1 lần, ffmpeg decode + đổi sang yuv420p 1 lần
+    rồi lặp frame đó (filter loop), fade bằng filter `fade` về màu nền (tương đương
+    ramp alpha của lớp chữ). Không dựng lại từng frame như CompositeVideoClip.
+    """
+    duration = audio_duration(audio_path)
+    fade_sec = min(fade_sec, duration / 2)
+    bg_color = "0x%02X%02X%02X" % STYLES.get(style, STYLES["dark"])[0]
+
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        card_path = Path(tmp) / "card.png"
+        render_card(text, size, style).save(card_path)
+
+        vf = (
+            f"format=yuv420p,loop=loop=-1:size=1:start=0,setpts=N/{fps}/TB,"
+            f"fade=t=in:st=0:d={fade_sec:.3f}:color={bg_color},"
+            f"fade=t=out:st={duration - fade_sec:.3f}:d={fade_sec:.3f}:color={bg_color}"
+        )
+        crf = int(configs.get("text_card", {}).get("crf", 20))
+        cmd = [
+            get_ffmpeg_exe(), "-y", "-loglevel", "error",
+            "-framerate", str(fps), "-i", str(card_path),
+            "-i", str(audio_path),
+            "-vf", vf,
+            # Chỉ các frame fade thay đổi, phần giữa gần như chỉ là skip block
+            "-c:v", "libx264", "-preset", "ultrafast", "-crf", str(crf), "-r", str(fps),
+            "-c:a", "aac",
+            "-t", f"{duration:.3f}",
+            "-movflags", "+faststart",
+            str(out_path),
+        ]
+        subprocess.run(cmd, check=True)
+
+    logger.info(f"Text card saved: {out_path.name} ({duration:.1f}s)")
+    return out_path
@@ -1,76 +1,221 @@
 import sys
+import time
+import threading
 import subprocess
 from pathlib import Path
 import shutil
 
+from common import PROJECT_DIR, configs
+from pipeline_events import EventWriter, pause_requested
+
 # --- CẤU HÌNH ---
 ROOT = Path(__file__).resolve().parents[1]
 SRC = ROOT / "src"
-PROJECT = ROOT / "projects" / "LOL"
+PROJECT = PROJECT_DIR
 CHECKPOINT_DIR = PROJECT / ".checkpoints" 
 
-# ĐỊNH NGHĨA QUY TRÌNH
+# ĐỊNH NGHĨA QUY TRÌNH (DAG)
+# Mỗi bước chỉ chờ các bước trong "deps": phần xử lý video (frame, embed)
+# chạy song song với phần chờ mạng (plot -> subplot), ranking nối 2 nhánh lại.
 STEPS = [
-    {"name": "Phase 1: Plot Retrieval", "script": "plot_retrieval.py"},
-    {"name": "Phase 2: Subplot Generation", "script": "subplot.py"},
-    {"name": "Phase 3: Frame Extraction", "script": "frame.py"},
-    {"name": "Phase 4: Frame Ranking", "script": "image_retrieval.py"},
-    {"name": "Phase 5: Voice Gen", "script": "voice.py"},
-    {"name": "Phase 6: Clip Creation", "script": "make_clip.py"},
-    {"name": "Phase 7: Audio Mixing", "script": "audio_clip.py"},
-    {"name": "Phase 8: Final Assembly", "script": "join_clip.py"} 
+    {"id": "plot", "name": "Phase 1: Plot Retrieval", "script": "plot_retrieval.py", "deps": []},
+    {"id": "subplot", "name": "Phase 2: Subplot Generation", "script": "subplot.py", "deps": ["plot"]},
+    {"id": "frame", "name": "Phase 3: Frame Extraction", "script": "frame.py", "deps": []},
+    {"id": "embed", "name": "Phase 4a: Frame Embedding", "script": "image_retrieval.py",
+     "args": ["--stage", "embed"], "deps": ["frame"]},
+    {"id": "rank", "name": "Phase 4b: Frame Ranking", "script": "image_retrieval.py",
+     "args": ["--stage", "rank"], "deps": ["embed", "subplot"]},
+    {"id": "voice", "name": "Phase 5: Voice Gen", "script": "voice.py", "deps": ["subplot"]},
+    {"id": "clip", "name": "Phase 6: Clip Creation", "script": "make_clip.py", "deps": ["rank", "voice"]},
+    {"id": "mix", "name": "Phase 7: Audio Mixing", "script": "audio_clip.py", "deps": ["clip"]},
+    {"id": "join", "name": "Phase 8: Final Assembly", "script": "join_clip.py", "deps": ["mix"]},
 ]
 
+# Progressive: tải video_input.mp4 như 1 bước nền không phụ thuộc bước nào; frame.py
+# chạy cùng lúc và đọc dần file đang tải (xem detect_scenes_progressive).
+# Bước "background" không chiếm suất của pipeline.max_parallel vì chỉ chờ mạng.
+if configs.get("video_retrieval", {}).get("progressive", False):
+    STEPS.insert(0, {"id": "download", "name": "Phase 0: Video Download", "script": "video_retrieval.py",
+                     "deps": [], "background": True})
+
+# Nhạc nền sinh trong pipeline: sau voice (độ dài nhạc = tổng độ dài voice, không phải
+# loop lại track mặc định) và trước clip (make_clip cắt theo beat của nhạc)
+if configs.get("music", {}).get("in_pipeline", False):
+    clip_pos = next(i for i, s in enumerate(STEPS) if s["id"] == "clip")
+    STEPS.insert(clip_pos, {"id": "music", "name": "Phase 5b: Music Gen", "script": "music_gen.py", "deps": ["voice"]})
+    STEPS[clip_pos + 1]["deps"] = STEPS[clip_pos + 1]["deps"] + ["music"]
+
+def marker_path(step) -> Path:
+    return CHECKPOINT_DIR / f"{step['id']}.done"
+
+def completed_steps() -> set:
+    """Bước được coi là xong khi có marker VÀ mọi bước phụ thuộc cũng đã xong."""
+    done = set()
+    for step in STEPS:  # STEPS đã theo thứ tự topo
+        if marker_path(step).exists() and all(d in done for d in step["deps"]):
+            done.add(step["id"])
+    return done
+
+def downstream_steps(step_ids) -> list:
+    """step_ids và mọi bước phụ thuộc (trực tiếp / gián tiếp) vào chúng, theo thứ tự topo."""
+    affected = set(step_ids)
+    for step in STEPS:
+        if any(d in affected for d in step["deps"]):
+            affected.add(step["id"])
+    return [step for step in STEPS if step["id"] in affected]
+
+def invalidate_from(step_ids):
+    """
+    Xoá marker của step_ids và các bước sau chúng để lần chạy tới làm lại.
+    Dùng khi sửa subplot: `--from-step rank,voice` chạy lại rank/voice/clip/mix/join,
+    các bước theo scene tự bỏ qua scene không đổi (xem scene_state.py).
+    """
+    unknown = set(step_ids) - {step["id"] for step in STEPS}
+    if unknown:
+        print(f"ERROR: Unknown step(s): {', '.join(sorted(unknown))}")
+        sys.exit(1)
+    invalidated = []
+    for step in downstream_steps(step_ids):
+        if marker_path(step).exists():
+            marker_path(step).unlink()
+            print(f"Invalidated: {step['name']}")
+            invalidated.append(step["name"])
+    EventWriter().emit("steps_invalidated", names=invalidated)
+
+def pump_output(step, proc, events: EventWriter):
+    """Chuyển stdout của bước con ra stdout + kênh sự kiện (dòng 'log')."""
+    for line in proc.stdout:
+        line = line.rstrip()
+        if not line:
+            continue
+        print(line)
+        sys.stdout.flush()
+        events.emit("log", step=step["id"], line=line)
+
+def start_step(step, python_exe, events: EventWriter):
+    script_path = SRC / step["script"]
+    if not script_path.exists():
+        print(f"ERROR: Missing script {step['script']}")
+        sys.exit(1)
+    cmd = [python_exe, str(script_path)] + step.get("args", [])
+    proc = subprocess.Popen(cmd, cwd=ROOT, text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    proc.pump = threading.Thread(target=pump_output, args=(step, proc, events), daemon=True)
+    proc.pump.start()
+    return proc
+
 def run_pipeline():
     python_exe = sys.executable
+    events = EventWriter()
     print("--- PIPELINE ORCHESTRATOR STARTED ---")
     sys.stdout.flush()
     
     CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
-    
+
     total = len(STEPS)
-    start_index = 0
-    
-    for i, step in enumerate(STEPS):
-        marker_name = f"{i+1}_{step['script']}.done"
-        marker_path = CHECKPOINT_DIR / marker_name
-        
-        if marker_path.exists():
-            print(f"[STEP {i+1}/{total}] SKIPPED: {step['name']} (Completed)")
-            start_index = i + 1
+    index = {step["id"]: i + 1 for i, step in enumerate(STEPS)}
+    max_parallel = int(configs.get("pipeline", {}).get("max_parallel", 2))
+    events.emit("pipeline_started", total=total, steps=[{"id": s["id"], "name": s["name"]} for s in STEPS])
+
+    done = completed_steps()
+    for step in STEPS:
+        if step["id"] in done:
+            print(f"[STEP {index[step['id']]}/{total}] SKIPPED: {step['name']} (Completed)")
+            events.emit("step_skipped", step=step["id"], name=step["name"], index=index[step["id"]], total=total)
         else:
-            break 
-            
+            # Marker cũ của bước chưa hợp lệ (bước trước chạy lại) -> bỏ
+            if marker_path(step).exists(): marker_path(step).unlink()
     sys.stdout.flush()
 
-    for i in range(start_index, total):
-        step = STEPS[i]
-        script_name = step["script"]
-        step_name = step["name"]
-        
-        marker_name = f"{i+1}_{script_name}.done"
-        marker_path = CHECKPOINT_DIR / marker_name
-        
-        print(f"[STEP {i+1}/{total}] RUNNING: {step_name}...")
-        sys.stdout.flush()
-        
-        script_path = SRC / script_name
-        if not script_path.exists():
-            print(f"ERROR: Missing script {script_name}")
+    running = {}  # id -> Popen
+
+    while len(done) < total:
+        # 1. Khởi chạy mọi bước đã đủ điều kiện (trong giới hạn song song).
+        # Đang có yêu cầu pause -> không mở bước mới, chỉ chờ bước đang chạy xong
+        paused = pause_requested()
+        for step in STEPS:
+            sid = step["id"]
+            busy = sum(1 for r in running if not STEPS[index[r] - 1].get("background"))
+            if paused or sid in done or sid in running:
+                continue
+            if busy >= max_parallel and not step.get("background"):
+                continue
+            if all(d in done for d in step["deps"]):
+                print(f"[STEP {index[sid]}/{total}] RUNNING: {step['name']}...")
+                sys.stdout.flush()
+                events.emit("step_started", step=sid, name=step["name"], index=index[sid], total=total)
+                running[sid] = start_step(step, python_exe, events)
+
+        if not running:
+            if paused:
+                # Dừng ở ranh giới bước: mọi bước đã chạy đều có marker, RESUME chạy tiếp từ đây
+                print("--- PIPELINE PAUSED ---")
+                events.emit("pipeline_paused", completed=sorted(done))
+                sys.stdout.flush()
+                return
+            print("ERROR: Pipeline has unsatisfiable step dependencies")
+            events.emit("pipeline_failed", error="unsatisfiable step dependencies")
             sys.exit(1)
+
+        # 2. Chờ bước nào đó kết thúc
+        time.sleep(0.2)
+        for sid, proc in list(running.items()):
+            if proc.poll() is None:
+                continue
+            del running[sid]
+            proc.pump.join()  # log cuối của bước được ghi trước sự kiện DONE/FAILED
+            step = STEPS[index[sid] - 1]
+
+            if proc.returncode == 0:
+                marker_path(step).touch()
+                done.add(sid)
+                print(f"[STEP {index[sid]}/{total}] DONE: {step['name']}")
+                events.emit("step_done", step=sid, name=step["name"], index=index[sid], total=total)
+            else:
+                print(f"FAILED at {step['name']}")
+                events.emit("step_failed", step=sid, name=step["name"], returncode=proc.returncode)
+                for other in running.values():
+                    other.terminate()
+                for other in running.values():
+                    other.wait()
+                events.emit("pipeline_failed", error=f"{step['name']} exited with code {proc.returncode}")
+                sys.exit(1)
+            sys.stdout.flush()
             
+    print("--- PIPELINE FINISHED SUCCESSFULLY ---")
+    events.emit("pipeline_finished")
+    sys.stdout.flush()
+
+# Render lại full-res từ video gốc (sau khi duyệt bản preview dựng từ proxy)
+FULL_RES_STEPS = [
+    {"name": "Full-Res: Clip Creation", "script": "make_clip.py", "args": ["--full-res"]},
+    {"name": "Full-Res: Audio Mixing", "script": "audio_clip.py"},
+    {"name": "Full-Res: Final Assembly", "script": "join_clip.py"},
+]
+
+def run_full_resolution():
+    python_exe = sys.executable
+    print("--- FULL-RESOLUTION RENDER STARTED ---")
+    sys.stdout.flush()
+
+    total = len(FULL_RES_STEPS)
+    for i, step in enumerate(FULL_RES_STEPS):
+        print(f"[STEP {i+1}/{total}] RUNNING: {step['name']}...")
+        sys.stdout.flush()
+        cmd = [python_exe, str(SRC / step["script"])] + step.get("args", [])
         try:
-            subprocess.run([python_exe, str(script_path)], cwd=ROOT, check=True, text=True)
-            marker_path.touch()
-            print(f"[STEP {i+1}/{total}] DONE: {step_name}")
-            
+            subprocess.run(cmd, cwd=ROOT, check=True, text=True)
+            print(f"[STEP {i+1}/{total}] DONE: {step['name']}")
         except subprocess.CalledProcessError:
-            print(f"FAILED at {step_name}")
-            if marker_path.exists(): marker_path.unlink()
+            print(f"FAILED at {step['name']}")
             sys.exit(1)
-            
-    print("--- PIPELINE FINISHED SUCCESSFULLY ---")
+
+    print("--- FULL-RESOLUTION RENDER FINISHED ---")
     sys.stdout.flush()
 
 if __name__ == "__main__":
-    run_pipeline()
+    if "--full-res" in sys.argv:
+        run_full_resolution()
+    else:
+        if "--from-step" in sys.argv:
+            invalidate_from(sys.argv[sys.argv.index("--from-step") + 1].split(","))
+        run_pipeline()
@@ -0,0 +1,254 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 1:
+        x = x[None, :]
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def top_k_indices(scores: np.ndarray, k: int):
+    """Top-k theo hàng bằng argpartition (O(N)) rồi mới sort k phần tử."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((len(scores), 0), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+class ExactIndex:
+    """Brute-force cosine similarity trên numpy (chuẩn để so recall)."""
+
+    kind = "exact"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, vectors, ids) -> None:
+        self.vectors = np.concatenate([self.vectors, _normalize(vectors)])
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+
+    def search(self, queries, k: int):
+        """Trả về (scores, ids), mỗi mảng shape (n_queries, k)."""
+        scores = _normalize(queries) @ self.vectors.T
+        idx = top_k_indices(scores, k)
+        return np.take_along_axis(scores, idx, axis=1), self.ids[idx]
+
+    def score_rows(self, queries, n_ids: int) -> np.ndarray:
+        """
+        Điểm cosine của mọi ứng viên mà index chấm, dạng ma trận (n_queries, n_ids)
+        với cột = id; id không được chấm mang -inf. Exact chấm tất cả.
+        """
+        out = np.full((len(queries), n_ids), -np.inf, dtype=np.float32)
+        out[:, self.ids] = _normalize(queries) @ self.vectors.T
+        return out
+
+    def _params(self) -> dict:
+        return {}
+
+    def _arrays(self) -> dict:
+        return {"vectors": self.vectors, "ids": self.ids}
+
+    def _restore(self, arrays) -> None:
+        self.vectors = arrays["vectors"]
+        self.ids = arrays["ids"]
+
+    def save(self, index_dir: Path) -> None:
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        meta = {"kind": self.kind, "dim": self.dim, "params": self._params()}
+        (index_dir / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        tmp = index_dir / "data.tmp.npz"
+        np.savez(tmp, **self._arrays())
+        tmp.replace(index_dir / "data.npz")
+
+
+class IVFIndex(ExactIndex):
+    """
+    Inverted-file index: k-means chia vector thành n_lists cụm, khi search chỉ
+    quét n_probe cụm gần query nhất. Vector thêm trước khi đủ dữ liệu để train
+    được giữ trong buffer và search exact.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, dim: int, n_lists: int = 256, n_probe: int = 8, min_train_per_list: int = 39):
+        super().__init__(dim)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_per_list = min_train_per_list
+        self.centroids = None
+        self.assign = np.zeros(0, dtype=np.int32)
+        self._order = None  # vector sắp theo cụm, tính lại khi có add mới
+        self._offsets = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, sample: np.ndarray, n_iter: int = 20, seed: int = 0) -> None:
+        """Spherical k-means trên sample đã chuẩn hóa."""
+        sample = _normalize(sample)
+        n_lists = min(self.n_lists, len(sample))
+        rng = np.random.default_rng(seed)
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+
+        for _ in range(n_iter):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=n_lists) == 0
+            # Cụm rỗng: lấy lại một điểm ngẫu nhiên làm tâm
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        # n_lists giữ giá trị cấu hình (để so tham số khi mở lại index), số cụm thật = len(centroids)
+        self.centroids = centroids
+        self.assign = np.argmax(self.vectors @ centroids.T, axis=1).astype(np.int32) if len(self) else self.assign
+        self._order = None
+
+    def add(self, vectors, ids) -> None:
+        vectors = _normalize(vectors)
+        super().add(vectors, ids)
+        if self.is_trained:
+            new_assign = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+            self.assign = np.concatenate([self.assign, new_assign])
+            self._order = None
+        elif len(self) >= self.n_lists * self.min_train_per_list:
+            logger.info(f"Training IVF index on {len(self)} vectors ({self.n_lists} lists)...")
+            self.train(self.vectors)
+
+    def _build_layout(self):
+        self._order = np.argsort(self.assign, kind="stable")
+        counts = np.bincount(self.assign, minlength=len(self.centroids))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def search(self, queries, k: int):
+        if not self.is_trained:
+            return super().search(queries, k)
+        if self._order is None:
+            self._build_layout()
+
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for qi, (rows, scores) in enumerate(self._probe(queries)):
+            if len(rows) == 0:
+                continue
+            top = top_k_indices(scores[None, :], k)[0]
+            all_scores[qi, :len(top)] = scores[top]
+            all_ids[qi, :len(top)] = self.ids[rows[top]]
+        return all_scores, all_ids
+
+    def score_rows(self, queries, n_ids: int) -> np.ndarray:
+        """Chỉ chấm các dòng trong n_probe cụm gần mỗi query, còn lại -inf."""
+        if not self.is_trained:
+            return super().score_rows(queries, n_ids)
+        if self._order is None:
+            self._build_layout()
+
+        out = np.full((len(queries), n_ids), -np.inf, dtype=np.float32)
+        for qi, (rows, scores) in enumerate(self._probe(queries)):
+            out[qi, self.ids[rows]] = scores
+        return out
+
+    def _probe(self, queries):
+        """Mỗi query: (các dòng trong n_probe cụm gần nhất, điểm cosine của chúng)."""
+        queries = _normalize(queries)
+        probes = top_k_indices(queries @ self.centroids.T, self.n_probe)
+        for qi, q in enumerate(queries):
+            rows = np.concatenate(
+                [self._order[self._offsets[c]:self._offsets[c + 1]] for c in probes[qi]]
+            )
+            yield rows, self.vectors[rows] @ q
+
+    def _params(self) -> dict:
+        return {"n_lists": self.n_lists, "n_probe": self.n_probe, "min_train_per_list": self.min_train_per_list}
+
+    def _arrays(self) -> dict:
+        arrays = super()._arrays()
+        arrays["assign"] = self.assign
+        if self.is_trained:
+            arrays["centroids"] = self.centroids
+        return arrays
+
+    def _restore(self, arrays) -> None:
+        super()._restore(arrays)
+        self.assign = arrays["assign"]
+        self.centroids = arrays["centroids"] if "centroids" in arrays else None
+
+
+INDEX_KINDS = {"exact": ExactIndex, "ivf": IVFIndex}
+
+
+def create_index(kind: str, dim: int, **params):
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind: {kind}")
+    return INDEX_KINDS[kind](dim, **params)
+
+
+def load_index(index_dir: Path):
+    index_dir = Path(index_dir)
+    meta = json.loads((index_dir / "meta.json").read_text(encoding="utf-8"))
+    index = create_index(meta["kind"], meta["dim"], **meta["params"])
+    with np.load(index_dir / "data.npz") as arrays:
+        index._restore({name: arrays[name] for name in arrays.files})
+    return index
+
+
+def open_or_create_index(index_dir: Path, kind: str, dim: int, **params):
+    """
+    Mở index đã lưu (để add thêm video mới) nếu cùng kind / dim / tham số,
+    ngược lại tạo index rỗng (cần build lại từ đầu).
+    """
+    meta_path = Path(index_dir) / "meta.json"
+    if meta_path.exists():
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        saved = create_index(meta["kind"], meta["dim"], **meta["params"])
+        wanted = create_index(kind, dim, **params)
+        if meta["kind"] == kind and meta["dim"] == dim and saved._params() == wanted._params():
+            return load_index(index_dir)
+        logger.info(f"Index settings changed ({meta['kind']} -> {kind}), rebuilding.")
+    return create_index(kind, dim, **params)
+
+
+def sync_index(index_dir: Path, vectors, keys: list[str], kind: str, tag: str = "", **params):
+    """
+    Index cho vectors (id = số thứ tự dòng), lưu ở index_dir. keys[i] định danh dòng i,
+    tag định danh thứ tạo ra vector (model). Incremental: chỉ add các dòng mới nếu
+    các dòng đã index vẫn cùng key, cùng tag; ngược lại build lại từ đầu.
+    Trả về (index, số dòng đã add).
+    """
+    index_dir = Path(index_dir)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rows_path = index_dir / "rows.json"
+
+    index = open_or_create_index(index_dir, kind, vectors.shape[1], **params)
+    n_old = len(index)
+    if n_old:
+        old = json.loads(rows_path.read_text(encoding="utf-8")) if rows_path.exists() else {}
+        if old.get("tag") != tag or n_old > len(keys) or old.get("keys") != list(keys[:n_old]):
+            logger.info("Indexed rows changed since the index was built, rebuilding.")
+            index = create_index(kind, vectors.shape[1], **params)
+            n_old = 0
+
+    if n_old < len(vectors):
+        index.add(vectors[n_old:], range(n_old, len(vectors)))
+        index.save(index_dir)
+        # Ghi sau index: nếu bị ngắt giữa chừng, lần sau thấy lệch và build lại
+        rows_path.write_text(json.dumps({"tag": tag, "keys": list(keys)}), encoding="utf-8")
+    return index, len(vectors) - n_old
@@ -0,0 +1,192 @@
+import bisect
+import hashlib
+import json
+import logging
+import re
+import shutil
+import subprocess
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from common import CACHE_DIR, file_fingerprint, get_ffmpeg_exe
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROBE_CACHE_DIR = CACHE_DIR / "probe"
+
+
+@dataclass
+class VideoMeta:
+    path: str
+    size: int
+    mtime: float
+    fingerprint: str
+    duration: float
+    fps: float
+    n_frames: int
+    width: int
+    height: int
+    codec: str
+    keyframes: list = field(default_factory=list)  # frame index của các keyframe, tăng dần
+
+    def keyframe_before(self, frame_idx: int) -> int:
+        """Keyframe gần nhất <= frame_idx (seek tới đó rồi decode tiếp là chính xác)."""
+        if not self.keyframes:
+            return 0
+        i = bisect.bisect_right(self.keyframes, frame_idx) - 1
+        return self.keyframes[max(i, 0)]
+
+
+def _cache_path(video_path: Path) -> Path:
+    key = hashlib.sha1(str(Path(video_path).resolve()).encode("utf-8")).hexdigest()[:16]
+    return PROBE_CACHE_DIR / f"{key}.json"
+
+
+def _ffprobe_exe():
+    """ffprobe trên PATH hoặc cạnh ffmpeg; imageio-ffmpeg không kèm ffprobe."""
+    exe = shutil.which("ffprobe")
+    if exe:
+        return exe
+    sibling = Path(get_ffmpeg_exe()).with_name("ffprobe")
+    for candidate in (sibling, sibling.with_suffix(".exe")):
+        if candidate.exists():
+            return str(candidate)
+    return None
+
+
+def _parse_rate(rate: str) -> float:
+    num, _, den = rate.partition("/")
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _probe_ffprobe(ffprobe: str, path: Path) -> dict:
+    out = subprocess.run(
+        [ffprobe, "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,start_time"
+         ":format=duration",
+         "-of", "json", str(path)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    info = json.loads(out)
+    stream = info["streams"][0]
+    fps = _parse_rate(stream.get("avg_frame_rate", "0/0")) or _parse_rate(stream.get("r_frame_rate", "0/0"))
+    start = float(stream.get("start_time") or 0.0)
+
+    # Chỉ đọc header packet (không decode) -> cờ K đánh dấu keyframe
+    packets = subprocess.run(
+        [ffprobe, "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", str(path)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    key_times = []
+    for line in packets.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags and pts not in ("", "N/A"):
+            key_times.append(float(pts) - start)
+
+    return {
+        "duration": float(info.get("format", {}).get("duration") or 0.0),
+        "fps": fps,
+        "n_frames": int(stream["nb_frames"]) if str(stream.get("nb_frames", "")).isdigit() else 0,
+        "width": int(stream.get("width", 0)),
+        "height": int(stream.get("height", 0)),
+        "codec": stream.get("codec_name", ""),
+        "key_times": key_times,
+    }
+
+
+def _probe_ffmpeg(path: Path) -> dict:
+    """Không có ffprobe: đọc header từ `ffmpeg -i`, keyframe bằng cách chỉ decode keyframe."""
+    ffmpeg = get_ffmpeg_exe()
+    header = subprocess.run([ffmpeg, "-hide_banner", "-i", str(path)], capture_output=True, text=True).stderr
+
+    duration = 0.0
+    m = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", header)
+    if m:
+        duration = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+    video_line = next((line for line in header.splitlines() if "Video:" in line), "")
+    codec = re.search(r"Video: (\w+)", video_line)
+    size = re.search(r", (\d{2,5})x(\d{2,5})", video_line)
+    fps = re.search(r"([\d.]+) fps", video_line) or re.search(r"([\d.]+) tbr", video_line)
+
+    shown = subprocess.run(
+        [ffmpeg, "-hide_banner", "-skip_frame", "nokey", "-i", str(path),
+         "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"],
+        capture_output=True, text=True,
+    ).stderr
+    key_times = [float(t) for t in re.findall(r"pts_time:\s*(-?[\d.]+)", shown)]
+
+    return {
+        "duration": duration,
+        "fps": float(fps.group(1)) if fps else 0.0,
+        "n_frames": 0,
+        "width": int(size.group(1)) if size else 0,
+        "height": int(size.group(2)) if size else 0,
+        "codec": codec.group(1) if codec else "",
+        "key_times": key_times,
+    }
+
+
+def probe_video(video_path: Path) -> VideoMeta:
+    """
+    Metadata của video (duration, fps, số frame, độ phân giải, codec, keyframe index).
+    Probe 1 lần rồi cache trong .cache/probe/; cache hợp lệ khi size + mtime khớp,
+    hoặc khi hash nội dung khớp (file được copy / touch lại).
+    """
+    video_path = Path(video_path)
+    st = video_path.stat()
+    cache_path = _cache_path(video_path)
+
+    if cache_path.exists():
+        try:
+            meta = VideoMeta(**json.loads(cache_path.read_text(encoding="utf-8")))
+            if meta.size == st.st_size and meta.mtime == st.st_mtime:
+                return meta
+            if meta.size == st.st_size and meta.fingerprint == file_fingerprint(video_path):
+                meta.mtime = st.st_mtime
+                cache_path.write_text(json.dumps(asdict(meta)), encoding="utf-8")
+                return meta
+        except Exception:
+            pass
+
+    logger.info(f"Probing video metadata: {video_path.name}")
+    ffprobe = _ffprobe_exe()
+    info = _probe_ffprobe(ffprobe, video_path) if ffprobe else _probe_ffmpeg(video_path)
+
+    fps = info["fps"] or 24.0
+    n_frames = info["n_frames"] or int(round(info["duration"] * fps))
+    keyframes = sorted({int(round(t * fps)) for t in info["key_times"] if t >= 0})
+    meta = VideoMeta(
+        path=str(video_path),
+        size=st.st_size,
+        mtime=st.st_mtime,
+        fingerprint=file_fingerprint(video_path),
+        duration=info["duration"] or n_frames / fps,
+        fps=fps,
+        n_frames=n_frames,
+        width=info["width"],
+        height=info["height"],
+        codec=info["codec"],
+        keyframes=keyframes or [0],
+    )
+
+    PROBE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(asdict(meta)), encoding="utf-8")
+    tmp.replace(cache_path)
+    return meta
+
+
+if __name__ == "__main__":
+    import sys
+
+    from common import VIDEO_INPUTS
+
+    for p in sys.argv[1:] or VIDEO_INPUTS:
+        m = probe_video(Path(p))
+        print(f"{m.path}: {m.width}x{m.height} {m.codec} {m.fps:.3f} fps, {m.duration:.2f}s, "
+              f"{m.n_frames} frames, {len(m.keyframes)} keyframes")
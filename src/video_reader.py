@@ -0,0 +1,101 @@
+import logging
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from common import configs, get_ffmpeg_exe
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Giới hạn số ffmpeg reader (VideoFileClip) mở cùng lúc trong 1 process
+MAX_OPEN_READERS = int(configs.get("clip", {}).get("max_open_readers", 2))
+_reader_slots = threading.BoundedSemaphore(MAX_OPEN_READERS)
+
+
+@contextmanager
+def open_video(path: Path, **kwargs):
+    """
+    Mở VideoFileClip chỉ trong phạm vi `with`, đóng reader (và audio reader)
+    ngay khi xong. Chặn lại nếu đã có MAX_OPEN_READERS reader đang mở.
+    """
+    from moviepy.editor import VideoFileClip
+
+    with _reader_slots:
+        clip = VideoFileClip(str(path), **kwargs)
+        try:
+            yield clip
+        finally:
+            clip.close()
+
+
+def conform_filter(width: int, height: int, fps: float) -> str:
+    """Filter ffmpeg đưa mọi clip về cùng khung width x height (giữ tỉ lệ, pad viền đen) và cùng fps."""
+    return (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps:.3f}"
+    )
+
+
+def concat_videos(paths: list[Path], out_path: Path) -> None:
+    """
+    Nối các clip bằng concat demuxer của ffmpeg: một process duy nhất, đọc
+    tuần tự từng file, không giữ clip nào trong RAM. Stream copy chỉ khi mọi
+    clip cùng codec / độ phân giải / fps (theo probe_video); nếu không (vd. nguồn
+    khác độ phân giải) thì encode lại, scale + pad về khung của clip đầu tiên.
+    """
+    from video_probe import probe_video
+
+    out_path = Path(out_path)
+    metas = [probe_video(p) for p in paths]
+    first = metas[0]
+    uniform = all(
+        (m.codec, m.width, m.height, round(m.fps, 3)) == (first.codec, first.width, first.height, round(first.fps, 3))
+        for m in metas
+    )
+
+    list_path = out_path.with_suffix(".concat.txt")
+    list_path.write_text(
+        "".join(f"file '{Path(p).resolve().as_posix()}'\n" for p in paths), encoding="utf-8"
+    )
+
+    base = [get_ffmpeg_exe(), "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", str(list_path)]
+    reencode = base[:]
+    if first.width and first.height:
+        reencode += ["-vf", conform_filter(first.width, first.height, first.fps)]
+    reencode += ["-c:v", "libx264", "-c:a", "aac", str(out_path)]
+    try:
+        if not uniform:
+            sizes = sorted({f"{m.width}x{m.height} {m.codec} {m.fps:.2f}fps" for m in metas})
+            logger.info(f"Clips differ ({', '.join(sizes)}), re-encoding to {first.width}x{first.height}...")
+            subprocess.run(reencode, check=True)
+            return
+        try:
+            subprocess.run(base + ["-c", "copy", str(out_path)], check=True)
+        except subprocess.CalledProcessError:
+            logger.warning("Stream copy concat failed, re-encoding...")
+            subprocess.run(reencode, check=True)
+    finally:
+        list_path.unlink(missing_ok=True)
+
+
+def peak_memory_mb() -> float | None:
+    """Peak RSS (MB) của process hiện tại + process con (ffmpeg) lớn nhất đã kết thúc."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux: KB, macOS: bytes
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return (self_rss + child_rss) / unit
+
+
+def log_peak_memory(label: str) -> None:
+    peak = peak_memory_mb()
+    if peak is not None:
+        logger.info(f"[{label}] Peak memory: {peak:.0f} MB")
@@ -1,35 +1,49 @@
 import logging
 from pathlib import Path
 
-from pytubefix import YouTube
-
 from common import PROJECT_DIR, configs
+from downloader import Downloader
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__file__)
+
 
+def get_video(video_url: str, video_path: Path, downloader: Downloader = None,
+              progressive: bool = False) -> Path:
+    """
+    Tải stream độ phân giải cao nhất (có tiếng) của video YouTube về video_path.
+    pytubefix chỉ dùng để lấy link stream; phần tải do Downloader làm (chunk song song,
+    resume, cache theo link gốc + itag vì link stream là link ký tạm thời).
+    progressive: ghi <video_path>.progress để frame.py phân tích trong lúc đang tải.
+    """
+    from pytubefix import YouTube
 
-def get_video(video_url: str, video_path: Path) -> None:
     logger.info(f'Downloading video from URL: "{video_url}"')
 
-    youtubeObject = YouTube(video_url)
-    youtubeObject = youtubeObject.streams.get_highest_resolution()
-    youtubeObject.download(
-        output_path=video_path.parents[0],
-        filename=video_path.name,
+    stream = YouTube(video_url).streams.get_highest_resolution()
+    downloader = downloader or Downloader()
+    downloader.fetch(
+        stream.url,
+        video_path,
+        sha256=configs.get("video_retrieval", {}).get("sha256"),
+        cache_key=f"{video_url}#itag={stream.itag}",
+        progressive=progressive,
     )
 
     logger.info(f'Video saved to: "{video_path}"')
+    return video_path
 
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__file__)
-
-logger.info("\nStarting optional step video retrieval\n")
-
-video_path = Path(configs["video_path"])
+def main():
+    logger.info("\nStarting optional step video retrieval\n")
 
-if not video_path.exists():
+    video_path = Path(configs["video_path"])
     video_path.parent.mkdir(parents=True, exist_ok=True)
-
-if not PROJECT_DIR.exists():
     PROJECT_DIR.mkdir(parents=True, exist_ok=True)
 
-get_video(configs["video_retrieval"]["video_url"], video_path)
+    retrieval_cfg = configs["video_retrieval"]
+    get_video(retrieval_cfg["video_url"], video_path, progressive=bool(retrieval_cfg.get("progressive", False)))
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,8 @@ os.environ.setdefault("MKL_NUM_THREADS", "1")
 
 from TTS.api import TTS
 from common import SUBPLOTS_DIR, VOICES_DIR, configs
+from loudness import measure_file
+from scene_state import SceneState, content_key
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__file__)
@@ -52,14 +54,17 @@ def generate_voice(
         speed=1.12,
     )
 
-def generate_voices(
-    model: TTS,
+def pending_scenes(
+    state: SceneState,
     n_audios: int,
     reference_voice: str,
     language: str,
 ):
-    VOICES_DIR.mkdir(parents=True, exist_ok=True)
-
+    """
+    Các scene cần tạo lại voice: [(scene_dir, scene_text, key)].
+    Scene có subplot + cấu hình voice không đổi (và còn đủ file wav) được giữ nguyên.
+    """
+    pending = []
     for scene_dir in sorted(SUBPLOTS_DIR.glob("scene_*")):
         scene_idx = scene_dir.name
         subplot_file = scene_dir / "subplot.txt"
@@ -69,6 +74,27 @@ def generate_voices(
             continue
 
         scene_text = subplot_file.read_text().strip()
+        # Path -> hash nội dung file giọng mẫu, không chỉ đường dẫn
+        key = content_key(scene_text, configs["voice"]["model_id"], Path(reference_voice), language, n_audios)
+        outputs = [VOICES_DIR / scene_idx / f"audio_{i}.wav" for i in range(1, n_audios + 1)]
+        if state.is_current("voice", scene_idx, key, *outputs):
+            logger.info(f"[VOICE] {scene_idx} unchanged, reusing existing audio")
+            continue
+        pending.append((scene_dir, scene_text, key))
+    return pending
+
+def generate_voices(
+    model: TTS,
+    scenes,
+    state: SceneState,
+    n_audios: int,
+    reference_voice: str,
+    language: str,
+):
+    VOICES_DIR.mkdir(parents=True, exist_ok=True)
+
+    for scene_dir, scene_text, key in scenes:
+        scene_idx = scene_dir.name
         logger.info(f'[VOICE] Generating audio for {scene_idx}')
 
         out_dir = VOICES_DIR / scene_idx
@@ -80,6 +106,9 @@ def generate_voices(
             audio_path = out_dir / f"audio_{i}.wav"
             logger.info(f"[VOICE] Scene {scene_idx} | audio {i}/{n_audios}")
             generate_voice(model, scene_text, audio_path, reference_voice, language)
+            # Đo loudness ngay khi sinh xong, mix sau chỉ đọc audio_i.loudness.json
+            measure_file(audio_path)
+        state.mark("voice", scene_idx, key)
 
         # ---- dọn RAM sau mỗi scene ----
         import gc, torch
@@ -90,16 +119,30 @@ def generate_voices(
             torch.mps.empty_cache()
 
 # --------------------------------------------------
-# Load model (CHỈ 1 LẦN)
+# Load model (CHỈ 1 LẦN, và chỉ khi có scene cần tạo lại)
 # --------------------------------------------------
-logger.info(f"[VOICE] Loading TTS model: {configs['voice']['model_id']}")
-tts = TTS(model_name=configs["voice"]["model_id"]).to(device)
-
-generate_voices(
-    model=tts,
-    n_audios=configs["voice"]["n_audios"],
-    reference_voice=configs["voice"]["reference_voice_path"],
-    language=configs["voice"]["tts_language"],
+voice_cfg = configs["voice"]
+scene_state = SceneState()
+scenes = pending_scenes(
+    scene_state,
+    n_audios=voice_cfg["n_audios"],
+    reference_voice=voice_cfg["reference_voice_path"],
+    language=voice_cfg["tts_language"],
 )
 
-logger.info("\nVoice generation completed successfully.\n")
\ No newline at end of file
+if scenes:
+    logger.info(f"[VOICE] Loading TTS model: {voice_cfg['model_id']}")
+    tts = TTS(model_name=voice_cfg["model_id"]).to(device)
+
+    generate_voices(
+        model=tts,
+        scenes=scenes,
+        state=scene_state,
+        n_audios=voice_cfg["n_audios"],
+        reference_voice=voice_cfg["reference_voice_path"],
+        language=voice_cfg["tts_language"],
+    )
+else:
+    logger.info("[VOICE] All scenes unchanged, nothing to generate.")
+
+logger.info("\nVoice generation completed successfully.\n")
@@ -0,0 +1,111 @@
+import hashlib
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from downloader import Downloader, IntegrityError, RemoteInfo, RequestsTransport, Transport  # noqa: E402
+from file_server import FileServer  # noqa: E402
+
+DATA = bytes(range(256)) * 400 + b"tail"   # 102404 byte, không chia hết cho chunk
+
+
+class FakeTransport(Transport):
+    """Transport trong bộ nhớ; over_send / short / fail_chunks giả lập server lỗi."""
+
+    def __init__(self, data=DATA, ranges=True, over_send=0, short=0, fail_chunks=(), block_size=1000):
+        self.data = data
+        self.ranges = ranges
+        self.over_send = over_send
+        self.short = short
+        self.fail_chunks = set(fail_chunks)
+        self.block_size = block_size
+        self.requests = []
+
+    def probe(self, url):
+        return RemoteInfo(len(self.data), self.ranges, "etag-1")
+
+    def read_range(self, url, start, end=None):
+        self.requests.append((start, end))
+        if start in self.fail_chunks:
+            raise IOError("connection reset")
+        stop = len(self.data) if end is None else end + 1 + self.over_send
+        body = self.data[start:stop - self.short]
+        for i in range(0, len(body), self.block_size):
+            yield body[i:i + self.block_size]
+
+
+class DownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def downloader(self, transport, **kwargs):
+        kwargs.setdefault("workers", 3)
+        kwargs.setdefault("chunk_size", 8192)
+        kwargs.setdefault("retries", 0)
+        return Downloader(transport, cache_dir=self.dir / "cache", **kwargs)
+
+    def test_chunked_download_then_cache_hit(self):
+        transport = FakeTransport()
+        dest = self.downloader(transport).fetch("http://x/video.mp4", self.dir / "out.mp4")
+        self.assertEqual(dest.read_bytes(), DATA)
+        self.assertEqual(len(transport.requests), 13)
+
+        again = FakeTransport()
+        self.downloader(again).fetch("http://x/video.mp4", self.dir / "out2.mp4")
+        self.assertEqual(again.requests, [])
+        self.assertEqual((self.dir / "out2.mp4").read_bytes(), DATA)
+
+    def test_over_sending_server_does_not_overwrite_next_chunk(self):
+        # Server bỏ qua Range end và gửi thừa 5000 byte cho mỗi chunk
+        path = self.downloader(FakeTransport(over_send=5000)).fetch("http://x/video.mp4")
+        self.assertEqual(path.read_bytes(), DATA)
+
+    def test_truncated_chunk_fails(self):
+        with self.assertRaises(IOError):
+            self.downloader(FakeTransport(short=10)).fetch("http://x/video.mp4")
+
+    def test_resume_only_fetches_missing_chunks(self):
+        with self.assertRaises(IOError):
+            self.downloader(FakeTransport(fail_chunks={8192 * 5}), workers=1).fetch("http://x/video.mp4")
+
+        transport = FakeTransport()
+        path = self.downloader(transport, workers=1).fetch("http://x/video.mp4")
+        self.assertEqual(path.read_bytes(), DATA)
+        self.assertNotIn((0, 8191), transport.requests)
+        self.assertIn((8192 * 5, 8192 * 6 - 1), transport.requests)
+
+    def test_sha256_mismatch(self):
+        with self.assertRaises(IntegrityError):
+            self.downloader(FakeTransport()).fetch("http://x/video.mp4", sha256="0" * 64)
+        good = hashlib.sha256(DATA).hexdigest()
+        path = self.downloader(FakeTransport()).fetch("http://x/video.mp4", sha256=good)
+        self.assertEqual(path.read_bytes(), DATA)
+
+    def test_no_range_support_streams_whole_file(self):
+        transport = FakeTransport(ranges=False)
+        path = self.downloader(transport).fetch("http://x/video.mp4")
+        self.assertEqual(path.read_bytes(), DATA)
+        self.assertEqual(transport.requests, [(0, None)])
+
+    def test_local_http_server(self):
+        src = self.dir / "served" / "video.mp4"
+        src.parent.mkdir()
+        src.write_bytes(DATA)
+        server = FileServer([src.parent]).start()
+        try:
+            url = server.url_for(src)
+            path = self.downloader(RequestsTransport(pool_size=3)).fetch(url, self.dir / "out.mp4")
+            self.assertEqual(path.read_bytes(), DATA)
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from file_server import FileServer, parse_range  # noqa: E402
+
+DATA = bytes(range(256)) * 40
+
+
+class FileServerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.project = Path(self.tmp.name) / "project"
+        self.trailers = self.project / "trailers"
+        self.trailers.mkdir(parents=True)
+        (self.trailers / "trailer_1.mp4").write_bytes(DATA)
+        (self.trailers / "notes.txt").write_text("private")
+        (self.project / "configs.yaml").write_text("gemini_api_key: secret")
+        self.video = self.project / "video_input.mp4"
+        self.video.write_bytes(DATA[:100])
+        self.server = FileServer([self.video, self.trailers]).start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def test_range_request(self):
+        url = self.server.url_for(self.trailers / "trailer_1.mp4")
+        r = requests.get(url, headers={"Range": "bytes=10-19"})
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.content, DATA[10:20])
+        self.assertEqual(r.headers["Content-Range"], f"bytes 10-19/{len(DATA)}")
+
+    def test_single_file_root(self):
+        r = requests.get(self.server.url_for(self.video))
+        self.assertEqual(r.content, DATA[:100])
+
+    def test_non_media_and_outside_files_are_not_served(self):
+        with self.assertRaises(ValueError):
+            self.server.url_for(self.trailers / "notes.txt")
+        with self.assertRaises(ValueError):
+            self.server.url_for(self.project / "configs.yaml")
+
+        base = self.server.public_url
+        for path in ("/r1/notes.txt", "/r1/../configs.yaml", "/r1/%2e%2e/configs.yaml", "/r0/../configs.yaml"):
+            self.assertEqual(requests.get(base + path).status_code, 404, path)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range("bytes=0-", 10), (0, 9))
+        self.assertEqual(parse_range("bytes=-4", 10), (6, 9))
+        self.assertEqual(parse_range("bytes=5-100", 10), (5, 9))
+        self.assertIsNone(parse_range("bytes=8-2", 10))
+
+    def test_public_bind_requires_public_url(self):
+        with self.assertRaises(ValueError):
+            FileServer([self.trailers], host="0.0.0.0")
+
+
+if __name__ == "__main__":
+    unittest.main()
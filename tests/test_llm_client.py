@@ -0,0 +1,108 @@
+import asyncio
+import json
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from llm_client import AsyncLLMClient, FakeBackend  # noqa: E402
+from subplot import generate_intro_outro_async, generate_subplots_async, parse_intro_outro  # noqa: E402
+
+PLOT = "A hero wakes up. The city burns. Old friends return. The final battle begins."
+
+
+class SlowOnceBackend(FakeBackend):
+    """Lần gọi đầu treo lâu hơn timeout của client, các lần sau trả lời ngay."""
+
+    async def generate(self, model, prompt, generation_config=None):
+        self.calls += 1
+        if self.calls == 1:
+            await asyncio.sleep(1.0)
+        return self.responder(model, prompt)
+
+
+class LLMClientTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def client(self, backend, **kwargs):
+        kwargs.setdefault("backoff_base", 0.001)
+        kwargs.setdefault("backoff_max", 0.01)
+        return AsyncLLMClient(backend, cache_dir=self.cache_dir, **kwargs)
+
+    def test_backoff_on_rate_limit(self):
+        backend = FakeBackend(rate_limit_failures=2)
+        text = asyncio.run(self.client(backend).generate("hello PLOT: x.", model="m"))
+        self.assertEqual(json.loads(text), ["x."] * 6)
+        self.assertEqual(backend.calls, 3)
+
+    def test_gives_up_after_max_retries(self):
+        backend = FakeBackend(rate_limit_failures=10)
+        with self.assertRaises(RuntimeError):
+            asyncio.run(self.client(backend, max_retries=2).generate("p", model="m"))
+        self.assertEqual(backend.calls, 3)
+
+    def test_retry_on_timeout(self):
+        backend = SlowOnceBackend()
+        asyncio.run(self.client(backend, timeout=0.05).generate("PLOT: a.", model="m"))
+        self.assertEqual(backend.calls, 2)
+
+    def test_response_cache_hit(self):
+        first = FakeBackend()
+        text = asyncio.run(self.client(first).generate("PLOT: a.", model="m"))
+        second = FakeBackend(responder=lambda model, prompt: "different")
+        self.assertEqual(asyncio.run(self.client(second).generate("PLOT: a.", model="m")), text)
+        self.assertEqual(second.calls, 0)
+
+    def test_invalid_response_is_not_cached(self):
+        bad = FakeBackend(responder=lambda model, prompt: "not json")
+        with self.assertRaises(RuntimeError):
+            asyncio.run(self.client(bad).generate("intro", model="m", parse=parse_intro_outro))
+        self.assertEqual(list(self.cache_dir.glob("responses/*.json")), [])
+
+        good = FakeBackend(responder=lambda model, prompt: '{"intro_text": "hi", "outro_text": "bye"}')
+        result = asyncio.run(self.client(good).generate("intro", model="m", parse=parse_intro_outro))
+        self.assertEqual(result["intro_text"], "hi")
+
+    def test_invalid_cached_response_is_regenerated(self):
+        asyncio.run(self.client(FakeBackend(responder=lambda m, p: "not json")).generate("intro", model="m"))
+        good = FakeBackend(responder=lambda model, prompt: '{"intro_text": "hi", "outro_text": "bye"}')
+        result = asyncio.run(self.client(good).generate("intro", model="m", parse=parse_intro_outro))
+        self.assertEqual(result["outro_text"], "bye")
+        self.assertEqual(good.calls, 1)
+
+    def test_model_list_ttl(self):
+        asyncio.run(self.client(FakeBackend(models=["models/a"])).list_models())
+        fresh = asyncio.run(self.client(FakeBackend(models=["models/b"]), model_list_ttl=3600).list_models())
+        self.assertEqual(fresh, ["models/a"])
+        expired = asyncio.run(self.client(FakeBackend(models=["models/b"]), model_list_ttl=0).list_models())
+        self.assertEqual(expired, ["models/b"])
+
+    def test_subplot_and_intro_outro_run_concurrently(self):
+        backend = FakeBackend(latency=0.3)
+        client = self.client(backend, max_concurrency=2, cache_responses=False)
+
+        async def both():
+            return await asyncio.gather(
+                generate_subplots_async(client, PLOT, 4),
+                generate_intro_outro_async(client, PLOT),
+            )
+
+        start = time.perf_counter()
+        subplots, intro_outro = asyncio.run(both())
+        elapsed = time.perf_counter() - start
+        self.assertEqual(len(subplots), 4)
+        self.assertIn("intro_text", intro_outro)
+        self.assertEqual(backend.calls, 2)
+        self.assertLess(elapsed, 0.55)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from vector_index import ExactIndex, IVFIndex, load_index, open_or_create_index, sync_index  # noqa: E402
+
+
+def clustered(n, dim=16, n_clusters=8, seed=0):
+    """Vector giả có cấu trúc cụm."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    return centers[rng.integers(0, n_clusters, n)] + 0.2 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+class VectorIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name) / "index"
+        self.data = clustered(600)
+        self.queries = self.data[:5] + 0.01
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_exact_search_matches_brute_force(self):
+        index = ExactIndex(16)
+        index.add(self.data[:300], range(300))
+        index.add(self.data[300:], range(300, 600))
+        scores, ids = index.search(self.queries, 4)
+
+        unit = self.data / np.linalg.norm(self.data, axis=1, keepdims=True)
+        q = self.queries / np.linalg.norm(self.queries, axis=1, keepdims=True)
+        truth = np.argsort(-(q @ unit.T), axis=1)[:, :4]
+        np.testing.assert_array_equal(ids, truth)
+        self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+
+    def test_exact_score_rows_covers_every_row(self):
+        index = ExactIndex(16)
+        index.add(self.data, range(600))
+        rows = index.score_rows(self.queries, 600)
+        self.assertEqual(rows.shape, (5, 600))
+        self.assertTrue(np.isfinite(rows).all())
+        scores, ids = index.search(self.queries, 3)
+        np.testing.assert_allclose(np.take_along_axis(rows, ids, axis=1), scores, rtol=1e-5)
+
+    def test_ivf_trains_and_scores_only_probed_rows(self):
+        index = IVFIndex(16, n_lists=8, n_probe=2, min_train_per_list=10)
+        index.add(self.data, range(600))
+        self.assertTrue(index.is_trained)
+
+        rows = index.score_rows(self.queries, 600)
+        scored = np.isfinite(rows)
+        self.assertTrue(scored.any(axis=1).all())
+        self.assertLess(scored.sum(), rows.size)
+
+        # Hàng xóm gần nhất của query nằm gần chính vector sinh ra nó
+        _, ids = index.search(self.queries, 1)
+        np.testing.assert_array_equal(ids[:, 0], np.arange(5))
+        for qi, i in enumerate(ids[:, 0]):
+            self.assertTrue(scored[qi, i])
+
+    def test_ivf_untrained_falls_back_to_exact(self):
+        index = IVFIndex(16, n_lists=64)
+        index.add(self.data[:50], range(50))
+        self.assertFalse(index.is_trained)
+        self.assertTrue(np.isfinite(index.score_rows(self.queries, 50)).all())
+
+    def test_save_and_load(self):
+        for index in (ExactIndex(16), IVFIndex(16, n_lists=8, n_probe=3, min_train_per_list=10)):
+            index.add(self.data, range(600))
+            index.save(self.dir / index.kind)
+            loaded = load_index(self.dir / index.kind)
+            self.assertIs(type(loaded), type(index))
+            self.assertEqual(loaded._params(), index._params())
+            np.testing.assert_array_equal(loaded.search(self.queries, 5)[1], index.search(self.queries, 5)[1])
+
+    def test_open_or_create_rebuilds_on_changed_params(self):
+        index = IVFIndex(16, n_lists=8, n_probe=2, min_train_per_list=10)
+        index.add(self.data, range(600))
+        index.save(self.dir)
+        self.assertEqual(len(open_or_create_index(self.dir, "ivf", 16, n_lists=8, n_probe=2, min_train_per_list=10)), 600)
+        self.assertEqual(len(open_or_create_index(self.dir, "ivf", 16, n_lists=8, n_probe=4, min_train_per_list=10)), 0)
+        self.assertEqual(len(open_or_create_index(self.dir, "exact", 16)), 0)
+
+
+class SyncIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name) / "index"
+        self.data = clustered(40)
+        self.keys = [f"frame_{i}.jpg:{i}" for i in range(40)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_adds_only_new_rows(self):
+        _, added = sync_index(self.dir, self.data[:30], self.keys[:30], "exact", tag="clip")
+        self.assertEqual(added, 30)
+        index, added = sync_index(self.dir, self.data, self.keys, "exact", tag="clip")
+        self.assertEqual((len(index), added), (40, 10))
+        self.assertEqual(json.loads((self.dir / "rows.json").read_text())["keys"], self.keys)
+
+        _, added = sync_index(self.dir, self.data, self.keys, "exact", tag="clip")
+        self.assertEqual(added, 0)
+
+    def test_rebuilds_when_old_rows_change(self):
+        sync_index(self.dir, self.data[:30], self.keys[:30], "exact", tag="clip")
+        keys = list(self.keys)
+        keys[3] = "frame_3.jpg:changed"
+        index, added = sync_index(self.dir, self.data, keys, "exact", tag="clip")
+        self.assertEqual((len(index), added), (40, 40))
+
+    def test_rebuilds_when_tag_changes(self):
+        sync_index(self.dir, self.data, self.keys, "exact", tag="clip")
+        index, added = sync_index(self.dir, self.data, self.keys, "exact", tag="onnx")
+        self.assertEqual((len(index), added), (40, 40))
+
+    def test_rebuilds_when_rows_shrink(self):
+        sync_index(self.dir, self.data, self.keys, "exact", tag="clip")
+        index, added = sync_index(self.dir, self.data[:20], self.keys[:20], "exact", tag="clip")
+        self.assertEqual((len(index), added), (20, 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
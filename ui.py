@@ -3,7 +3,7 @@ from pathlib import Path
 import subprocess
 import sys
 import os
-import signal
+import html
 import time
 import shutil
 
@@ -14,11 +14,6 @@ try:
 except ImportError:
     pass
 
-try:
-    from pytubefix import YouTube
-except ImportError:
-    st.error("Thiếu thư viện. Hãy chạy: pip install pytubefix")
-
 # --- 1. CONFIG & THEME ---
 st.set_page_config(
     page_title="AI TRAILER STUDIO",
@@ -65,7 +60,7 @@ st.markdown("""
 
     /* 4. BUTTONS (BLUE #03346E) */
 /* 4. BUTTONS & DOWNLOAD BUTTONS (FIXED) */
-    div.stButton > button, div.stDownloadButton > button {
+    div.stButton > button, div.stDownloadButton > button, div.stLinkButton > a {
         background-color: #03346E !important;
         color: #FFFFFF !important;
         border: none !important;
@@ -78,7 +73,7 @@ st.markdown("""
         width: 100%;
     }
     
-    div.stButton > button:hover, div.stDownloadButton > button:hover {
+    div.stButton > button:hover, div.stDownloadButton > button:hover, div.stLinkButton > a:hover {
         background-color: #0553a0 !important;
         opacity: 0.9;
     }
@@ -151,6 +146,15 @@ TRAILERS = PROJECT / "trailers"
 CHECKPOINT_DIR = PROJECT / ".checkpoints"
 PYTHON = sys.executable
 
+# Module trong src/ (file server, preview) dùng trực tiếp trong UI
+sys.path.insert(0, str(ROOT / "src"))
+from common import configs
+from file_server import FileServer
+from preview import PREVIEW_CACHE_DIR, build_preview
+from pipeline_events import EVENTS_PATH, RUNNER_LOG_PATH, EventReader, clear_pause, request_pause
+from video_retrieval import get_video
+from plot_igdb import IGDBClient
+
 #IGDB token hard-coded for demo purposes only
 
 IGDB_CLIENT_ID = "dmz1ufs9byvwf027un57323nfv9fa6"
@@ -158,9 +162,14 @@ IGDB_ACCESS_TOKEN = "h730k3leqtsztmen0vfd6rww4ezako"
 # --- 3. STATE ---
 if 'page' not in st.session_state: st.session_state.page = 'input'
 if 'logs' not in st.session_state: st.session_state.logs = [] 
-if 'pid' not in st.session_state: st.session_state.pid = None
+if 'job' not in st.session_state: st.session_state.job = None          # Popen của trailer_generator chạy nền
+if 'fresh_run' not in st.session_state: st.session_state.fresh_run = False
+if 'pausing' not in st.session_state: st.session_state.pausing = False
+if 'failed' not in st.session_state: st.session_state.failed = False
+if 'event_reader' not in st.session_state: st.session_state.event_reader = EventReader()
 if 'is_running' not in st.session_state: st.session_state.is_running = False
 if 'generation_done' not in st.session_state: st.session_state.generation_done = False
+if 'pipeline_args' not in st.session_state: st.session_state.pipeline_args = []
 
 if "plot_mode" not in st.session_state: st.session_state.plot_mode = "Manual"
 if "plot_text" not in st.session_state:
@@ -170,12 +179,120 @@ if "plot_text" not in st.session_state:
 def clean_workspace():
     paths = [PROJECT / "subplots", PROJECT / "frames", PROJECT / "frames_ranking", 
              PROJECT / "voices", PROJECT / "clips", PROJECT / "audio_clips", 
-             PROJECT / "retrieved_plot.txt", PROJECT / "plot.txt", CHECKPOINT_DIR]
+             PROJECT / "retrieved_plot.txt", PROJECT / "plot.txt", PROJECT / "intro_outro.json",
+             PROJECT / ".scene_state.json", CHECKPOINT_DIR]
     for p in paths:
         if p.exists():
             try: shutil.rmtree(p) if p.is_dir() else p.unlink()
             except: pass
 
+def load_subplots() -> dict:
+    """{scene_name: subplot text} theo thứ tự scene_1, scene_2, ..."""
+    scenes = [d for d in (PROJECT / "subplots").glob("scene_*") if (d / "subplot.txt").exists()]
+    scenes.sort(key=lambda d: int(d.name.split("_")[1]))
+    return {d.name: (d / "subplot.txt").read_text(encoding="utf-8").strip() for d in scenes}
+
+def rerender_changed_scenes(edited: dict) -> list:
+    """
+    Ghi các subplot đã sửa rồi chạy lại pipeline từ các bước đọc subplot (rank, voice).
+    voice / clip / mix tự bỏ qua scene không đổi, join dùng lại clip cũ.
+    """
+    current = load_subplots()
+    changed = [name for name, text in edited.items() if text.strip() != current.get(name, "")]
+    for name in changed:
+        (PROJECT / "subplots" / name / "subplot.txt").write_text(edited[name].strip(), encoding="utf-8")
+    if changed:
+        st.session_state.pipeline_args = ["--from-step", "rank,voice"]
+        st.session_state.fresh_run = True
+        st.session_state.failed = False
+        st.session_state.is_running = True
+        st.session_state.generation_done = False
+        st.session_state.logs = []
+    return changed
+
+@st.cache_resource
+def get_file_server() -> FileServer:
+    """
+    Một HTTP server (Range request) cho cả tiến trình Streamlit: video được trình duyệt
+    đọc thẳng từ đĩa theo từng đoạn thay vì đẩy cả file qua session ở mỗi lần rerun.
+    Chỉ mở video input, thư mục trailer và preview, không phải cả thư mục project.
+    """
+    ui_cfg = configs.get("ui", {})
+    return FileServer(
+        [VIDEO_PATH, TRAILERS, PREVIEW_CACHE_DIR],
+        host=ui_cfg.get("file_server_host", "127.0.0.1"),
+        port=int(ui_cfg.get("file_server_port", 8765)),
+        public_url=ui_cfg.get("file_server_public_url", ""),
+    ).start()
+
+def served_url(path: Path, download: bool = False) -> str:
+    """URL của file trên file server, kèm mtime để trình duyệt không dùng bản cache cũ."""
+    url = get_file_server().url_for(path, download=download)
+    sep = "&" if "?" in url else "?"
+    return f"{url}{sep}v={int(path.stat().st_mtime)}"
+
+# Chỉ giữ / vẽ phần cuối log: mỗi lần poll tốn O(LOG_TAIL), không phụ thuộc độ dài log
+LOG_TAIL = 200
+ALLOWED = ["---", "STEP", "Phase", "RUNNING", "SKIPPED", "DONE", "FAILED", "FINISHED", "ERROR",
+           "Trailer created", "Rendering", "Scene", "Saved", "Generating", "AI Selected", "Mixed", "Detecting", "Retrieving", "Loading", "Collected", "Joining",
+           "Invalidated", "Unchanged", "unchanged"]
+
+def start_pipeline_job():
+    """Chạy trailer_generator.py nền (không chặn script Streamlit), output thô vào .runner.log."""
+    if st.session_state.fresh_run:
+        EVENTS_PATH.unlink(missing_ok=True)
+        st.session_state.event_reader = EventReader()
+        st.session_state.fresh_run = False
+    clear_pause()
+    cmd = [PYTHON, "src/trailer_generator.py"] + st.session_state.pipeline_args
+    RUNNER_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(RUNNER_LOG_PATH, "a", encoding="utf-8") as log:
+        st.session_state.job = subprocess.Popen(
+            cmd, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT, start_new_session=True
+        )
+    # Marker đã được xoá lúc khởi động, RESUME sau đó không xoá lại
+    st.session_state.pipeline_args = []
+
+def apply_pipeline_events():
+    """Đọc sự kiện mới (từ offset lần trước) và cập nhật trạng thái + log."""
+    # Kiểm tra job đã thoát TRƯỚC khi đọc, để không bỏ sót sự kiện cuối cùng nó ghi
+    job = st.session_state.job
+    exited = job is not None and job.poll() is not None
+
+    logs = st.session_state.logs
+    for ev in st.session_state.event_reader.poll():
+        kind = ev["event"]
+        if kind == "log":
+            if any(m in ev["line"] for m in ALLOWED):
+                logs.append(ev["line"])
+        elif kind == "steps_invalidated":
+            logs.extend(f"Invalidated: {name}" for name in ev["names"])
+        elif kind in ("step_started", "step_done", "step_skipped"):
+            label = {"step_started": "RUNNING", "step_done": "DONE", "step_skipped": "SKIPPED"}[kind]
+            logs.append(f"[STEP {ev['index']}/{ev['total']}] {label}: {ev['name']}")
+        elif kind == "step_failed":
+            logs.append(f"FAILED at {ev['name']}")
+        elif kind == "pipeline_paused":
+            logs.append("--- PIPELINE PAUSED ---")
+            st.session_state.is_running = False
+            st.session_state.pausing = False
+        elif kind == "pipeline_failed":
+            st.session_state.is_running = False
+            st.session_state.failed = True
+        elif kind == "pipeline_finished":
+            logs.append("--- PIPELINE FINISHED SUCCESSFULLY ---")
+            st.session_state.is_running = False
+            st.session_state.generation_done = True
+    st.session_state.logs = logs[-LOG_TAIL:]
+
+    if exited:
+        st.session_state.job = None
+        # Tiến trình chết mà không kịp ghi sự kiện kết thúc (crash / bị kill)
+        if st.session_state.is_running:
+            st.session_state.is_running = False
+            st.session_state.failed = job.returncode != 0
+            st.session_state.pausing = False
+
 def go_to_processing():
     st.session_state.page = 'processing'
     st.rerun()
@@ -185,14 +302,20 @@ def go_to_input():
     st.session_state.logs = []
     st.session_state.generation_done = False
     st.session_state.is_running = False
+    st.session_state.failed = False
     st.rerun()
 def save_plot_to_file(text: str):
     PROJECT.mkdir(parents=True, exist_ok=True)
     PLOT_PATH.write_text(text or "", encoding="utf-8")
 
+@st.cache_resource
+def get_igdb_client(client_id: str, access_token: str) -> IGDBClient:
+    """1 client cho mỗi bộ credential: session (kết nối) + rate limiter dùng lại qua các lần rerun."""
+    return IGDBClient(client_id, access_token)
+
 def run_igdb_plot_fetch(game_name: str, client_id: str, access_token: str) -> tuple[bool, str]:
     """
-    Call src/plot_igdb.py to fetch plot and write into PLOT_PATH.
+    Fetch plot from IGDB (in-process, cached on disk) and write into PLOT_PATH.
     Returns: (ok, message)
     """
     if not game_name.strip():
@@ -200,24 +323,16 @@ def run_igdb_plot_fetch(game_name: str, client_id: str, access_token: str) -> tu
     if not client_id.strip() or not access_token.strip():
         return (False, "Missing IGDB credentials (Client ID / Access Token).")
 
-    
-    #   --game "<name>" --out "<path>" --client-id "<id>" --token "<token>"
-    cmd = [
-        PYTHON, "src/plot_igdb.py",
-        "--game", game_name.strip(),
-        "--out", str(PLOT_PATH),
-        "--client-id", client_id.strip(),
-        "--token", access_token.strip()
-    ]
-
     try:
-        res = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
-        out = (res.stdout or "") + "\n" + (res.stderr or "")
-        if res.returncode != 0:
-            return (False, f"plot_igdb.py failed.\n{out.strip()}")
-        return (True, out.strip() if out.strip() else "Fetched plot successfully.")
+        plot_text, best_obj = get_igdb_client(client_id.strip(), access_token.strip()).fetch_plot(game_name.strip())
     except Exception as e:
-        return (False, f"Error running plot_igdb.py: {e}")
+        return (False, f"IGDB fetch failed: {e}")
+
+    save_plot_to_file(plot_text.strip() + "\n")
+    preview = plot_text.strip().replace("\n", " ")
+    if len(preview) > 240:
+        preview = preview[:240] + "..."
+    return (True, f"[IGDB] Selected: {best_obj.get('name', 'Unknown')}\n[IGDB] Preview: {preview}")
     
 # ==========================================
 # PAGE 1: INPUT DASHBOARD
@@ -250,16 +365,16 @@ def render_input_page():
                             with st.spinner("Fetching..."):
                                 try:
                                     PROJECT.mkdir(parents=True, exist_ok=True)
-                                    yt = YouTube(yt_url)
-                                    stream = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
-                                    stream.download(output_path=str(PROJECT), filename="video_input.mp4")
+                                    # Cache theo URL + resume: lấy lại URL cũ gần như tức thì
+                                    get_video(yt_url, VIDEO_PATH)
                                     st.rerun()
+                                except ImportError: st.error("Thiếu thư viện. Hãy chạy: pip install pytubefix")
                                 except Exception as e: st.error(str(e))
 
         # Video Preview 
         if VIDEO_PATH.exists():
             st.write("")
-            st.video(VIDEO_PATH.read_bytes())
+            st.video(served_url(VIDEO_PATH))
         else:
             st.info("Please upload a video to start.")
 
@@ -348,6 +463,8 @@ def render_input_page():
 
                         clean_workspace()
 
+                        st.session_state.fresh_run = True
+                        st.session_state.failed = False
                         st.session_state.is_running = True
                         st.session_state.logs = []
                         st.session_state.generation_done = False
@@ -358,59 +475,43 @@ def render_input_page():
 def render_processing_page():
     st.markdown('<div class="hero-text">AI TRAILER GENERATOR</div>', unsafe_allow_html=True)
     
+    # Runner: khởi chạy job nền nếu cần, rồi đọc các sự kiện mới
+    if st.session_state.is_running and st.session_state.job is None:
+        start_pipeline_job()
+    apply_pipeline_events()
+
     # Status Bar
     c_stat, c_ctrl = st.columns([6, 2])
     with c_stat:
         if st.session_state.generation_done: st.success("PIPELINE COMPLETED")
+        elif st.session_state.failed: st.error("PIPELINE FAILED")
+        elif st.session_state.pausing: st.info("PAUSING AFTER THE CURRENT STEP...")
         elif st.session_state.is_running: st.info("PROCESSING IN PROGRESS...")
         else: st.warning("PAUSED")
     with c_ctrl:
         if st.session_state.is_running and not st.session_state.generation_done:
-            if st.button("PAUSE"):
-                if st.session_state.pid:
-                    try: os.kill(st.session_state.pid, signal.SIGTERM)
-                    except: pass
-                st.session_state.is_running = False
-                st.session_state.pid = None
+            # Pause ở ranh giới bước: bước đang chạy được làm xong và lưu checkpoint
+            if st.button("PAUSE", disabled=st.session_state.pausing):
+                request_pause()
+                st.session_state.pausing = True
                 st.rerun()
-        elif not st.session_state.generation_done:
+        elif not st.session_state.generation_done and st.session_state.job is None:
             if st.button("RESUME"):
                 st.session_state.is_running = True
+                st.session_state.failed = False
                 st.rerun()
     
-    # Terminal Log
+    # Terminal Log (chỉ phần cuối)
     with st.container(border=True):
         st.markdown("### SYSTEM LOGS")
-        log_box = st.empty()
         if st.session_state.logs:
-            log_box.markdown(f'<div class="terminal-box">{"<br>".join(st.session_state.logs)}</div>', unsafe_allow_html=True)
+            body = "<br>".join(html.escape(line) for line in st.session_state.logs)
+            st.markdown(
+                f'<div class="terminal-box" id="term">{body}<script>var d=document.getElementById("term");d.scrollTop=d.scrollHeight;</script></div>',
+                unsafe_allow_html=True,
+            )
         else:
-            log_box.markdown('<div class="terminal-box">Initializing...</div>', unsafe_allow_html=True)
-
-    # Runner
-    if st.session_state.is_running and not st.session_state.generation_done:
-        process = subprocess.Popen([PYTHON, "src/trailer_generator.py"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, cwd=ROOT)
-        st.session_state.pid = process.pid
-        
-        ALLOWED = ["---", "STEP", "Phase", "RUNNING", "SKIPPED", "DONE", "FAILED", "FINISHED", "ERROR",
-                   "Trailer created", "Rendering", "Scene", "Saved", "Generating", "AI Selected", "Mixed", "Detecting", "Retrieving", "Loading", "Collected", "Joining"]
-
-        while True:
-            line = process.stdout.readline()
-            if not line and process.poll() is not None: break
-            if line:
-                clean = line.strip()
-                if not clean: continue
-                if any(m in clean for m in ALLOWED):
-                    st.session_state.logs.append(clean)
-                    js = f"""<div class="terminal-box" id="term">{"<br>".join(st.session_state.logs)}<script>var d=document.getElementById("term");d.scrollTop=d.scrollHeight;</script></div>"""
-                    log_box.markdown(js, unsafe_allow_html=True)
-        
-        st.session_state.is_running = False
-        st.session_state.pid = None
-        if process.returncode == 0:
-            st.session_state.generation_done = True
-            st.rerun()
+            st.markdown('<div class="terminal-box">Initializing...</div>', unsafe_allow_html=True)
 
     # Result 
     if st.session_state.generation_done:
@@ -420,18 +521,53 @@ def render_processing_page():
             if files:
                 latest = files[-1]
                 c1, c2 = st.columns([2, 1])
-                with c1: st.video(latest.read_bytes())
+                with c1:
+                    # Xem bản preview nhỏ (cache theo hash trailer), tải bản gốc qua file server
+                    with st.spinner("Preparing preview..."):
+                        preview = build_preview(latest)
+                    st.video(served_url(preview))
                 with c2:
                     with st.container(border=True):
                         st.markdown("### RESULT")
                         st.write(f"`{latest.name}`")
-                        with open(latest, "rb") as f:
-                            st.download_button("DOWNLOAD MP4", f, file_name=latest.name, mime="video/mp4")
+                        st.link_button("DOWNLOAD MP4", served_url(latest, download=True))
                         st.write("")
                         if st.button("START NEW PROJECT"): 
                             st.session_state.plot_text = ""
                             go_to_input()
+
+        # Sửa narration của từng scene, chỉ render lại scene bị sửa
+        subplots = load_subplots()
+        if subplots:
+            with st.container(border=True):
+                st.markdown("### EDIT SCENES")
+                edited = {
+                    name: st.text_area(name.replace("_", " ").upper(), value=text, height=100, key=f"edit_{name}")
+                    for name, text in subplots.items()
+                }
+                if st.button("RE-RENDER CHANGED SCENES"):
+                    changed = rerender_changed_scenes(edited)
+                    if changed:
+                        st.toast(f"Re-rendering: {', '.join(changed)}")
+                        st.rerun()
+                    else:
+                        st.info("No scene changed.")
                     
+def schedule_poll():
+    """Job còn chạy -> rerun sau 1s để đọc tiếp sự kiện (không chặn trong vòng readline)."""
+    if st.session_state.page == 'processing' and st.session_state.job is not None:
+        time.sleep(1.0)
+        st.rerun()
+
+# File server khởi động ngay từ đầu: cấu hình ui.* sai thì báo lỗi trước khi chạy pipeline
+try:
+    get_file_server()
+except ValueError as e:
+    st.error(str(e))
+    st.stop()
+
 # MAIN ROUTER
 if st.session_state.page == 'input': render_input_page()
-elif st.session_state.page == 'processing': render_processing_page()
+elif st.session_state.page == 'processing':
+    render_processing_page()
+    schedule_poll()